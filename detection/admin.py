@@ -1,3 +1,13 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import Detection
+
+
+@admin.register(Detection)
+class DetectionAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'result', 'confidence_score', 'flagged', 'created_at')
+    list_filter = ('flagged', 'disease_class__crop')
+    search_fields = ('user__username', 'disease_class__label')
+    # `result` is the label of the class, which is set when the row is stored
+    readonly_fields = ('user', 'result', 'disease_class', 'created_at', 'model_version', 'inference_stage')
+    list_select_related = ('user', 'disease_class')
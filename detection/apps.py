@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class DetectionConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'detection'
+
+    def ready(self):
+        # Only serving processes opt in; management commands keep a fast startup
+        if getattr(settings, 'PREDICTION_PRELOAD_MODEL', False):
+            from .utils.onnx_predictor import preload_model
+            preload_model()
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from detection.models import ModelVersion
+from .register_model import activate
+
+
+class Command(BaseCommand):
+    help = "Activate (or roll back to) a registered ModelVersion on every worker."
+
+    def add_arguments(self, parser):
+        parser.add_argument('version', nargs='?', help="Version to activate. Omit to list registered versions.")
+
+    def handle(self, *args, **options):
+        if not options['version']:
+            for row in ModelVersion.objects.order_by('-created_at'):
+                self.stdout.write(f"{'*' if row.is_active else ' '} {row.version}\t{row.model_path}")
+            return
+
+        try:
+            row = ModelVersion.objects.get(version=options['version'])
+        except ModelVersion.DoesNotExist:
+            raise CommandError(f"Unknown model version: {options['version']}")
+
+        with transaction.atomic():
+            activate(row)
+        self.stdout.write(self.style.SUCCESS(f"Activated model {row.version}"))
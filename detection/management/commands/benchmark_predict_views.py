@@ -0,0 +1,262 @@
+import asyncio
+import io
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.utils import timezone
+from PIL import Image
+from rest_framework_simplejwt.tokens import AccessToken
+
+from detection.models import Detection
+from detection.utils.derivatives import wait_for_pending
+
+MODES = {
+    # mode: (entry point, URL path)
+    'wsgi-sync': ('wsgi', '/api/predict/'),
+    'asgi-sync': ('asgi', '/api/predict/'),
+    'asgi-async': ('asgi', '/api/predict/async/'),
+}
+
+
+def _random_jpeg(rng, size) -> bytes:
+    # Noise, so the prediction cache never answers for the benchmark
+    pixels = rng.integers(0, 256, size=(size[1], size[0], 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def _multipart_body(rng, images: int, size) -> bytes:
+    files = [SimpleUploadedFile(f'bench{i}.jpg', _random_jpeg(rng, size), 'image/jpeg') for i in range(images)]
+    return encode_multipart(BOUNDARY, {'images': files})
+
+
+def _split(body: bytes, chunks: int) -> list:
+    step = max(1, -(-len(body) // chunks))
+    return [body[i:i + step] for i in range(0, len(body), step)]
+
+
+class _ThreadSampler:
+    """
+    Samples the process's thread count while a mode runs.
+    """
+
+    def __init__(self):
+        self.peak = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(0.01):
+            self.peak = max(self.peak, threading.active_count())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+class _SlowInput:
+    """
+    wsgi.input that hands the body out in chunks spread over `seconds`, like a
+    phone on a slow uplink. The WSGI thread is blocked while it waits.
+    """
+
+    def __init__(self, body: bytes, chunks: int, seconds: float):
+        self._pieces = _split(body, chunks)
+        self._delay = seconds / max(1, len(self._pieces))
+        self._buffer = b''
+
+    def read(self, size=-1):
+        if not self._buffer and self._pieces:
+            time.sleep(self._delay)
+            self._buffer = self._pieces.pop(0)
+        if size is None or size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def readline(self, size=-1):
+        return self.read(size)
+
+
+def _wsgi_request(app, path, body, headers, chunks, seconds):
+    environ = {
+        'REQUEST_METHOD': 'POST', 'PATH_INFO': path, 'SCRIPT_NAME': '', 'QUERY_STRING': '',
+        'SERVER_NAME': headers['host'], 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1', 'REMOTE_ADDR': '127.0.0.1',
+        'HTTP_HOST': headers['host'], 'HTTP_AUTHORIZATION': headers['authorization'],
+        'CONTENT_TYPE': MULTIPART_CONTENT, 'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': _SlowInput(body, chunks, seconds), 'wsgi.errors': sys.stderr, 'wsgi.url_scheme': 'http',
+        'wsgi.version': (1, 0), 'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+    }
+    response = {}
+
+    def start_response(status, response_headers, exc_info=None):
+        response['status'] = int(status.split()[0])
+
+    result = app(environ, start_response)
+    try:
+        for _ in result:
+            pass
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return response.get('status')
+
+
+def _run_wsgi(path, requests, chunks, seconds, threads):
+    from django.core.wsgi import get_wsgi_application
+
+    app = get_wsgi_application()
+    started = time.perf_counter()
+    latencies, statuses = [], []
+    lock = threading.Lock()
+
+    def one(request):
+        body, headers = request
+        status = _wsgi_request(app, path, body, headers, chunks, seconds)
+        with lock:
+            latencies.append(time.perf_counter() - started)
+            statuses.append(status)
+
+    # Every client connects at once; requests beyond `threads` queue for a worker thread
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(one, requests))
+    return latencies, statuses, time.perf_counter() - started
+
+
+async def _asgi_request(app, path, body, headers, chunks, seconds):
+    pieces = _split(body, chunks)
+    delay = seconds / max(1, len(pieces))
+    response = {}
+
+    async def receive():
+        if pieces:
+            await asyncio.sleep(delay)
+            piece = pieces.pop(0)
+            return {'type': 'http.request', 'body': piece, 'more_body': bool(pieces)}
+        # The client stays connected until the response is sent
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'scheme': 'http',
+        'method': 'POST', 'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+        'headers': [
+            (b'host', headers['host'].encode()),
+            (b'authorization', headers['authorization'].encode()),
+            (b'content-type', MULTIPART_CONTENT.encode()),
+            (b'content-length', str(len(body)).encode()),
+        ],
+        'client': ('127.0.0.1', 0), 'server': (headers['host'], 80),
+    }
+    await app(scope, receive, send)
+    return response.get('status')
+
+
+def _run_asgi(path, requests, chunks, seconds):
+    from django.core.asgi import get_asgi_application
+
+    app = get_asgi_application()
+
+    async def run_all():
+        started = time.perf_counter()
+        latencies, statuses = [], []
+
+        async def one(body, headers):
+            status = await _asgi_request(app, path, body, headers, chunks, seconds)
+            latencies.append(time.perf_counter() - started)
+            statuses.append(status)
+
+        await asyncio.gather(*(one(body, headers) for body, headers in requests))
+        return latencies, statuses, time.perf_counter() - started
+
+    return asyncio.run(run_all())
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the sync predict view (under WSGI and ASGI) with the async one (under ASGI) "
+        "for many concurrent clients that upload slowly. Requests go straight to the WSGI/ASGI "
+        "application objects in this process, so no server is needed. Detections written by "
+        "the benchmark users are deleted afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modes', default=','.join(MODES), help=f"Comma separated modes to run: {', '.join(MODES)}.")
+        parser.add_argument('--requests', type=int, default=32, help="Concurrent clients, all connecting at once.")
+        parser.add_argument('--images', type=int, default=1, help="Images per request.")
+        parser.add_argument('--image-size', default='1280x960', help="WIDTHxHEIGHT of the generated JPEGs.")
+        parser.add_argument('--upload-seconds', type=float, default=1.0, help="How long each client takes to send its body.")
+        parser.add_argument('--chunks', type=int, default=10, help="Number of pieces the body is sent in.")
+        parser.add_argument('--wsgi-threads', type=int, default=8, help="Worker threads for wsgi-sync (like gunicorn --threads).")
+        parser.add_argument('--username', default='predict-benchmark', help="Prefix of the users the requests authenticate as, one per client so the per-user concurrency limit does not apply (created if missing).")
+        parser.add_argument('--host', default=None, help="Host header (default: first non-wildcard ALLOWED_HOSTS entry, or localhost).")
+
+    def handle(self, *args, **options):
+        modes = [m.strip() for m in options['modes'].split(',') if m.strip()]
+        unknown = set(modes) - set(MODES)
+        if unknown:
+            raise CommandError(f"Unknown modes: {', '.join(sorted(unknown))}")
+        try:
+            width, height = (int(v) for v in options['image_size'].lower().split('x'))
+        except ValueError:
+            raise CommandError("--image-size must look like 1280x960")
+
+        # Each client is a different user, like many phones uploading at once
+        users = [
+            User.objects.get_or_create(username=f"{options['username']}-{i}")[0]
+            for i in range(options['requests'])
+        ]
+        host = options['host'] or next((h.lstrip('.') for h in settings.ALLOWED_HOSTS if h != '*'), 'localhost')
+        headers = [{'host': host, 'authorization': f'Bearer {AccessToken.for_user(user)}'} for user in users]
+
+        rng = np.random.default_rng(0)
+        started_at = timezone.now()
+        self.stdout.write(
+            f"{options['requests']} clients x {options['images']} image(s) of {width}x{height}, "
+            f"each upload spread over {options['upload_seconds']}s"
+        )
+        self.stdout.write(f"{'mode':>10} {'ok':>7} {'wall s':>8} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} {'threads':>7}")
+
+        try:
+            for mode in modes:
+                entry_point, path = MODES[mode]
+                requests = [(_multipart_body(rng, options['images'], (width, height)), h) for h in headers]
+                with _ThreadSampler() as sampler:
+                    if entry_point == 'wsgi':
+                        latencies, statuses, wall = _run_wsgi(
+                            path, requests, options['chunks'], options['upload_seconds'], options['wsgi_threads'],
+                        )
+                    else:
+                        latencies, statuses, wall = _run_asgi(
+                            path, requests, options['chunks'], options['upload_seconds'],
+                        )
+                latencies.sort()
+                ok = sum(status == 200 for status in statuses)
+                self.stdout.write(
+                    f"{mode:>10} {f'{ok}/{len(statuses)}':>7} {wall:>8.2f} {len(statuses) / wall:>7.1f} "
+                    f"{latencies[len(latencies) // 2] * 1000:>8.0f} "
+                    f"{latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000:>8.0f} "
+                    f"{latencies[-1] * 1000:>8.0f} {sampler.peak:>7}"
+                )
+        finally:
+            wait_for_pending()
+            for detection in Detection.objects.filter(user__in=users, created_at__gte=started_at):
+                detection.image.delete(save=False)
+                detection.thumbnail.delete(save=False)
+                detection.delete()
@@ -0,0 +1,163 @@
+import multiprocessing
+import os
+import queue
+import time
+from collections import defaultdict
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from detection.utils.model_registry import create_session, quantized_path, read_manifest
+from detection.utils.onnx_predictor import LABELS, preprocess_image
+from .quantize_model import iter_image_paths
+
+
+def _rss_bytes() -> int:
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _score_model(model_path, image_paths, results):
+    """
+    Runs in a child process so each model's memory is measured from a clean start.
+    Images are decoded one at a time as they are scored, so only the session and a
+    single tensor are resident, and predictions are named with the model's own labels.
+    """
+    labels = read_manifest(model_path, LABELS).labels
+    with open(image_paths[0], 'rb') as f:
+        warmup = preprocess_image(f)
+
+    rss_before = _rss_bytes()
+    session = create_session(model_path)
+    input_name = session.get_inputs()[0].name
+    session.run(None, {input_name: warmup})
+    rss_loaded = _rss_bytes()
+
+    predictions, latencies = [], []
+    for path in image_paths:
+        with open(path, 'rb') as f:
+            tensor = preprocess_image(f)
+        started = time.perf_counter()
+        probabilities = session.run(None, {input_name: tensor})[0][0]
+        latencies.append(time.perf_counter() - started)
+        index = int(np.argmax(probabilities))
+        predictions.append(labels[index] if index < len(labels) else None)
+
+    results.put({
+        'predictions': predictions,
+        'labels': labels,
+        'latencies': latencies,
+        'rss_bytes': rss_loaded - rss_before,
+        'file_bytes': os.path.getsize(model_path),
+    })
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the FP32 and INT8 models over a labelled image set (one sub-folder per class label) "
+        "and report top-1 agreement, per-class accuracy drift, latency and memory."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('image_dir', help="Folder with one sub-folder per class label, e.g. Tomato__healthy/leaf1.jpg.")
+        parser.add_argument('--fp32', default=settings.PREDICTION_MODEL_PATH, help="FP32 model.")
+        parser.add_argument('--int8', help="INT8 model. Defaults to <fp32 model>.int8.onnx.")
+        parser.add_argument('--limit', type=int, default=0, help="Only use the first N images (0 = all).")
+        parser.add_argument('--timeout', type=float, default=600.0, help="Seconds to wait for each model's report.")
+
+    def handle(self, *args, **options):
+        fp32_path = options['fp32']
+        int8_path = options['int8'] or quantized_path(fp32_path)
+        for path in (fp32_path, int8_path):
+            if not os.path.exists(path):
+                raise CommandError(f"Model file not found: {path}")
+
+        image_paths = list(iter_image_paths(options['image_dir']))
+        if options['limit']:
+            image_paths = image_paths[:options['limit']]
+        readable = []
+        for path in image_paths:
+            try:
+                with open(path, 'rb') as f:
+                    preprocess_image(f)
+                readable.append(path)
+            except ValueError:
+                self.stderr.write(f"Skipping unreadable image {path}")
+        if not readable:
+            raise CommandError(f"No readable images in {options['image_dir']}")
+        truth = [os.path.basename(os.path.dirname(path)) for path in readable]
+
+        fp32 = self._run(fp32_path, readable, options['timeout'])
+        int8 = self._run(int8_path, readable, options['timeout'])
+
+        agree = sum(a == b for a, b in zip(fp32['predictions'], int8['predictions']))
+        self.stdout.write(f"Images: {len(readable)}")
+        self.stdout.write(f"Top-1 agreement: {agree / len(readable):.2%} ({agree}/{len(readable)})")
+
+        # Each report names its predictions with its own model's labels, so a reordered
+        # or extended manifest is compared by class rather than by output index
+        known = set(fp32['labels']) | set(int8['labels'])
+        per_class = defaultdict(lambda: [0, 0, 0])  # total, fp32 correct, int8 correct
+        for label, a, b in zip(truth, fp32['predictions'], int8['predictions']):
+            if label not in known:
+                continue
+            counts = per_class[label]
+            counts[0] += 1
+            counts[1] += a == label
+            counts[2] += b == label
+
+        if per_class:
+            total = sum(c[0] for c in per_class.values())
+            self.stdout.write(
+                f"Accuracy: FP32 {sum(c[1] for c in per_class.values()) / total:.2%}, "
+                f"INT8 {sum(c[2] for c in per_class.values()) / total:.2%} over {total} labelled images"
+            )
+            self.stdout.write(f"\n{'class':<48} {'n':>5} {'fp32':>7} {'int8':>7} {'drift':>7}")
+            rows = sorted(per_class.items(), key=lambda item: (item[1][2] - item[1][1]) / item[1][0])
+            for label, (n, fp32_correct, int8_correct) in rows:
+                drift = (int8_correct - fp32_correct) / n
+                self.stdout.write(f"{label:<48} {n:>5} {fp32_correct / n:>7.1%} {int8_correct / n:>7.1%} {drift:>+7.1%}")
+        else:
+            self.stdout.write("No sub-folders match either model's labels; accuracy not computed.")
+
+        self.stdout.write(f"\n{'model':<6} {'file MB':>8} {'RSS MB':>8} {'mean ms':>8} {'p50 ms':>8} {'p95 ms':>8}")
+        for name, report in (('fp32', fp32), ('int8', int8)):
+            latencies = sorted(report['latencies'])
+            self.stdout.write(
+                f"{name:<6} {report['file_bytes'] / 1e6:>8.1f} {report['rss_bytes'] / 1e6:>8.1f} "
+                f"{np.mean(latencies) * 1000:>8.2f} {latencies[len(latencies) // 2] * 1000:>8.2f} "
+                f"{latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000:>8.2f}"
+            )
+        speedup = np.mean(fp32['latencies']) / np.mean(int8['latencies'])
+        self.stdout.write(self.style.SUCCESS(f"INT8 speedup: {speedup:.2f}x"))
+
+    def _run(self, model_path, image_paths, timeout):
+        context = multiprocessing.get_context()
+        results = context.Queue()
+        process = context.Process(target=_score_model, args=(model_path, image_paths, results))
+        process.start()
+        give_up = time.monotonic() + timeout
+        try:
+            while True:
+                try:
+                    report = results.get(timeout=0.5)
+                    break
+                except queue.Empty:
+                    if process.exitcode:
+                        raise CommandError(f"Scoring {model_path} failed (exit code {process.exitcode})")
+                    if time.monotonic() > give_up:
+                        raise CommandError(f"Scoring {model_path} did not finish within {timeout}s")
+        except BaseException:
+            process.terminate()
+            raise
+        finally:
+            process.join()
+        return report
@@ -0,0 +1,103 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from onnxruntime.quantization import (
+    CalibrationDataReader, CalibrationMethod, QuantFormat, QuantType, quant_pre_process, quantize_dynamic, quantize_static,
+)
+
+from detection.utils.model_registry import quantized_path, read_manifest
+from detection.utils.onnx_predictor import LABELS, preprocess_image
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+
+
+def iter_image_paths(folder: str):
+    for root, _, files in sorted(os.walk(folder)):
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(root, name)
+
+
+class LeafImageCalibrationReader(CalibrationDataReader):
+    """
+    Feeds preprocessed sample leaf images to the static quantization calibrator.
+    """
+
+    def __init__(self, folder: str, input_name: str, limit: int):
+        self.input_name = input_name
+        self.paths = list(iter_image_paths(folder))[:limit]
+        self._iterator = iter(self.paths)
+
+    def get_next(self):
+        for path in self._iterator:
+            try:
+                with open(path, 'rb') as f:
+                    return {self.input_name: preprocess_image(f)}
+            except ValueError:
+                continue
+        return None
+
+    def rewind(self):
+        self._iterator = iter(self.paths)
+
+
+class Command(BaseCommand):
+    help = "Produce an INT8 variant of an ONNX model, dynamically quantized or statically calibrated on sample images."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', default=settings.PREDICTION_MODEL_PATH, help="FP32 model to quantize.")
+        parser.add_argument('--output', help="Output path. Defaults to <model>.int8.onnx, which PREDICTION_MODEL_PRECISION=int8 serves.")
+        parser.add_argument('--mode', choices=['dynamic', 'static'], default='static')
+        parser.add_argument('--calibration-dir', help="Folder of sample leaf images (searched recursively). Required for static mode.")
+        parser.add_argument('--calibration-limit', type=int, default=500, help="Maximum number of calibration images.")
+        parser.add_argument('--calibration-method', choices=['minmax', 'entropy', 'percentile'], default='minmax')
+        parser.add_argument('--per-channel', action='store_true', help="Quantize weights per channel (usually more accurate for convolutions).")
+
+    def handle(self, *args, **options):
+        model_path = options['model']
+        output = options['output'] or quantized_path(model_path)
+        if not os.path.exists(model_path):
+            raise CommandError(f"Model file not found: {model_path}")
+
+        # Shape inference and graph cleanup make quantization cover more nodes
+        prepared = output + '.prep.onnx'
+        quant_pre_process(model_path, prepared, skip_symbolic_shape=True)
+        try:
+            if options['mode'] == 'dynamic':
+                quantize_dynamic(prepared, output, weight_type=QuantType.QInt8, per_channel=options['per_channel'])
+            else:
+                if not options['calibration_dir']:
+                    raise CommandError("--calibration-dir is required for static quantization")
+                import onnxruntime as ort
+                input_name = ort.InferenceSession(prepared).get_inputs()[0].name
+                reader = LeafImageCalibrationReader(options['calibration_dir'], input_name, options['calibration_limit'])
+                if not reader.paths:
+                    raise CommandError(f"No images found in {options['calibration_dir']}")
+                self.stdout.write(f"Calibrating on {len(reader.paths)} images")
+                quantize_static(
+                    prepared, output, reader,
+                    quant_format=QuantFormat.QDQ,
+                    activation_type=QuantType.QUInt8,
+                    weight_type=QuantType.QInt8,
+                    per_channel=options['per_channel'],
+                    calibrate_method={
+                        'minmax': CalibrationMethod.MinMax,
+                        'entropy': CalibrationMethod.Entropy,
+                        'percentile': CalibrationMethod.Percentile,
+                    }[options['calibration_method']],
+                )
+        finally:
+            if os.path.exists(prepared):
+                os.remove(prepared)
+
+        # Manifest so the INT8 file can also be registered as its own ModelVersion
+        spec = read_manifest(model_path, LABELS)
+        with open(os.path.splitext(output)[0] + '.json', 'w') as f:
+            json.dump({'version': f'{spec.version}-int8', 'labels': spec.labels}, f, indent=1)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {options['mode']} INT8 model to {output} "
+            f"({os.path.getsize(model_path) / 1e6:.1f} MB -> {os.path.getsize(output) / 1e6:.1f} MB)"
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from detection.utils.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the per-day x class x flagged detection rollups from the Detection table. "
+        "Run after writes that bypass the model layer, e.g. QuerySet.update() or raw SQL."
+    )
+
+    def handle(self, *args, **options):
+        rows = rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} detection rollup row(s)"))
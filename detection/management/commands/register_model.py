@@ -0,0 +1,58 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from detection.models import ModelVersion
+from detection.utils.model_registry import read_manifest, load_model
+from detection.utils.onnx_predictor import LABELS
+
+
+class Command(BaseCommand):
+    help = "Register an ONNX model (and its label manifest) as a servable ModelVersion."
+
+    def add_arguments(self, parser):
+        parser.add_argument('model_path', help="Path to the .onnx file. Labels are read from <model>.json when present.")
+        parser.add_argument('--model-version', help="Version id. Defaults to the manifest version or the file name.")
+        parser.add_argument('--activate', action='store_true', help="Make this the active version on every worker.")
+        parser.add_argument('--skip-check', action='store_true', help="Do not test-load the model before registering it.")
+
+    def handle(self, *args, **options):
+        model_path = os.path.abspath(options['model_path'])
+        if not os.path.exists(model_path):
+            raise CommandError(f"Model file not found: {model_path}")
+
+        spec = read_manifest(model_path, LABELS)
+        version = options['model_version'] or spec.version
+
+        if not options['skip_check']:
+            try:
+                model = load_model(spec)
+            except Exception as e:
+                raise CommandError(f"Model failed to load: {e}")
+            outputs = model.session.get_outputs()[0].shape[-1]
+            if isinstance(outputs, int) and outputs != len(spec.labels):
+                raise CommandError(f"Model has {outputs} outputs but the manifest lists {len(spec.labels)} labels")
+
+        with transaction.atomic():
+            row, created = ModelVersion.objects.update_or_create(
+                version=version,
+                defaults={'model_path': model_path, 'labels': spec.labels},
+            )
+            if options['activate']:
+                activate(row)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Registered' if created else 'Updated'} model {version}{' (active)' if options['activate'] else ''}"
+        ))
+
+
+def activate(row):
+    """
+    Marks `row` as the only active version. Workers pick it up on their next poll.
+    """
+    ModelVersion.objects.filter(is_active=True).exclude(pk=row.pk).update(is_active=False)
+    row.is_active = True
+    row.activated_at = timezone.now()
+    row.save(update_fields=['is_active', 'activated_at'])
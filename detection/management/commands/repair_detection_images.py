@@ -0,0 +1,64 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from detection.models import Detection
+from detection.utils.derivatives import STAGED_PREFIXES, store_derivatives, store_thumbnail
+
+
+class Command(BaseCommand):
+    help = (
+        "Finish stored images that were never written, e.g. because the process died with "
+        "derivatives still queued. Rows still pointing at their staged original get the archival "
+        "copy and thumbnail built from it; rows with an archival copy but no thumbnail get the "
+        "thumbnail. Rows with no image are reported (this includes tensor uploads, which never have one)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=10, help="Only repair rows created at least this many minutes ago, so queued derivatives are left alone.")
+        parser.add_argument('--dry-run', action='store_true', help="Report what would be rebuilt without writing anything.")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(minutes=options['older_than'])
+        detections = Detection.objects.filter(created_at__lte=cutoff)
+        dry_run = options['dry_run']
+
+        staged = Q()
+        for prefix in STAGED_PREFIXES:
+            staged |= Q(image__startswith=prefix)
+
+        rebuilt = 0
+        for detection in detections.filter(staged).order_by('pk').iterator():
+            if not dry_run:
+                try:
+                    store_derivatives(detection.pk, detection.image.name)
+                except Exception as e:
+                    self.stderr.write(f"Detection {detection.pk}: staged original {detection.image.name} is unusable: {e}")
+                    continue
+            rebuilt += 1
+
+        thumbnails = 0
+        missing_thumbnail = detections.exclude(image='').exclude(staged).filter(Q(thumbnail__isnull=True) | Q(thumbnail=''))
+        for detection in missing_thumbnail.order_by('pk').iterator():
+            if not dry_run:
+                try:
+                    store_thumbnail(detection)
+                except Exception as e:
+                    self.stderr.write(f"Detection {detection.pk}: image {detection.image.name} is unreadable: {e}")
+                    continue
+            thumbnails += 1
+
+        verb = "Would rebuild" if dry_run else "Rebuilt"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {rebuilt} image(s) from staged originals and {thumbnails} thumbnail(s) from stored images"
+        ))
+        unrecoverable = list(detections.filter(image='').order_by('pk').values_list('pk', flat=True)[:51])
+        if unrecoverable:
+            total = detections.filter(image='').count()
+            shown = ', '.join(str(pk) for pk in unrecoverable[:50])
+            more = f" and {total - 50} more" if total > 50 else ""
+            self.stdout.write(self.style.WARNING(
+                f"{total} detection(s) have no image: {shown}{more}"
+            ))
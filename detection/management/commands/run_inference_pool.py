@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from detection.utils.inference_pool import serve
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the shared inference pool: a fixed number of processes that own the ONNX model "
+        "and score tensors sent by web workers running with PREDICTION_BACKEND=pool."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', default=settings.PREDICTION_POOL_SOCKET, help="Unix socket path to listen on.")
+        parser.add_argument('--workers', type=int, default=settings.PREDICTION_POOL_WORKERS, help="Number of pool processes, each with one model copy.")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Starting {options['workers']} inference pool worker(s) on {options['socket']}")
+        serve(options['socket'], options['workers'], getattr(settings, 'PREDICTION_MODEL_POLL_SECONDS', 30))
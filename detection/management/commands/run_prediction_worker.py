@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from detection.utils.prediction_jobs import default_worker_name, run_worker
+
+
+class Command(BaseCommand):
+    help = (
+        "Score queued prediction jobs. Run as many of these processes as needed; "
+        "they claim jobs from the database, so no message broker is required."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--worker-id', default=None, help="Name recorded on claimed jobs (default: host:pid).")
+        parser.add_argument('--poll-seconds', type=float, default=settings.PREDICTION_JOB_POLL_SECONDS, help="How long to sleep when the queue is empty.")
+        parser.add_argument('--once', action='store_true', help="Exit once the queue is empty instead of waiting for more jobs.")
+
+    def handle(self, *args, **options):
+        worker = options['worker_id'] or default_worker_name()
+        self.stdout.write(f"Prediction worker {worker} waiting for jobs")
+        run_worker(worker, options['poll_seconds'], options['once'])
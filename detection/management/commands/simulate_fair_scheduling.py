@@ -0,0 +1,104 @@
+import random
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from detection.utils.batching import MicroBatchScheduler
+
+
+def _percentiles(latencies) -> str:
+    if not latencies:
+        return f"{'-':>8} {'-':>8} {'-':>8} {'-':>8}"
+    latencies = sorted(latencies)
+
+    def at(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+    return f"{at(0.5):>8.0f} {at(0.95):>8.0f} {at(0.99):>8.0f} {latencies[-1] * 1000:>8.0f}"
+
+
+class Command(BaseCommand):
+    help = (
+        "Simulate mixed load on the inference batch scheduler, with and without per-user fair "
+        "queuing, and report per-user latency distributions. The model is replaced by a sleep "
+        "of --batch-ms + --row-ms per row, so no ONNX file is needed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--duration', type=float, default=10.0, help="Seconds to run each mode.")
+        parser.add_argument('--bulk-users', type=int, default=1, help="Users that submit large batches back to back.")
+        parser.add_argument('--bulk-images', type=int, default=200, help="Images per bulk request.")
+        parser.add_argument('--bulk-tier', default='bulk', help="PREDICTION_TIER_WEIGHTS tier of the bulk users.")
+        parser.add_argument('--interactive-users', type=int, default=8, help="Users that send single photos.")
+        parser.add_argument('--interactive-rate', type=float, default=2.0, help="Requests per second per interactive user (Poisson).")
+        parser.add_argument('--interactive-tier', default='standard', help="PREDICTION_TIER_WEIGHTS tier of the interactive users.")
+        parser.add_argument('--batch-ms', type=float, default=5.0, help="Simulated fixed cost of one model run.")
+        parser.add_argument('--row-ms', type=float, default=2.0, help="Simulated cost per image in a run.")
+        parser.add_argument('--max-batch-size', type=int, default=settings.PREDICTION_BATCH_MAX_SIZE)
+        parser.add_argument('--quantum', type=int, default=getattr(settings, 'PREDICTION_FAIR_QUANTUM', None))
+
+    def handle(self, *args, **options):
+        weights = getattr(settings, 'PREDICTION_TIER_WEIGHTS', {'standard': 1.0})
+        self.stdout.write(
+            f"{options['bulk_users']} bulk user(s) x {options['bulk_images']} images ({options['bulk_tier']}), "
+            f"{options['interactive_users']} interactive user(s) at {options['interactive_rate']} req/s ({options['interactive_tier']}); "
+            f"model run = {options['batch_ms']}ms + {options['row_ms']}ms/image"
+        )
+        self.stdout.write(f"{'mode':>6} {'user':>14} {'reqs':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} {'img/s':>7}")
+        for mode in ('fifo', 'fair'):
+            for user, latencies, images in self._simulate(options, weights, fair=mode == 'fair'):
+                self.stdout.write(
+                    f"{mode:>6} {user:>14} {len(latencies):>6} {_percentiles(latencies)} {images / options['duration']:>7.1f}"
+                )
+
+    def _simulate(self, options, weights, fair: bool) -> list:
+        def run_batch(tensor):
+            time.sleep((options['batch_ms'] + options['row_ms'] * tensor.shape[0]) / 1000)
+            return np.zeros((tensor.shape[0], 1), dtype=np.float32), None
+
+        scheduler = MicroBatchScheduler(
+            run_batch, max_batch_size=options['max_batch_size'], max_wait_ms=settings.PREDICTION_BATCH_MAX_WAIT_MS,
+            name='simulated-batcher', quantum=options['quantum'],
+        )
+        deadline = time.perf_counter() + options['duration']
+        results = {}
+        lock = threading.Lock()
+
+        def client(user, tier, images, rate):
+            # Without fair queuing every request shares one flow, i.e. plain arrival order
+            flow = (user, weights.get(tier, 1.0)) if fair else (None, 1.0)
+            tensor = np.zeros((images, 1), dtype=np.float32)
+            rng = random.Random(user)
+            latencies, done = [], 0
+            while time.perf_counter() < deadline:
+                if rate:
+                    time.sleep(rng.expovariate(rate))
+                started = time.perf_counter()
+                scheduler.submit(tensor, flow=flow)
+                latencies.append(time.perf_counter() - started)
+                done += images
+            with lock:
+                results[user] = (latencies, done)
+
+        clients = [
+            (f'bulk-{i}', options['bulk_tier'], options['bulk_images'], 0) for i in range(options['bulk_users'])
+        ] + [
+            (f'interactive-{i}', options['interactive_tier'], 1, options['interactive_rate']) for i in range(options['interactive_users'])
+        ]
+        threads = [threading.Thread(target=client, args=c, daemon=True) for c in clients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        rows = [(user, *results[user]) for user, *_ in clients if user.startswith('bulk')]
+        interactive = [results[user] for user, *_ in clients if user.startswith('interactive')]
+        if interactive:
+            rows.append((
+                'interactive', [latency for latencies, _ in interactive for latency in latencies],
+                sum(done for _, done in interactive),
+            ))
+        return rows
@@ -0,0 +1,144 @@
+import itertools
+import multiprocessing
+import queue
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from detection.utils.model_registry import build_session_options
+
+
+def _parse_ints(value):
+    return [int(v) for v in value.split(',') if v.strip()]
+
+
+def _bench_worker(model_path, options, batch_size, ready, start, deadline, results):
+    """
+    Runs one simulated web worker: its own session, scoring batches until the shared `deadline`.
+    """
+    import onnxruntime as ort
+
+    session = ort.InferenceSession(model_path, build_session_options(**options))
+    model_input = session.get_inputs()[0]
+    shape = (batch_size,) + tuple(model_input.shape[1:])
+    batch = np.random.default_rng().random(shape, dtype=np.float32)
+    session.run(None, {model_input.name: batch})
+
+    ready.wait()
+    start.wait()
+    latencies = []
+    while time.monotonic() < deadline.value:
+        started = time.perf_counter()
+        session.run(None, {model_input.name: batch})
+        latencies.append(time.perf_counter() - started)
+    results.put(latencies)
+
+
+class Command(BaseCommand):
+    help = (
+        "Sweep ONNX Runtime thread settings against a number of concurrent worker processes "
+        "and report aggregate throughput, to choose PREDICTION_ORT_* values from data."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(), help="Number of web workers to simulate, each with its own session.")
+        parser.add_argument('--intra', default='1,2,4', help="Comma separated intra-op thread counts to try (0 = ORT default).")
+        parser.add_argument('--inter', default='1', help="Comma separated inter-op thread counts to try.")
+        parser.add_argument('--execution-mode', default='sequential', help="Comma separated execution modes to try.")
+        parser.add_argument('--batch-size', type=int, default=1, help="Images per session run.")
+        parser.add_argument('--duration', type=float, default=10.0, help="Seconds to run each configuration.")
+        parser.add_argument('--model', default=settings.PREDICTION_MODEL_PATH, help="ONNX model to benchmark.")
+        parser.add_argument('--timeout', type=float, default=120.0, help="Seconds to wait for workers to load their sessions, and past the end of a run for their results.")
+
+    def handle(self, *args, **options):
+        configs = itertools.product(
+            _parse_ints(options['intra']),
+            _parse_ints(options['inter']),
+            [m.strip() for m in options['execution_mode'].split(',') if m.strip()],
+        )
+        self.stdout.write(
+            f"{options['workers']} workers, batch size {options['batch_size']}, {options['duration']}s per configuration, "
+            f"{multiprocessing.cpu_count()} CPUs"
+        )
+        self.stdout.write(f"{'intra':>5} {'inter':>5} {'mode':>10} {'img/s':>9} {'p50 ms':>8} {'p95 ms':>8}")
+
+        rows = []
+        for intra, inter, mode in configs:
+            session_options = {
+                'intra_op_threads': intra,
+                'inter_op_threads': inter,
+                'execution_mode': mode,
+                'graph_optimization': getattr(settings, 'PREDICTION_ORT_GRAPH_OPTIMIZATION', 'all'),
+                'cpu_mem_arena': getattr(settings, 'PREDICTION_ORT_CPU_MEM_ARENA', True),
+                'mem_pattern': getattr(settings, 'PREDICTION_ORT_MEM_PATTERN', True),
+            }
+            latencies = self._run_config(options, session_options)
+            if not latencies:
+                continue
+            latencies.sort()
+            throughput = len(latencies) * options['batch_size'] / options['duration']
+            p50 = latencies[len(latencies) // 2] * 1000
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000
+            rows.append((throughput, intra, inter, mode))
+            self.stdout.write(f"{intra:>5} {inter:>5} {mode:>10} {throughput:>9.1f} {p50:>8.1f} {p95:>8.1f}")
+
+        if rows:
+            throughput, intra, inter, mode = max(rows)
+            self.stdout.write(self.style.SUCCESS(
+                f"Best: PREDICTION_ORT_INTRA_OP_THREADS={intra} PREDICTION_ORT_INTER_OP_THREADS={inter} "
+                f"PREDICTION_ORT_EXECUTION_MODE={mode} ({throughput:.1f} img/s)"
+            ))
+
+    def _run_config(self, options, session_options):
+        context = multiprocessing.get_context()
+        # Every worker plus this process must reach the barrier before timing starts
+        ready = context.Barrier(options['workers'] + 1)
+        start = context.Event()
+        deadline = context.Value('d', 0.0)
+        results = context.Queue()
+        processes = [
+            context.Process(
+                target=_bench_worker,
+                args=(options['model'], session_options, options['batch_size'], ready, start, deadline, results),
+            )
+            for _ in range(options['workers'])
+        ]
+        for process in processes:
+            process.start()
+        try:
+            # Wait for every worker to load its session, failing fast if one dies
+            give_up = time.monotonic() + options['timeout']
+            while ready.n_waiting < len(processes):
+                self._check_workers(processes, give_up, "load the model")
+                time.sleep(0.05)
+            ready.wait()
+            # One deadline for all workers, so they measure the same window
+            deadline.value = time.monotonic() + options['duration']
+            start.set()
+
+            latencies = []
+            give_up = deadline.value + options['timeout']
+            while len(latencies) < len(processes):
+                try:
+                    latencies.append(results.get(timeout=0.5))
+                except queue.Empty:
+                    self._check_workers(processes, give_up, "report results")
+            latencies = [latency for worker in latencies for latency in worker]
+        except BaseException:
+            for process in processes:
+                process.terminate()
+            raise
+        finally:
+            for process in processes:
+                process.join()
+        return latencies
+
+    @staticmethod
+    def _check_workers(processes, give_up, waiting_for):
+        failed = [p.exitcode for p in processes if p.exitcode]
+        if failed or time.monotonic() > give_up:
+            codes = ', '.join('running' if p.exitcode is None else str(p.exitcode) for p in processes)
+            reason = "a worker exited" if failed else "timed out"
+            raise CommandError(f"Workers did not {waiting_for}: {reason} (exit codes: {codes})")
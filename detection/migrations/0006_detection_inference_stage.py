@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detection', '0005_modelversion_detection_model_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='detection',
+            name='inference_stage',
+            field=models.CharField(blank=True, max_length=16, null=True),
+        ),
+    ]
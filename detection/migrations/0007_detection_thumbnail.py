@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detection', '0006_detection_inference_stage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='detection',
+            name='thumbnail',
+            field=models.ImageField(blank=True, null=True, upload_to='detections/thumbnails/'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:35
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detection', '0008_predictionjob'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='detection',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='detection_user_history_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:36
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detection', '0009_detection_history_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='detection',
+            index=models.Index(fields=['user', 'result'], name='detection_user_result_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='detection',
+            index=models.Index(fields=['user', 'confidence_score'], name='detection_user_conf_idx'),
+        ),
+    ]
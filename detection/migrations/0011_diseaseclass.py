@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:38
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detection', '0010_detection_filter_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DiseaseClass',
+            fields=[
+                ('id', models.SmallAutoField(primary_key=True, serialize=False)),
+                ('label', models.CharField(max_length=255, unique=True)),
+                ('crop', models.CharField(db_index=True, max_length=64)),
+                ('disease', models.CharField(max_length=128)),
+                ('healthy', models.BooleanField(default=False)),
+            ],
+            options={
+                'verbose_name_plural': 'disease classes',
+                'ordering': ['label'],
+            },
+        ),
+        migrations.RemoveIndex(
+            model_name='detection',
+            name='detection_user_result_idx',
+        ),
+        migrations.AddField(
+            model_name='detection',
+            name='disease_class',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='detections', to='detection.diseaseclass'),
+        ),
+        migrations.AddIndex(
+            model_name='detection',
+            index=models.Index(fields=['user', 'disease_class'], name='detection_user_class_idx'),
+        ),
+    ]
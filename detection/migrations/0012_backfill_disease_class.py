@@ -0,0 +1,45 @@
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+
+def _parse_label(label):
+    # Frozen copy of utils.disease_classes.parse_label
+    crop, separator, disease = label.partition('__')
+    if not separator:
+        crop, disease = label, ''
+    crop = crop.replace('_', ' ').strip()
+    disease = disease.strip('_').replace('_', ' ').strip()
+    return crop, disease, disease.lower() == 'healthy'
+
+
+def backfill_disease_classes(apps, schema_editor):
+    DiseaseClass = apps.get_model('detection', 'DiseaseClass')
+    Detection = apps.get_model('detection', 'Detection')
+    ModelVersion = apps.get_model('detection', 'ModelVersion')
+
+    labels = set(Detection.objects.values_list('result', flat=True).distinct())
+    for version_labels in ModelVersion.objects.values_list('labels', flat=True):
+        labels.update(version_labels or ())
+    labels.discard('')
+    DiseaseClass.objects.bulk_create(
+        [
+            DiseaseClass(label=label, crop=crop, disease=disease, healthy=healthy)
+            for label, (crop, disease, healthy) in ((label, _parse_label(label)) for label in sorted(labels))
+        ],
+        ignore_conflicts=True,
+    )
+    # One UPDATE for the whole table rather than one per label
+    Detection.objects.filter(disease_class__isnull=True).update(
+        disease_class=Subquery(DiseaseClass.objects.filter(label=OuterRef('result')).values('pk')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detection', '0011_diseaseclass'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_disease_classes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+
+
+def build_rollups(apps, schema_editor):
+    # Frozen copy of utils.rollups.rebuild
+    Detection = apps.get_model('detection', 'Detection')
+    DetectionDailyStat = apps.get_model('detection', 'DetectionDailyStat')
+    groups = (
+        Detection.objects.order_by().annotate(day=TruncDate('created_at'))
+        .values_list('day', 'disease_class', 'flagged').annotate(rows=Count('id'))
+    )
+    DetectionDailyStat.objects.bulk_create(
+        DetectionDailyStat(day=day, disease_class_id=class_id, flagged=flagged, count=rows)
+        for day, class_id, flagged, rows in groups.iterator()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detection', '0012_backfill_disease_class'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DetectionDailyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('flagged', models.BooleanField(default=False)),
+                ('count', models.IntegerField(default=0)),
+                ('disease_class', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='detection.diseaseclass')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='detectiondailystat',
+            constraint=models.UniqueConstraint(condition=models.Q(('disease_class__isnull', False)), fields=('day', 'disease_class', 'flagged'), name='detection_daily_stat_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='detectiondailystat',
+            constraint=models.UniqueConstraint(condition=models.Q(('disease_class__isnull', True)), fields=('day', 'flagged'), name='detection_daily_stat_unclassified_unique'),
+        ),
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:22
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def _parse_label(label):
+    # Frozen copy of utils.disease_classes.parse_label
+    crop, separator, disease = label.partition('__')
+    if not separator:
+        crop, disease = label, ''
+    crop = crop.replace('_', ' ').strip()
+    disease = disease.strip('_').replace('_', ' ').strip()
+    return crop, disease, disease.lower() == 'healthy'
+
+
+def link_remaining_rows(apps, schema_editor):
+    # Rows stored since 0012 that never got a class would lose their label with the column
+    DiseaseClass = apps.get_model('detection', 'DiseaseClass')
+    Detection = apps.get_model('detection', 'Detection')
+
+    unlinked = Detection.objects.filter(disease_class__isnull=True).exclude(result='')
+    labels = set(unlinked.values_list('result', flat=True).distinct())
+    DiseaseClass.objects.bulk_create(
+        [
+            DiseaseClass(label=label, crop=crop, disease=disease, healthy=healthy)
+            for label, (crop, disease, healthy) in ((label, _parse_label(label)) for label in sorted(labels))
+        ],
+        ignore_conflicts=True,
+    )
+    unlinked.update(disease_class=Subquery(DiseaseClass.objects.filter(label=OuterRef('result')).values('pk')[:1]))
+
+
+def restore_results(apps, schema_editor):
+    DiseaseClass = apps.get_model('detection', 'DiseaseClass')
+    Detection = apps.get_model('detection', 'Detection')
+    Detection.objects.filter(disease_class__isnull=False).update(
+        result=Subquery(DiseaseClass.objects.filter(pk=OuterRef('disease_class')).values('label')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detection', '0013_detectiondailystat'),
+    ]
+
+    operations = [
+        migrations.RunPython(link_remaining_rows, restore_results),
+        # Lets the reverse re-add the column to existing rows before restore_results fills it
+        migrations.AlterField(
+            model_name='detection',
+            name='result',
+            field=models.CharField(default='', max_length=255),
+        ),
+        migrations.RemoveField(
+            model_name='detection',
+            name='result',
+        ),
+    ]
@@ -1,16 +1,226 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
 from django.contrib.auth.models import User
 
+class DiseaseClass(models.Model):
+    """
+    A label a model can predict (e.g. `Tomato__target_spot`), split into its
+    crop and disease. Rows are added by utils.disease_classes the first time a
+    label is stored; a SmallAutoField keeps Detection's foreign key at 2 bytes.
+    """
+    id = models.SmallAutoField(primary_key=True)
+    label = models.CharField(max_length=255, unique=True)
+    crop = models.CharField(max_length=64, db_index=True)
+    disease = models.CharField(max_length=128)  # 'healthy' for healthy classes
+    healthy = models.BooleanField(default=False)
+
+    class Meta:
+        ordering = ['label']
+        verbose_name_plural = 'disease classes'
+
+    def __str__(self):
+        return self.label
+
+class DetectionQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        # bulk_create sends no pre_save or post_save: classes are linked and the
+        # rollups counted here, in the same transaction
+        objs = list(objs)
+        from .utils.disease_classes import link_classes
+        link_classes([detection for detection in objs if detection.disease_class_id is None])
+        with transaction.atomic(using=self.db, savepoint=False):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            from .utils.rollups import record_created
+            record_created(objs)
+        return objs
+
 class Detection(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='detections')
+    # Size-capped re-encoded copy and list thumbnail, written after the response
+    # by utils.derivatives. Until then `image` is the staged upload as sent and
+    # `thumbnail` is empty; tensor uploads have neither
     image = models.ImageField(upload_to='detections/')
-    result = models.CharField(max_length=255)
+    thumbnail = models.ImageField(upload_to='detections/thumbnails/', null=True, blank=True)
+    # The predicted label is stored only as this link; see `result`
+    disease_class = models.ForeignKey(DiseaseClass, on_delete=models.PROTECT, null=True, blank=True, related_name='detections')
     latitude = models.FloatField(null=True, blank=True)
     longitude = models.FloatField(null=True, blank=True)
     confidence_score = models.FloatField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     flagged = models.BooleanField(default=False)
     flag_reason = models.TextField(null=True, blank=True)
+    model_version = models.CharField(max_length=64, null=True, blank=True)
+    inference_stage = models.CharField(max_length=16, null=True, blank=True)  # 'fast' or 'ensemble'
+
+    class Meta:
+        indexes = [
+            # History pages walk this index from a (created_at, id) cursor
+            models.Index(fields=['user', '-created_at', '-id'], name='detection_user_history_idx'),
+            # Filtered history: class/crop lookups and confidence ranges
+            models.Index(fields=['user', 'disease_class'], name='detection_user_class_idx'),
+            models.Index(fields=['user', 'confidence_score'], name='detection_user_conf_idx'),
+        ]
+
+    objects = DetectionQuerySet.as_manager()
 
     def __str__(self):
         return f'{self.user.username} - {self.result}'
+
+    @property
+    def result(self) -> str:
+        """
+        The predicted label, e.g. `Tomato__target_spot`, read from the linked
+        DiseaseClass (select_related('disease_class') when reading many rows).
+        A label set on an unsaved detection is linked to its class on save.
+        """
+        if self.disease_class_id is not None:
+            return self.disease_class.label
+        return getattr(self, '_unlinked_result', '')
+
+    @result.setter
+    def result(self, label: str):
+        self._unlinked_result = label
+        self.disease_class = None
+
+    def flag(self, reason: str):
+        """
+        Flags the detection with `reason`. Only the request that actually flips
+        `flagged` moves it to the flagged rollup, so concurrent flags count once.
+        """
+        from .utils.rollups import record_change, rollup_key
+        with transaction.atomic():
+            before = rollup_key(self)
+            if Detection.objects.filter(pk=self.pk, flagged=False).update(flagged=True, flag_reason=reason):
+                self.flagged = True
+                record_change(before, self)
+            else:
+                Detection.objects.filter(pk=self.pk).update(flag_reason=reason)
+        self.flagged, self.flag_reason = True, reason
+
+class ModelVersion(models.Model):
+    """
+    An ONNX model that can be served. Every worker swaps to the row marked active.
+    """
+    version = models.CharField(max_length=64, unique=True)
+    model_path = models.CharField(max_length=500)
+    labels = models.JSONField()
+    is_active = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    activated_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f'{self.version}{" (active)" if self.is_active else ""}'
+
+class PredictionJob(models.Model):
+    """
+    A batch of uploads scored in the background by `manage.py run_prediction_worker`.
+    Workers claim queued jobs with a conditional UPDATE, so the database is the queue.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='prediction_jobs')
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED)
+    total = models.PositiveIntegerField(default=0)
+    processed = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    error = models.TextField(null=True, blank=True)
+    worker = models.CharField(max_length=128, null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)  # refreshed after every chunk; stale leases are requeued
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'created_at'])]
+
+    def __str__(self):
+        return f'Job {self.pk} ({self.status}, {self.processed}/{self.total})'
+
+class PredictionJobItem(models.Model):
+    """
+    One upload of a PredictionJob. Once scored, the staged upload is deleted, or
+    handed to the Detection as its image until the archival copy replaces it.
+    """
+    PENDING = 'pending'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    job = models.ForeignKey(PredictionJob, on_delete=models.CASCADE, related_name='items')
+    position = models.PositiveIntegerField()
+    filename = models.CharField(max_length=255)
+    upload = models.FileField(upload_to='jobs/', blank=True)
+    preprocessed_on = models.CharField(max_length=16, default='backend')  # 'mobile' for tensor uploads
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    result = models.CharField(max_length=255, null=True, blank=True)
+    confidence_score = models.FloatField(null=True, blank=True)
+    model_version = models.CharField(max_length=64, null=True, blank=True)
+    inference_stage = models.CharField(max_length=16, null=True, blank=True)
+    error = models.TextField(null=True, blank=True)
+    detection = models.ForeignKey(Detection, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    class Meta:
+        ordering = ['position']
+        unique_together = [('job', 'position')]
+
+class DetectionDailyStat(models.Model):
+    """
+    How many detections of one class were created on one day (TIME_ZONE), split by
+    flagged status. Kept current by the Detection signal receivers below (and
+    DetectionQuerySet.bulk_create / Detection.flag, which send no signals) on
+    every create, delete, cascade and save; `manage.py rebuild_detection_stats`
+    recomputes it.
+    """
+    day = models.DateField()
+    disease_class = models.ForeignKey(DiseaseClass, on_delete=models.PROTECT, null=True, blank=True, related_name='+')
+    flagged = models.BooleanField(default=False)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['day', 'disease_class', 'flagged'], condition=Q(disease_class__isnull=False),
+                name='detection_daily_stat_unique',
+            ),
+            # NULLs never collide in a plain unique index, so detections without a
+            # class need their own to roll up into one row per day, not one per writer
+            models.UniqueConstraint(
+                fields=['day', 'flagged'], condition=Q(disease_class__isnull=True),
+                name='detection_daily_stat_unclassified_unique',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.day} {self.disease_class_id} flagged={self.flagged}: {self.count}'
+
+
+# Class linking and rollup maintenance for single saves, and rollup maintenance
+# for every delete, including cascades (e.g. from User) and queryset deletes,
+# which send post_delete per row
+@receiver(pre_save, sender=Detection)
+def remember_rollup_key(sender, instance, **kwargs):
+    if instance.disease_class_id is None and instance.result:
+        from .utils.disease_classes import link_classes
+        link_classes([instance])
+    if not instance._state.adding:
+        from .utils.rollups import stored_rollup_key
+        instance._stored_rollup_key = stored_rollup_key(instance.pk)
+
+@receiver(post_save, sender=Detection)
+def count_saved_detection(sender, instance, created, **kwargs):
+    from .utils.rollups import record_change, record_created
+    if created:
+        record_created([instance])
+    else:
+        record_change(getattr(instance, '_stored_rollup_key', None), instance)
+
+@receiver(post_delete, sender=Detection)
+def count_deleted_detection(sender, instance, **kwargs):
+    from .utils.rollups import record_deleted
+    record_deleted(instance)
@@ -0,0 +1,75 @@
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination
+
+
+class DetectionHistoryPagination(CursorPagination):
+    """
+    Keyset pagination over a user's detections, newest first.
+    - the cursor carries the (created_at, id) of the row it continues from, and
+      the next page is `WHERE (created_at, id) < cursor ORDER BY created_at DESC,
+      id DESC LIMIT n`, which the (user, -created_at, -id) index answers without
+      counting or skipping rows; page 500 costs the same as page 1
+    - unlike DRF's CursorPagination it never falls back to an OFFSET for rows
+      that share a timestamp, since `id` breaks the tie
+    - the page size is fixed by DETECTION_HISTORY_PAGE_SIZE so cursors stay
+      valid when passed between clients
+    """
+    ordering = ('-created_at', '-id')
+
+    def get_page_size(self, request):
+        return getattr(settings, 'DETECTION_HISTORY_PAGE_SIZE', 20)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.cursor = self.decode_cursor(request)
+        reverse = bool(self.cursor and self.cursor.reverse)
+
+        if self.cursor is not None:
+            created_at, pk = self._decode_position(self.cursor.position)
+            if reverse:
+                after = Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk)
+            else:
+                after = Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+            queryset = queryset.filter(after)
+        queryset = queryset.order_by(*(('created_at', 'id') if reverse else self.ordering))
+
+        # One extra row tells whether there is anything beyond this page
+        rows = list(queryset[:self.page_size + 1])
+        more = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        if reverse:
+            self.page.reverse()
+
+        # Stepping back from a page means there is a newer one and vice versa
+        self.has_next = more if not reverse else self.cursor is not None
+        self.has_previous = more if reverse else self.cursor is not None
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=self._encode_position(self.page[-1])))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=self._encode_position(self.page[0])))
+
+    @staticmethod
+    def _encode_position(detection) -> str:
+        return f'{detection.created_at.isoformat()}|{detection.pk}'
+
+    def _decode_position(self, position):
+        try:
+            created_at, pk = position.rsplit('|', 1)
+            created_at, pk = parse_datetime(created_at), int(pk)
+        except (AttributeError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if created_at is None:
+            raise NotFound(self.invalid_cursor_message)
+        return created_at, pk
@@ -1,21 +1,90 @@
+from django.conf import settings
 from rest_framework import serializers
-from .models import Detection
+from .models import Detection, PredictionJob
+from .utils.uploads import DecodedUpload
 
-class MultiImageUploadSerializer(serializers.Serializer):
-    images = serializers.ListField(
-        child=serializers.ImageField(),
-        allow_empty=False,
+class HeaderCheckedImageField(serializers.FileField):
+    """
+    Accepts an image upload after reading only its header (format and size).
+    Unlike ImageField it does not decode the file to verify it; the prediction
+    pipeline decodes it once and reports a corrupt body as a per-image error.
+    """
+    default_error_messages = {
+        'invalid_image': serializers.ImageField.default_error_messages['invalid_image'],
+    }
+
+    def to_internal_value(self, data):
+        file = super().to_internal_value(data)
+        try:
+            DecodedUpload.of(file).check()
+        except Exception:
+            self.fail('invalid_image')
+        return file
+
+class UploadListField(serializers.ListField):
+    """
+    A list of uploads whose `max_length` is checked before any upload is
+    validated; ListField only checks it afterwards, once every header is read.
+    """
+
+    def to_internal_value(self, data):
+        if self.max_length is not None and hasattr(data, '__len__') and len(data) > self.max_length:
+            self.fail('max_length', max_length=self.max_length)
+        return super().to_internal_value(data)
+
+def _upload_fields(max_length):
+    images = UploadListField(
+        child=HeaderCheckedImageField(),
+        required=False,
+        max_length=max_length,
         help_text="Upload one or more images for prediction."
     )
+    tensors = UploadListField(
+        child=serializers.FileField(),
+        required=False,
+        max_length=max_length,
+        help_text="Images already preprocessed on the device: 224x224x3 tensors as raw uint8/float16/float32 bytes or .npy files. Float values must be in [0, 1]."
+    )
+    return images, tensors
+
+class MultiImageUploadSerializer(serializers.Serializer):
+    # Each list is capped at PREDICTION_MAX_IMAGES_PER_REQUEST; admission control caps their sum
+    images, tensors = _upload_fields(getattr(settings, 'PREDICTION_MAX_IMAGES_PER_REQUEST', 50) or None)
+
+    def validate(self, attrs):
+        if not attrs.get('images') and not attrs.get('tensors'):
+            raise serializers.ValidationError("Upload at least one file in 'images' or 'tensors'.")
+        return attrs
+
+class PredictionJobUploadSerializer(MultiImageUploadSerializer):
+    # Jobs take batches past the per-request cap, up to the multipart file limit
+    images, tensors = _upload_fields(getattr(settings, 'DATA_UPLOAD_MAX_NUMBER_FILES', 100))
 
 class PredictionResponseSerializer(serializers.Serializer):
     filename = serializers.CharField()
-    predicted_class = serializers.CharField()
-    confidence_score = serializers.FloatField()
-    preprocessed_on = serializers.CharField()  # 'mobile' or 'backend'
+    predicted_class = serializers.CharField(required=False)
+    confidence_score = serializers.FloatField(required=False)
+    model_version = serializers.CharField(required=False)
+    stage = serializers.CharField(required=False)  # 'fast' or 'ensemble'
+    error = serializers.CharField(required=False)  # set instead of a prediction when the image failed
+    preprocessed_on = serializers.CharField(required=False)  # 'mobile' or 'backend'
+    rejected = serializers.ListField(child=serializers.CharField(), required=False)  # prescreen reasons: blurry, too_dark, too_bright, no_leaf
+    quality = serializers.DictField(child=serializers.FloatField(), required=False)  # prescreen metrics of a rejected image
+    quality_warnings = serializers.ListField(child=serializers.CharField(), required=False)  # prescreen reasons when only tagging
 
 class DetectionSerializer(serializers.ModelSerializer):
+    # Facets of the predicted class; null for rows whose label is not linked yet
+    crop = serializers.CharField(source='disease_class.crop', read_only=True)
+    disease = serializers.CharField(source='disease_class.disease', read_only=True)
+    healthy = serializers.BooleanField(source='disease_class.healthy', read_only=True)
+
     class Meta:
         model = Detection
-        fields = ('id', 'user', 'image', 'result', 'confidence_score', 'created_at', 'flagged', 'flag_reason')
-        read_only_fields = ('user',)
+        fields = ('id', 'user', 'image', 'thumbnail', 'result', 'crop', 'disease', 'healthy', 'confidence_score', 'created_at', 'flagged', 'flag_reason', 'model_version', 'inference_stage')
+        read_only_fields = ('user', 'thumbnail', 'model_version', 'inference_stage')
+
+class PredictionJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = PredictionJob
+        fields = ('id', 'status', 'total', 'processed', 'failed', 'error', 'created_at', 'started_at', 'finished_at')
+        read_only_fields = fields
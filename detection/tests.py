@@ -1,3 +1,1777 @@
-from django.test import TestCase
+import base64
+import csv
+import gzip
+import io
+import json
+import os
+import queue
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DatabaseError, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image, ImageFilter
+from rest_framework.test import APIClient
+
+from .models import Detection, DetectionDailyStat, ModelVersion, PredictionJob, PredictionJobItem
+from .utils import exports, onnx_predictor, preprocess_pool, quality, streaming
+from .utils.admission import AdmissionController, AdmissionRejected
+from .utils.batching import MicroBatchScheduler, current_flow, inference_flow
+from .utils.cascade import ENSEMBLE_STAGE, FAST_STAGE, CascadeStats, run_cascade
+from .utils.derivatives import ORIGINALS_DIR, schedule_derivatives, stage_original
+from .utils.disease_classes import link_classes
+from .utils.exports import EXPORT_COLUMNS
+from .utils.inference_pool import InferencePoolClient, _PoolRequestHandler, _PoolServer, recv_frame, send_frame
+from .utils.model_registry import LoadedModel, ModelRegistry, ModelSpec
+from .utils.prediction_cache import PredictionCache, content_digest
+from .utils.prediction_jobs import claim_job, process_job, requeue_stale_jobs, submit_job
+from .utils.uploads import DecodedUpload
+
+
+def _jpeg(name='leaf.jpg', color=(60, 140, 40), size=(320, 240)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'JPEG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+
+class _FakeSession:
+    """
+    Stands in for an InferenceSession: every row scores `[0.1, 0.9]`.
+    """
+
+    def get_inputs(self):
+        return [SimpleNamespace(name='input', shape=['N', 224, 224, 3])]
+
+    def run(self, outputs, feeds):
+        rows = feeds['input'].shape[0]
+        return [np.tile(np.array([0.1, 0.9], dtype=np.float32), (rows, 1))]
+
+
+def _fake_load(spec):
+    return LoadedModel(spec, _FakeSession())
+
+
+class FilteredHistoryQueryPlanTests(TestCase):
+    """
+    Every query the history endpoints run against Detection must be answerable
+    from an index. Test tables are tiny, so PostgreSQL is told to avoid
+    sequential scans: if one still appears, no index could serve the query.
+    On SQLite only bare table scans can be detected.
+    """
+    FILTERS = [
+        '',
+        'result=blight',
+        'min_conf=0.5',
+        'max_conf=0.9',
+        'min_conf=0.2&max_conf=0.8',
+        'start_date=2024-03-01',
+        'end_date=2024-03-31',
+        'start_date=2024-03-01&end_date=2024-03-31',
+        'result=tomato&min_conf=0.3&start_date=2024-03-01&end_date=2024-03-31',
+        'crop=potato&healthy=false',
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('farmer', password='x')
+        other = User.objects.create_user('neighbour', password='x')
+        labels = ['Tomato__late_blight', 'Tomato__healthy', 'Potato__early_blight', 'Corn__common_rust']
+        detections = [
+            Detection(user=user, image='', result=labels[i % len(labels)], confidence_score=(i % 10) / 10)
+            for user in (cls.user, other) for i in range(60)
+        ]
+        link_classes(detections)
+        Detection.objects.bulk_create(detections)
+        start = timezone.make_aware(datetime(2024, 2, 20))
+        for i, pk in enumerate(Detection.objects.order_by('pk').values_list('pk', flat=True)):
+            Detection.objects.filter(pk=pk).update(created_at=start + timedelta(hours=12 * (i % 60)))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _detection_queries(self, url):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        queries = [q['sql'] for q in captured.captured_queries if '"detection_detection"' in q['sql']]
+        self.assertTrue(queries, f"{url} ran no Detection query")
+        return response, queries
+
+    def _plan(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute('EXPLAIN ' + sql)
+                return [row[0] for row in cursor.fetchall()]
+            if connection.vendor == 'sqlite':
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                return [row[-1] for row in cursor.fetchall()]
+        self.skipTest(f"No query plan check for {connection.vendor}")
+
+    def assertNoSequentialScan(self, sql):
+        plan = self._plan(sql)
+        if connection.vendor == 'postgresql':
+            # A casted date or an ILIKE left in a Filter is evaluated row by row,
+            # even when an index on user_id narrowed the rows first
+            scans = [
+                line for line in plan
+                if 'Seq Scan on detection_detection' in line
+                or ('Filter:' in line and any(expr in line for expr in ('::date', '~~*', 'upper(')))
+            ]
+        else:
+            # SQLite reports a table scan as a bare "SCAN detection_detection"
+            scans = [line for line in plan if line.strip() == 'SCAN detection_detection']
+        self.assertFalse(scans, "Sequential scan in:\n  " + "\n  ".join(plan) + "\nfor: " + sql)
+
+    def test_filtered_history_uses_indexes(self):
+        for query in self.FILTERS:
+            with self.subTest(query=query):
+                _, queries = self._detection_queries('/api/predict/history/filtered/?' + query)
+                for sql in queries:
+                    self.assertNoSequentialScan(sql)
+
+    def test_history_pages_use_indexes(self):
+        response, queries = self._detection_queries('/api/predict/history/')
+        self.assertIsNotNone(response.data['next'])
+        _, next_queries = self._detection_queries(response.data['next'])
+        for sql in queries + next_queries:
+            self.assertNoSequentialScan(sql)
+
+    def test_date_bounds_are_whole_days(self):
+        response = self.client.get('/api/predict/history/filtered/?start_date=2024-03-01&end_date=2024-03-01')
+        created = [row['created_at'] for row in response.data['results']]
+        self.assertEqual(len(created), 2)
+        self.assertTrue(all(value.startswith('2024-03-01') for value in created))
+
+    def test_invalid_filters_are_rejected(self):
+        for query in ('min_conf=high', 'start_date=yesterday', 'end_date=2024-02-30'):
+            with self.subTest(query=query):
+                response = self.client.get('/api/predict/history/filtered/?' + query)
+                self.assertEqual(response.status_code, 400)
+
+
+@override_settings(DETECTION_HISTORY_PAGE_SIZE=2)
+class DetectionHistoryPaginationTests(TestCase):
+    """
+    History pages are keyset pages on (created_at, id): links round-trip in
+    both directions, ties on created_at are split by id, and bad cursors 404.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('grower', password='x')
+        other = User.objects.create_user('neighbour', password='x')
+        start = timezone.make_aware(datetime(2024, 3, 1))
+        # Three detections share the middle timestamp, and another user's rows interleave
+        for hours in (0, 5, 5, 5, 9, 12, 30):
+            for user in (cls.user, other):
+                detection = Detection.objects.create(user=user, image='', result='Tomato__healthy')
+                Detection.objects.filter(pk=detection.pk).update(created_at=start + timedelta(hours=hours))
+        cls.newest_first = list(
+            Detection.objects.filter(user=cls.user).order_by('-created_at', '-id').values_list('id', flat=True)
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _page(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.data
+
+    def test_next_links_walk_every_row_once(self):
+        page = self._page('/api/predict/history/')
+        self.assertIsNone(page['previous'])
+        pages = [[row['id'] for row in page['results']]]
+        while page['next']:
+            page = self._page(page['next'])
+            pages.append([row['id'] for row in page['results']])
+        self.assertEqual(pages, [self.newest_first[i:i + 2] for i in range(0, 7, 2)])
+
+    def test_previous_links_return_the_same_pages(self):
+        page, forward = self._page('/api/predict/history/'), []
+        while True:
+            forward.append([row['id'] for row in page['results']])
+            if not page['next']:
+                break
+            page = self._page(page['next'])
+
+        backward = [forward[-1]]
+        while page['previous']:
+            page = self._page(page['previous'])
+            backward.append([row['id'] for row in page['results']])
+        self.assertEqual(backward[::-1], forward)
+        self.assertIsNone(page['previous'])
+        self.assertIsNotNone(page['next'])
+
+    def test_pages_are_not_counted(self):
+        with CaptureQueriesContext(connection) as captured:
+            self._page('/api/predict/history/')
+        self.assertFalse([q['sql'] for q in captured.captured_queries if 'COUNT(' in q['sql'].upper()])
+
+    def test_invalid_cursors_are_not_found(self):
+        for cursor in ('not-base64!', base64.b64encode(b'p=5').decode(), base64.b64encode(b'p=yesterday|5').decode(),
+                       base64.b64encode(b'p=2024-03-01T05:00:00+00:00|five').decode()):
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self.client.get('/api/predict/history/', {'cursor': cursor}).status_code, 404)
+
+    def test_empty_history_has_no_links(self):
+        self.client.force_authenticate(User.objects.create_user('newcomer', password='x'))
+        self.assertEqual(self._page('/api/predict/history/'), {'next': None, 'previous': None, 'results': []})
+
+
+class DiseaseClassMigrationTests(TransactionTestCase):
+    """
+    0012 links existing detections to classes built from their labels, and
+    0014 drops the label column once every row is linked (restoring it on the way back).
+    """
+
+    def _migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.migrate([('detection', target)])
+        return executor.loader.project_state([('detection', target)]).apps
+
+    def setUp(self):
+        latest = MigrationExecutor(connection).loader.graph.leaf_nodes('detection')
+        self.addCleanup(lambda: MigrationExecutor(connection).migrate(latest))
+
+    def test_backfill_links_detections_by_label(self):
+        apps = self._migrate('0011_diseaseclass')
+        user = apps.get_model('auth', 'User').objects.create(username='grower')
+        Detection = apps.get_model('detection', 'Detection')
+        for label in ('Pepper_bell__bacterial_spot', 'Strawberry___leaf_scorch', 'Tomato__healthy', 'Tomato__healthy', ''):
+            Detection.objects.create(user=user, image='', result=label)
+        apps.get_model('detection', 'ModelVersion').objects.create(version='v1', model_path='m.onnx', labels=['Corn__common_rust'])
+
+        apps = self._migrate('0012_backfill_disease_class')
+        DiseaseClass = apps.get_model('detection', 'DiseaseClass')
+        self.assertEqual(set(DiseaseClass.objects.values_list('label', 'crop', 'disease', 'healthy')), {
+            ('Corn__common_rust', 'Corn', 'common rust', False),
+            ('Pepper_bell__bacterial_spot', 'Pepper bell', 'bacterial spot', False),
+            ('Strawberry___leaf_scorch', 'Strawberry', 'leaf scorch', False),
+            ('Tomato__healthy', 'Tomato', 'healthy', True),
+        })
+        Detection = apps.get_model('detection', 'Detection')
+        self.assertEqual(
+            sorted(Detection.objects.values_list('result', 'disease_class__label'), key=str),
+            sorted([(label, label or None) for label in (
+                'Pepper_bell__bacterial_spot', 'Strawberry___leaf_scorch', 'Tomato__healthy', 'Tomato__healthy', '',
+            )], key=str),
+        )
+
+    def test_label_column_is_dropped_only_after_every_row_is_linked(self):
+        apps = self._migrate('0013_detectiondailystat')
+        user = apps.get_model('auth', 'User').objects.create(username='grower')
+        # Stored after 0012 without a class
+        apps.get_model('detection', 'Detection').objects.create(user=user, image='', result='Rice__hispa')
+
+        apps = self._migrate('0014_remove_detection_result')
+        self.assertEqual(
+            list(apps.get_model('detection', 'Detection').objects.values_list('disease_class__label', flat=True)),
+            ['Rice__hispa'],
+        )
+        apps = self._migrate('0013_detectiondailystat')
+        self.assertEqual(list(apps.get_model('detection', 'Detection').objects.values_list('result', flat=True)), ['Rice__hispa'])
+
+
+class DetectionRollupTests(TestCase):
+    """
+    DetectionDailyStat follows every write to Detection: single and bulk
+    creates, flags, admin-style saves, deletes and the cascade from User.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('grower', password='x')
+
+    def _create(self, count, result='Tomato__late_blight', user=None):
+        detections = [Detection(user=user or self.user, image='', result=result) for _ in range(count)]
+        link_classes(detections)
+        return Detection.objects.bulk_create(detections)
+
+    def _counts(self):
+        return {
+            (stat.disease_class.label if stat.disease_class else None, stat.flagged): stat.count
+            for stat in DetectionDailyStat.objects.select_related('disease_class')
+        }
+
+    def test_creates_are_counted(self):
+        self._create(3)
+        Detection.objects.create(user=self.user, image='', result='Tomato__healthy')
+        Detection.objects.create(user=self.user, image='')
+        self.assertEqual(
+            self._counts(), {('Tomato__late_blight', False): 3, ('Tomato__healthy', False): 1, (None, False): 1},
+        )
+
+    def test_flag_moves_the_detection_once(self):
+        detection, _ = self._create(2)
+        detection.flag('wrong crop')
+        Detection.objects.get(pk=detection.pk).flag('still wrong')
+        self.assertEqual(self._counts(), {('Tomato__late_blight', False): 1, ('Tomato__late_blight', True): 1})
+
+        # Saving a changed flag directly, as the admin does
+        detection.refresh_from_db()
+        detection.flagged = False
+        detection.save()
+        self.assertEqual(self._counts(), {('Tomato__late_blight', False): 2})
+
+    def test_deletes_and_cascades_are_uncounted(self):
+        other = User.objects.create_user('neighbour', password='x')
+        first, _, _ = self._create(3)
+        self._create(2, user=other)
+
+        first.delete()
+        self.assertEqual(self._counts(), {('Tomato__late_blight', False): 4})
+        Detection.objects.filter(user=self.user).delete()
+        self.assertEqual(self._counts(), {('Tomato__late_blight', False): 2})
+        other.delete()
+        self.assertEqual(self._counts(), {})
+
+    def test_rebuild_matches_the_maintained_rollups(self):
+        flagged, _ = self._create(2)
+        flagged.flag('blurry')
+        self._create(1, result='unlabelled')
+        maintained = self._counts()
+
+        DetectionDailyStat.objects.update(count=99)
+        call_command('rebuild_detection_stats', stdout=io.StringIO())
+        self.assertEqual(self._counts(), maintained)
+
+
+class DetectionExportTests(TestCase):
+    """
+    History exports stream CSV or NDJSON, optionally gzipped, in ~64 KiB pieces.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('grower', password='x')
+        cls.other = User.objects.create_user('neighbour', password='x')
+        cls.admin = User.objects.create_user('admin', password='x', is_staff=True)
+        start = timezone.make_aware(datetime(2024, 3, 1))
+        for i, label in enumerate(['Tomato__healthy', 'Tomato__late_blight', 'Corn__common_rust']):
+            detection = Detection.objects.create(user=cls.user, image='', result=label, confidence_score=0.5 + i / 10)
+            Detection.objects.filter(pk=detection.pk).update(created_at=start + timedelta(days=i))
+        Detection.objects.create(user=cls.other, image='', result='Rice__hispa', confidence_score=0.9)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _download(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['X-Accel-Buffering'], 'no')
+        return response, b''.join(response.streaming_content)
+
+    def test_csv_lists_own_history_newest_first(self):
+        response, body = self._download('/api/predict/history/export/')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="prediction_history.csv"')
+        rows = list(csv.reader(io.StringIO(body.decode())))
+        self.assertEqual(tuple(rows[0]), EXPORT_COLUMNS)
+        self.assertEqual([row[1] for row in rows[1:]], ['Corn__common_rust', 'Tomato__late_blight', 'Tomato__healthy'])
+
+    def test_ndjson_has_one_object_per_row(self):
+        response, body = self._download('/api/predict/history/export/', file_format='ndjson')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        records = [json.loads(line) for line in body.decode().splitlines()]
+        self.assertEqual([tuple(record) for record in records], [EXPORT_COLUMNS] * 3)
+        self.assertEqual((records[0]['result'], records[0]['confidence_score']), ('Corn__common_rust', 0.7))
+        self.assertEqual(records[-1]['created_at'], '2024-03-01T00:00:00Z')
+
+    def test_gzip_wraps_either_format(self):
+        for file_format in ('csv', 'ndjson'):
+            with self.subTest(file_format):
+                plain = self._download('/api/predict/history/export/', file_format=file_format)[1]
+                response, body = self._download('/api/predict/history/export/', file_format=file_format, compress='gzip')
+                self.assertEqual(response['Content-Type'], 'application/gzip')
+                self.assertEqual(response['Content-Disposition'], f'attachment; filename="prediction_history.{file_format}.gz"')
+                self.assertEqual(gzip.decompress(body), plain)
+
+    def test_output_is_sent_in_pieces(self):
+        with mock.patch.object(exports, '_CHUNK_BYTES', 1):
+            chunks = list(self.client.get('/api/predict/history/export/').streaming_content)
+        # One piece per row; the header goes out with the first
+        self.assertEqual(len(chunks), 3)
+        self.assertTrue(all(chunk.endswith(b'\r\n') for chunk in chunks))
+
+    def test_unknown_options_are_rejected(self):
+        for params in ({'file_format': 'xlsx'}, {'compress': 'zip'}):
+            with self.subTest(params):
+                self.assertEqual(self.client.get('/api/predict/history/export/', params).status_code, 400)
+
+    def test_admin_export_covers_every_user(self):
+        self.assertEqual(self.client.get('/api/predict/admin/export/').status_code, 403)
+        self.client.force_authenticate(self.admin)
+        response, body = self._download('/api/predict/admin/export/', file_format='ndjson')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="all_predictions.ndjson"')
+        records = [json.loads(line) for line in body.decode().splitlines()]
+        self.assertEqual([record['id'] for record in records], sorted(record['id'] for record in records))
+        self.assertEqual(
+            [(record['user_id'], record['result']) for record in records],
+            [(self.user.pk, 'Tomato__healthy'), (self.user.pk, 'Tomato__late_blight'),
+             (self.user.pk, 'Corn__common_rust'), (self.other.pk, 'Rice__hispa')],
+        )
+
+
+class MicroBatchSchedulerTests(SimpleTestCase):
+    """
+    Concurrent submissions share one run, every caller gets its own rows back,
+    and start-time fair queuing lets a small request overtake a large one.
+    """
+
+    def _rows(self, values):
+        # One (1, 1, 1, 1) row per value, so outputs can be traced back to callers
+        return np.array(values, dtype=np.float32).reshape(-1, 1, 1, 1)
+
+    def test_concurrent_submissions_share_a_batch(self):
+        batches = []
+
+        def run_batch(tensor):
+            batches.append(tensor.shape[0])
+            return tensor[:, 0, 0, 0] * 10, 'v1'
+
+        scheduler = MicroBatchScheduler(run_batch, max_batch_size=4, max_wait_ms=500)
+        start = threading.Barrier(4)
+        results = {}
+
+        def submit(value):
+            start.wait()
+            results[value] = scheduler.submit(self._rows([value]), timeout=5)
+
+        threads = [threading.Thread(target=submit, args=(value,)) for value in (1, 2, 3, 4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(batches, [4])
+        for value, (outputs, tag) in results.items():
+            self.assertEqual(outputs.tolist(), [value * 10])
+            self.assertEqual(tag, 'v1')
+        self.assertEqual(scheduler.stats()['batch_size_histogram'], {4: 1})
+
+    def test_large_request_is_sliced_and_returned_in_order(self):
+        batches = []
+
+        def run_batch(tensor):
+            batches.append(tensor.shape[0])
+            return tensor[:, 0, 0, 0], 'v1'
+
+        scheduler = MicroBatchScheduler(run_batch, max_batch_size=4, max_wait_ms=0, quantum=3)
+        outputs, _ = scheduler.submit(self._rows(range(10)), timeout=5)
+        self.assertEqual(outputs.tolist(), list(range(10)))
+        self.assertEqual(sum(batches), 10)
+        self.assertTrue(all(size <= 4 for size in batches))
+
+    def test_small_flow_overtakes_a_large_one(self):
+        gate = threading.Event()
+        batches = []
+
+        def run_batch(tensor):
+            batches.append(sorted(set(tensor[:, 0, 0, 0].tolist())))
+            gate.wait(5)
+            return tensor[:, 0, 0, 0], None
+
+        scheduler = MicroBatchScheduler(run_batch, max_batch_size=2, max_wait_ms=0, quantum=2)
+
+        def submit(value, rows, flow):
+            with inference_flow(flow):
+                scheduler.submit(self._rows([value] * rows), timeout=5)
+
+        bulk = threading.Thread(target=submit, args=(1, 8, 'bulk'))
+        bulk.start()
+        while not batches:
+            time.sleep(0.001)
+        # The bulk flow's first slice is running and its other three are queued
+        single = threading.Thread(target=submit, args=(2, 1, 'interactive'))
+        single.start()
+        while scheduler.stats()['queue_depth'] < 4:
+            time.sleep(0.001)
+        gate.set()
+        bulk.join()
+        single.join()
+
+        self.assertEqual(batches, [[1], [2], [1], [1], [1]])
+
+    def test_errors_reach_every_caller(self):
+        def run_batch(tensor):
+            raise RuntimeError('session failed')
+
+        scheduler = MicroBatchScheduler(run_batch, max_batch_size=4, max_wait_ms=0)
+        with self.assertRaisesMessage(RuntimeError, 'session failed'):
+            scheduler.submit(self._rows([1, 2]), timeout=5)
+
+    def test_slices_scored_before_a_swap_are_rescored(self):
+        calls = []
+
+        def run_batch(tensor):
+            # The model swaps after the first batch, and the new one has an extra class
+            calls.append(tensor[:, 0, 0, 0].tolist())
+            classes, tag = (2, 'v1') if len(calls) == 1 else (3, 'v2')
+            return np.tile(tensor[:, 0, 0, :1], (1, classes)), tag
+
+        scheduler = MicroBatchScheduler(run_batch, max_batch_size=2, max_wait_ms=0, quantum=2)
+        outputs, tag = scheduler.submit(self._rows([1, 2, 3, 4]), timeout=5)
+
+        self.assertEqual(tag, 'v2')
+        self.assertEqual(outputs.shape, (4, 3))
+        self.assertEqual(outputs[:, 0].tolist(), [1, 2, 3, 4])
+        self.assertEqual(calls, [[1, 2], [3, 4], [1, 2]])
+
+    def test_failed_slice_cancels_the_rest(self):
+        calls = []
+
+        def run_batch(tensor):
+            calls.append(tensor.shape[0])
+            if len(calls) == 1:
+                raise RuntimeError('session failed')
+            return tensor[:, 0, 0, 0], 'v1'
+
+        scheduler = MicroBatchScheduler(run_batch, max_batch_size=1, max_wait_ms=0, quantum=1)
+        with self.assertRaisesMessage(RuntimeError, 'session failed'):
+            scheduler.submit(self._rows([1, 2, 3]), timeout=5)
+        outputs, _ = scheduler.submit(self._rows([4]), timeout=5)
+
+        self.assertEqual(outputs.tolist(), [4])
+        self.assertEqual(calls, [1, 1])
+
+    def test_timed_out_request_is_not_scored(self):
+        gate = threading.Event()
+        scored = []
+
+        def run_batch(tensor):
+            gate.wait(5)
+            scored.extend(tensor[:, 0, 0, 0].tolist())
+            return tensor[:, 0, 0, 0], 'v1'
+
+        scheduler = MicroBatchScheduler(run_batch, max_batch_size=1, max_wait_ms=0, quantum=1)
+        with self.assertRaises(TimeoutError):
+            scheduler.submit(self._rows([1, 2, 3]), timeout=0.05)
+        gate.set()
+        scheduler.submit(self._rows([4]), timeout=5)
+
+        self.assertEqual(scored, [1, 4])
+
+
+@override_settings(PREDICTION_CACHE_ENABLED=False, PREDICTION_QUALITY_MODE='off')
+class PredictBatchTests(SimpleTestCase):
+    """
+    A multi-image upload is scored with a single forward pass.
+    """
+
+    def _score(self, tensor):
+        model = SimpleNamespace(labels=['Tomato__healthy', 'Tomato__late_blight'], version='v1')
+        self.forward_passes.append(tensor.shape)
+        return [(np.array([0.2, 0.8], dtype=np.float32), model, onnx_predictor.ENSEMBLE_STAGE) for _ in tensor]
+
+    def setUp(self):
+        self.forward_passes = []
+        patcher = mock.patch.object(onnx_predictor, 'score_batch', side_effect=self._score)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_one_forward_pass_for_all_images(self):
+        results = onnx_predictor.predict_batch([_jpeg(f'leaf{i}.jpg') for i in range(3)])
+        self.assertEqual(self.forward_passes, [(3, 224, 224, 3)])
+        self.assertEqual([r['label'] for r in results], ['Tomato__late_blight'] * 3)
+
+    def test_unreadable_image_gets_its_own_error(self):
+        broken = SimpleUploadedFile('broken.jpg', b'not an image', content_type='image/jpeg')
+        results = onnx_predictor.predict_batch([_jpeg('a.jpg'), broken, _jpeg('b.jpg')])
+        self.assertEqual(self.forward_passes, [(2, 224, 224, 3)])
+        self.assertIn('error', results[1])
+        self.assertEqual(results[0]['confidence'], 0.8)
+        self.assertEqual(results[2]['model_version'], 'v1')
+
+
+def _leaf(color=(60, 140, 40), size=(320, 240), amplitude=30, seed=0):
+    """
+    A flat colour with grey grain, so it has detail but no extra hue.
+    """
+    grain = np.random.default_rng(seed).uniform(-amplitude, amplitude, (size[1], size[0], 1))
+    pixels = np.clip(np.array(color, dtype=np.float32) + grain, 0, 255).astype(np.uint8)
+    return Image.fromarray(pixels, 'RGB')
+
+
+def _png(image, name='leaf.png'):
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+class PreprocessPoolTests(SimpleTestCase):
+    """
+    run_all fans per-image work out over the preprocessing threads and returns
+    outcomes in input order, with each failure in its own slot.
+    """
+
+    def setUp(self):
+        executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='preprocess')
+        self.addCleanup(executor.shutdown)
+        patcher = mock.patch.object(preprocess_pool, '_executor', executor)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_outcomes_keep_input_order(self):
+        # All four tasks must be running at once to pass the barrier; later ones finish first
+        barrier = threading.Barrier(4, timeout=5)
+
+        def task(i):
+            barrier.wait()
+            time.sleep((3 - i) * 0.02)
+            return i * i, threading.current_thread().name
+
+        outcomes = preprocess_pool.run_all(task, 4)
+        self.assertEqual([value for value, _ in outcomes], [0, 1, 4, 9])
+        self.assertEqual(len({thread for _, thread in outcomes}), 4)
+
+    def test_errors_stay_in_their_slot(self):
+        def task(i):
+            if i % 2:
+                raise ValueError(f'image {i} is corrupt')
+            return i
+
+        outcomes = preprocess_pool.run_all(task, 5)
+        self.assertEqual([o if isinstance(o, int) else str(o) for o in outcomes], [0, 'image 1 is corrupt', 2, 'image 3 is corrupt', 4])
+        self.assertIsInstance(outcomes[1], ValueError)
+
+    def test_single_items_run_on_the_calling_thread(self):
+        caller = threading.current_thread().name
+        self.assertEqual(preprocess_pool.run_all(lambda i: threading.current_thread().name, 1), [caller])
+        self.assertEqual(preprocess_pool.run_all(lambda i: i, 0), [])
+
+    def test_timed_task_sums_time_across_threads_and_failures(self):
+        def task(i):
+            time.sleep(0.02)
+            if i == 2:
+                raise ValueError('bad')
+
+        timed = preprocess_pool.TimedTask(task)
+        started = time.perf_counter()
+        preprocess_pool.run_all(timed, 4)
+        wall = time.perf_counter() - started
+        self.assertGreaterEqual(timed.busy, 0.08)
+        self.assertLess(wall, timed.busy)
+
+    def test_stats(self):
+        stats = preprocess_pool.PreprocessStats()
+        stats.record(4, 0.010, 0.032)
+        stats.record(2, 0.030, 0.008)
+        report = stats.stats()
+        self.assertEqual((report['requests'], report['images'], report['mean_image_ms']), (2, 6, 6.667))
+        self.assertEqual(report['request_wall_ms'], {'mean': 20.0, 'p50': 30.0, 'p95': 30.0})
+
+
+class CascadeTests(SimpleTestCase):
+    """
+    The fast model answers rows it is confident about; only the rest reach the ensemble.
+    """
+
+    def setUp(self):
+        self.fast = SimpleNamespace(labels=['Tomato__healthy', 'Tomato__late_blight'], version='fast-v1')
+        # Same classes in another output order, so agreement is compared by label
+        self.ensemble = SimpleNamespace(labels=['Tomato__late_blight', 'Tomato__healthy'], version='v2')
+        self.calls = []
+
+    def _run_stage(self, fast_rows, ensemble_rows):
+        def run_stage(tensor, stage):
+            self.calls.append((stage, tensor[:, 0, 0, 0].tolist()))
+            if stage == FAST_STAGE:
+                return np.array(fast_rows, dtype=np.float32), self.fast
+            return np.array(ensemble_rows, dtype=np.float32), self.ensemble
+        return run_stage
+
+    def _tensor(self, rows):
+        # Each row is filled with its index, so the ensemble's input shows which rows were escalated
+        return np.arange(rows, dtype=np.float32).reshape(rows, 1, 1, 1) * np.ones((rows, 2, 2, 3), dtype=np.float32)
+
+    def test_rows_below_the_threshold_are_escalated(self):
+        run_stage = self._run_stage(
+            [[0.95, 0.05], [0.4, 0.6], [0.1, 0.9], [0.7, 0.3]],
+            [[0.2, 0.8], [0.9, 0.1]],
+        )
+        scored = run_cascade(self._tensor(4), run_stage, 0.9, CascadeStats())
+        self.assertEqual(self.calls, [(FAST_STAGE, [0, 1, 2, 3]), (ENSEMBLE_STAGE, [1, 3])])
+        # A confidence equal to the threshold is enough
+        self.assertEqual([stage for _, _, stage in scored], [FAST_STAGE, ENSEMBLE_STAGE, FAST_STAGE, ENSEMBLE_STAGE])
+        self.assertEqual([model for _, model, _ in scored], [self.fast, self.ensemble, self.fast, self.ensemble])
+        np.testing.assert_allclose(scored[1][0], [0.2, 0.8])
+        np.testing.assert_allclose(scored[3][0], [0.9, 0.1])
+
+    def test_confident_batches_skip_the_ensemble(self):
+        scored = run_cascade(self._tensor(2), self._run_stage([[0.99, 0.01], [0.05, 0.95]], []), 0.9, CascadeStats())
+        self.assertEqual([stage for stage, _ in self.calls], [FAST_STAGE])
+        self.assertEqual({stage for _, _, stage in scored}, {FAST_STAGE})
+
+    def test_stats_count_stages_agreement_and_confidence(self):
+        stats = CascadeStats()
+        run_stage = self._run_stage(
+            [[1.0, 0.0], [0.4, 0.6], [0.7, 0.3]],
+            # Row 1: both say late blight. Row 2: fast says healthy, the ensemble late blight
+            [[0.8, 0.2], [0.6, 0.4]],
+        )
+        run_cascade(self._tensor(3), run_stage, 0.9, stats)
+        run_cascade(self._tensor(1), self._run_stage([[0.1, 0.9]], []), 0.9, stats)
+        report = stats.stats()
+        self.assertEqual(
+            {key: report[key] for key in ('images', 'resolved_fast', 'resolved_ensemble', 'fast_fraction', 'escalated_agreement')},
+            {'images': 4, 'resolved_fast': 2, 'resolved_ensemble': 2, 'fast_fraction': 0.5, 'escalated_agreement': 0.5},
+        )
+        histogram = {bucket: count for bucket, count in report['fast_confidence_histogram'].items() if count}
+        # A confidence of exactly 1.0 lands in the top bin
+        self.assertEqual(histogram, {'0.60-0.65': 1, '0.70-0.75': 1, '0.90-0.95': 1, '0.95-1.00': 1})
+
+    @override_settings(PREDICTION_CASCADE_ENABLED=True, PREDICTION_CASCADE_THRESHOLD=0.8)
+    def test_score_batch_uses_the_cascade_threshold_setting(self):
+        run_stage = self._run_stage([[0.85, 0.15], [0.75, 0.25]], [[0.3, 0.7]])
+        with mock.patch.object(onnx_predictor, 'run_inference', side_effect=run_stage), \
+                mock.patch.object(onnx_predictor, 'cascade_stats', CascadeStats()):
+            scored = onnx_predictor.score_batch(self._tensor(2))
+        self.assertEqual([stage for _, _, stage in scored], [FAST_STAGE, ENSEMBLE_STAGE])
+        self.assertEqual(onnx_predictor._to_prediction(*scored[1])['stage'], ENSEMBLE_STAGE)
+        self.assertEqual(onnx_predictor._cache_version('v2'), 'v2+cascade@0.8')
+
+
+class TensorUploadTests(SimpleTestCase):
+    """
+    Tensors preprocessed on the phone arrive as raw bytes or .npy files and are
+    copied into the batch without decoding.
+    """
+
+    def _npy(self, array):
+        buffer = io.BytesIO()
+        np.save(buffer, array)
+        return SimpleUploadedFile('leaf.npy', buffer.getvalue(), content_type='application/octet-stream')
+
+    def _raw(self, array):
+        return SimpleUploadedFile('leaf.bin', np.ascontiguousarray(array).tobytes(), content_type='application/octet-stream')
+
+    def _into(self, upload):
+        out = np.empty((224, 224, 3), dtype=np.float32)
+        onnx_predictor.preprocess_tensor_into(upload, out)
+        return out
+
+    def test_raw_dtype_follows_from_size(self):
+        for dtype in (np.uint8, np.float16, np.float32):
+            with self.subTest(dtype=dtype.__name__):
+                tensor = onnx_predictor.load_tensor(self._raw(np.zeros((224, 224, 3), dtype=dtype)))
+                self.assertEqual((tensor.shape, tensor.dtype), ((224, 224, 3), np.dtype(dtype)))
+
+    def test_raw_of_any_other_size_is_rejected(self):
+        with self.assertRaisesMessage(ValueError, 'Raw tensor is 150527 bytes'):
+            onnx_predictor.load_tensor(self._raw(np.zeros(224 * 224 * 3 - 1, dtype=np.uint8)))
+
+    def test_npy_accepts_single_and_batched_shapes(self):
+        for shape in ((224, 224, 3), (1, 224, 224, 3)):
+            with self.subTest(shape=shape):
+                array = np.random.default_rng(0).random(shape, dtype=np.float32)
+                np.testing.assert_array_equal(onnx_predictor.load_tensor(self._npy(array)), array.reshape(224, 224, 3))
+
+    def test_npy_shape_and_dtype_are_checked(self):
+        cases = [
+            (np.zeros((224, 224, 4), dtype=np.float32), 'shape (224, 224, 4)'),
+            (np.zeros((2, 224, 224, 3), dtype=np.float32), 'shape (2, 224, 224, 3)'),
+            (np.zeros((3, 224, 224), dtype=np.float32), 'shape (3, 224, 224)'),
+            (np.zeros((224, 224, 3), dtype=np.float64), 'dtype float64'),
+            (np.zeros((224, 224, 3), dtype='>f4'), 'dtype >f4'),
+        ]
+        for array, message in cases:
+            with self.subTest(message), self.assertRaisesMessage(ValueError, message):
+                onnx_predictor.load_tensor(self._npy(array))
+
+    def test_fortran_ordered_npy_is_rejected(self):
+        with self.assertRaisesMessage(ValueError, 'Fortran-ordered'):
+            onnx_predictor.load_tensor(self._npy(np.asfortranarray(np.zeros((224, 224, 3), dtype=np.float32))))
+
+    def test_uint8_is_scaled_and_floats_are_copied(self):
+        pixels = np.full((224, 224, 3), 51, dtype=np.uint8)
+        pixels[0, 0] = 255
+        scaled = self._into(self._raw(pixels))
+        self.assertAlmostEqual(float(scaled[1, 1, 0]), 0.2, places=6)
+        self.assertEqual(float(scaled[0, 0, 0]), 1.0)
+
+        half = np.full((224, 224, 3), 0.5, dtype=np.float16)
+        np.testing.assert_array_equal(self._into(self._npy(half)), np.full((224, 224, 3), 0.5, dtype=np.float32))
+
+    def test_errors_name_the_tensor_upload(self):
+        with self.assertRaisesMessage(ValueError, 'Tensor upload rejected: Raw tensor is 3 bytes'):
+            self._into(SimpleUploadedFile('leaf.bin', b'abc'))
+
+    @override_settings(PREDICTION_CACHE_ENABLED=False, PREDICTION_QUALITY_MODE='off')
+    def test_tensors_are_scored_after_images(self):
+        seen = []
+
+        def score_batch(tensor):
+            seen.append(tensor.copy())
+            model = SimpleNamespace(labels=['Tomato__healthy', 'Tomato__late_blight'], version='v1')
+            return [(np.array([0.2, 0.8], dtype=np.float32), model, onnx_predictor.ENSEMBLE_STAGE) for _ in tensor]
+
+        with mock.patch.object(onnx_predictor, 'score_batch', side_effect=score_batch):
+            results = onnx_predictor.predict_batch([_jpeg()], [self._raw(np.full((224, 224, 3), 255, dtype=np.uint8))])
+        self.assertEqual(len(results), 2)
+        self.assertEqual(seen[0].shape, (2, 224, 224, 3))
+        np.testing.assert_array_equal(seen[0][1], np.ones((224, 224, 3), dtype=np.float32))
+
+
+class QualityScreenTests(SimpleTestCase):
+    """
+    The prescreen flags blurred, dark, overexposed and leafless photos; 'reject'
+    mode stops the first three from being scored, 'tag' mode only warns.
+    """
+
+    def _screen(self, image):
+        batch = np.empty((1,) + onnx_predictor.EXPECTED_SHAPE[1:], dtype=np.float32)
+        onnx_predictor.preprocess_into(_png(image), batch[0])
+        return quality.screen(batch, [image])[0]
+
+    def test_usable_leaves_pass(self):
+        for image in (_leaf(), _leaf(color=(130, 80, 35))):  # green and brown
+            metrics, reasons = self._screen(image)
+            self.assertEqual(reasons, [])
+            self.assertEqual(metrics['foliage_coverage'], 1.0)
+
+    def test_bad_photos_are_flagged(self):
+        cases = [
+            (_leaf().filter(ImageFilter.GaussianBlur(6)), 'blurry'),
+            (_leaf(color=(9, 21, 6), amplitude=6), 'too_dark'),
+            (_leaf(color=(250, 250, 245), amplitude=5), 'too_bright'),
+            (_leaf(color=(128, 128, 128)), 'no_leaf'),
+        ]
+        for image, reason in cases:
+            with self.subTest(reason):
+                self.assertIn(reason, self._screen(image)[1])
+
+    def test_thresholds_come_from_settings(self):
+        with override_settings(PREDICTION_QUALITY_MIN_SHARPNESS=1e6, PREDICTION_QUALITY_MIN_FOLIAGE_COVERAGE=0.0):
+            self.assertEqual(self._screen(_leaf(color=(128, 128, 128)))[1], ['blurry'])
+        with override_settings(PREDICTION_QUALITY_FOLIAGE_MIN_SATURATION=0.9):
+            self.assertEqual(self._screen(_leaf())[1], ['no_leaf'])
+
+    def test_fine_detail_lost_at_224_is_not_blurry(self):
+        # A one-pixel checkerboard averages to a flat colour when scaled to 224
+        checker = (np.indices((1792, 1792)).sum(axis=0) % 2 * 50 - 25)[..., np.newaxis]
+        image = Image.fromarray((np.array([60, 140, 40]) + checker).astype(np.uint8), 'RGB')
+        metrics, reasons = self._screen(image)
+        self.assertNotIn('blurry', reasons)
+        self.assertGreater(metrics['sharpness'], 1000)
+
+    def test_native_sharpness_measures_the_centre_crop(self):
+        image = _leaf(size=(1024, 1024))
+        centre = (256, 256, 768, 768)
+        flat_centre = image.copy()
+        flat_centre.paste((60, 140, 40), centre)
+        self.assertLess(quality.native_sharpness(flat_centre), 1.0)
+        only_centre = Image.new('RGB', (1024, 1024), (60, 140, 40))
+        only_centre.paste(image.crop(centre), centre[:2])
+        self.assertAlmostEqual(quality.native_sharpness(only_centre), quality.native_sharpness(image), places=2)
+
+    def _predict(self, mode):
+        scored = []
+
+        def score_batch(tensor):
+            scored.append(tensor.shape[0])
+            model = SimpleNamespace(labels=['Tomato__healthy', 'Tomato__late_blight'], version='v1')
+            return [(np.array([0.2, 0.8], dtype=np.float32), model, onnx_predictor.ENSEMBLE_STAGE) for _ in tensor]
+
+        uploads = [
+            _png(_leaf()),
+            _png(_leaf().filter(ImageFilter.GaussianBlur(6))),
+            _png(_leaf(color=(128, 128, 128))),
+        ]
+        with override_settings(PREDICTION_CACHE_ENABLED=False, PREDICTION_QUALITY_MODE=mode), \
+                mock.patch.object(onnx_predictor, 'score_batch', side_effect=score_batch):
+            return onnx_predictor.predict_batch(uploads), scored
+
+    def test_reject_mode_skips_blocking_reasons_only(self):
+        (good, blurred, leafless), scored = self._predict('reject')
+        self.assertEqual(scored, [2])
+        self.assertNotIn('quality_warnings', good)
+        self.assertEqual(blurred['rejected'], ['blurry'])
+        self.assertIn('hold the phone steady', blurred['error'])
+        self.assertNotIn('label', blurred)
+        # no_leaf is a heuristic, so it warns instead of blocking
+        self.assertEqual((leafless['label'], leafless['quality_warnings']), ('Tomato__late_blight', ['no_leaf']))
+
+    def test_tag_mode_scores_everything(self):
+        (good, blurred, leafless), scored = self._predict('tag')
+        self.assertEqual(scored, [3])
+        self.assertNotIn('quality_warnings', good)
+        self.assertEqual(blurred['quality_warnings'], ['blurry'])
+        self.assertEqual(leafless['quality_warnings'], ['no_leaf'])
+
+
+@override_settings(PREDICTION_BACKEND='local', PREDICTION_MODEL_PATH='/models/bundled.onnx')
+class ModelReadinessTests(TestCase):
+    """
+    The model loads lazily: the readiness probe answers 503 and starts a
+    background load, then 200 once the model is warm.
+    """
+
+    def setUp(self):
+        self.registry = ModelRegistry(default_labels=['Tomato__healthy', 'Tomato__late_blight'])
+        self.loaded = threading.Event()
+
+        def load(spec):
+            self.loaded.wait(5)
+            return _fake_load(spec)
+
+        for patcher in (
+            mock.patch.object(onnx_predictor, 'registry', self.registry),
+            mock.patch('detection.utils.model_registry.load_model', side_effect=load),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(self.loaded.set)
+
+    def test_probe_starts_loading_and_reports_ready(self):
+        self.assertEqual(self.registry.status()['state'], 'not_loaded')
+
+        response = self.client.get('/health/ready')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['status'], 'not_ready')
+        self.assertEqual(self.registry.status()['state'], 'loading')
+        # A second probe while loading does not start another load
+        self.assertFalse(self.registry.mark_loading())
+
+        self.loaded.set()
+        for _ in range(500):
+            if self.registry.status()['ready']:
+                break
+            time.sleep(0.01)
+        response = self.client.get('/health/ready')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['model']['version'], 'bundled')
+        self.assertEqual(response.json()['model']['state'], 'ready')
+
+    def test_failed_load_is_reported(self):
+        with mock.patch('detection.utils.model_registry.load_model', side_effect=RuntimeError('corrupt model')):
+            with self.assertRaises(RuntimeError), self.assertLogs('detection.utils.model_registry', 'ERROR'):
+                self.registry.get_active()
+        status = self.registry.status()
+        self.assertEqual(status['state'], 'failed')
+        self.assertEqual(status['error'], 'corrupt model')
+        self.assertFalse(status['ready'])
+
+
+@override_settings(PREDICTION_MODEL_PATH='/models/bundled.onnx', PREDICTION_MODEL_PRECISION='fp32')
+class ModelRegistryHotSwapTests(TestCase):
+    """
+    Activating a ModelVersion swaps it in without dropping requests, and a
+    database outage never unloads the model being served.
+    """
+    LABELS = ['Tomato__healthy', 'Tomato__late_blight']
+
+    def setUp(self):
+        self.load = mock.patch('detection.utils.model_registry.load_model', side_effect=_fake_load).start()
+        self.addCleanup(mock.patch.stopall)
+        self.registry = ModelRegistry(default_labels=self.LABELS)
+
+    def _activate(self, version):
+        ModelVersion.objects.update(is_active=False)
+        return ModelVersion.objects.create(
+            version=version, model_path=f'/models/{version}.onnx', labels=self.LABELS,
+            is_active=True, activated_at=timezone.now(),
+        )
+
+    def _wait_for_version(self, version):
+        for _ in range(500):
+            if self.registry.status()['version'] == version:
+                return
+            time.sleep(0.01)
+        self.fail(f"{version} was never swapped in: {self.registry.status()}")
+
+    def test_first_load_uses_the_active_version(self):
+        self._activate('v2')
+        self.assertEqual(self.registry.get_active().version, 'v2')
+        self.assertEqual(self.load.call_count, 1)
+
+    def test_bundled_model_without_an_active_version(self):
+        self.assertEqual(self.registry.get_active().version, 'bundled')
+
+    def test_poll_swaps_to_a_newly_activated_version(self):
+        self.registry.get_active()
+        listener = mock.Mock()
+        self.registry.on_swap(listener)
+
+        self._activate('v2')
+        self.registry.poll(force=True)
+        self._wait_for_version('v2')
+
+        self.assertEqual(self.registry.get_active().path, '/models/v2.onnx')
+        listener.assert_called_once_with(self.registry.get_active())
+        self.assertEqual(self.registry.status()['recent_swaps'][-1]['from'], 'bundled')
+
+    def test_in_flight_request_keeps_its_session(self):
+        old = self.registry.get_active()
+        with self.registry.lease() as model:
+            self.registry.swap(ModelSpec('v2', '/models/v2.onnx', self.LABELS))
+            self.assertEqual(self.registry.get_active().version, 'v2')
+            # The retired model stays usable until its last lease is released
+            self.assertIsNotNone(model.session)
+            self.assertEqual(model.run(np.zeros((1, 224, 224, 3), dtype=np.float32)).shape, (1, 2))
+        self.assertIsNone(old.session)
+
+    def test_failed_load_keeps_the_current_model(self):
+        self.registry.get_active()
+        self.load.side_effect = RuntimeError('corrupt model')
+        with self.assertLogs('detection.utils.model_registry', 'ERROR'):
+            self.registry.swap(ModelSpec('v2', '/models/v2.onnx', self.LABELS))
+        self.assertEqual(self.registry.get_active().version, 'bundled')
+        self.assertIsNone(self.registry.status()['pending_version'])
+
+    def test_database_error_keeps_the_current_model(self):
+        self._activate('v2')
+        self.registry.get_active()
+        with mock.patch.object(ModelVersion.objects, 'filter', side_effect=DatabaseError('connection lost')):
+            with self.assertLogs('detection.utils.model_registry', 'WARNING'):
+                self.registry.poll(force=True)
+        self.assertEqual(self.registry.get_active().version, 'v2')
+        self.assertIsNone(self.registry.status()['pending_version'])
+        self.assertEqual(self.load.call_count, 1)
+
+    def _poll_until_loaded(self, loads):
+        self.registry.poll(force=True)
+        for _ in range(500):
+            if self.load.call_count == loads and self.registry.status()['pending_version'] is None:
+                return
+            time.sleep(0.01)
+        self.fail(f"expected {loads} loads, saw {self.load.call_count}: {self.registry.status()}")
+
+    @override_settings(PREDICTION_MODEL_RETRY_SECONDS=60)
+    def test_failing_version_is_retried_with_backoff(self):
+        self.registry.get_active()
+        self._activate('v2')
+        self.load.side_effect = RuntimeError('corrupt model')
+        with self.assertLogs('detection.utils.model_registry', 'ERROR'):
+            self._poll_until_loaded(2)
+        status = self.registry.status()
+        self.assertEqual((status['version'], status['failed_version']), ('bundled', 'v2'))
+        self.assertAlmostEqual(status['retry_in_seconds'], 60, delta=1)
+
+        # Polls during the backoff do not reload the broken file
+        self.registry.poll(force=True)
+        self.assertEqual(self.load.call_count, 2)
+
+        # Once it elapses the version is tried again, and the next wait doubles
+        self.registry._retry_at = 0.0
+        with self.assertLogs('detection.utils.model_registry', 'ERROR'):
+            self._poll_until_loaded(3)
+        self.assertAlmostEqual(self.registry.status()['retry_in_seconds'], 120, delta=1)
+
+        self.load.side_effect = _fake_load
+        self.registry._retry_at = 0.0
+        self._poll_until_loaded(4)
+        status = self.registry.status()
+        self.assertEqual((status['version'], status['failed_version'], status['retry_in_seconds']), ('v2', None, None))
+
+    def test_swap_history_is_bounded(self):
+        self.registry.get_active()
+        for n in range(2, 10):
+            self.registry.swap(ModelSpec(f'v{n}', f'/models/v{n}.onnx', self.LABELS))
+        swaps = self.registry.status()['recent_swaps']
+        self.assertEqual(len(swaps), ModelRegistry.SWAP_HISTORY)
+        self.assertEqual((swaps[0]['from'], swaps[-1]['to']), ('v4', 'v9'))
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'prediction-tests'},
+})
+class PredictionCacheTests(SimpleTestCase):
+    """
+    Repeated uploads are answered from the cache, per model version, with a
+    bounded local tier and a best-effort shared tier.
+    """
+    PREDICTION = {'label': 'Tomato__healthy', 'confidence': 0.9, 'model_version': 'v1', 'stage': 'ensemble'}
+
+    def test_entries_are_per_model_version(self):
+        cache = PredictionCache()
+        cache.set('digest', 'v1', self.PREDICTION)
+        self.assertEqual(cache.get('digest', 'v1'), self.PREDICTION)
+        self.assertIsNone(cache.get('digest', 'v2'))
+        self.assertEqual(cache.stats()['local_hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_callers_get_copies(self):
+        cache = PredictionCache()
+        cache.set('digest', 'v1', self.PREDICTION)
+        cache.get('digest', 'v1')['label'] = 'changed'
+        self.assertEqual(cache.get('digest', 'v1')['label'], 'Tomato__healthy')
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = PredictionCache(max_entries=2)
+        cache.set('a', 'v1', self.PREDICTION)
+        cache.set('b', 'v1', self.PREDICTION)
+        cache.get('a', 'v1')
+        cache.set('c', 'v1', self.PREDICTION)
+        self.assertIsNone(cache.get('b', 'v1'))
+        self.assertIsNotNone(cache.get('a', 'v1'))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_entries_expire(self):
+        cache = PredictionCache(ttl=60)
+        with mock.patch('detection.utils.prediction_cache.time.monotonic', return_value=1000.0):
+            cache.set('digest', 'v1', self.PREDICTION)
+        with mock.patch('detection.utils.prediction_cache.time.monotonic', return_value=1061.0):
+            self.assertIsNone(cache.get('digest', 'v1'))
+        self.assertEqual(cache.stats()['expirations'], 1)
+
+    def test_shared_tier_fills_the_local_one(self):
+        PredictionCache(shared_alias='shared').set('digest', 'v1', self.PREDICTION)
+        other_process = PredictionCache(shared_alias='shared')
+        self.assertEqual(other_process.get('digest', 'v1'), self.PREDICTION)
+        self.assertEqual(other_process.get('digest', 'v1'), self.PREDICTION)
+        self.assertEqual(other_process.stats()['shared_hits'], 1)
+        self.assertEqual(other_process.stats()['local_hits'], 1)
+
+    def test_shared_tier_failures_are_misses(self):
+        cache = PredictionCache(shared_alias='shared')
+        broken = mock.Mock(**{'get.side_effect': ConnectionError('down'), 'set.side_effect': ConnectionError('down')})
+        with mock.patch('detection.utils.prediction_cache.caches', {'shared': broken}), \
+                self.assertLogs('detection.utils.prediction_cache', 'WARNING'):
+            self.assertIsNone(cache.get('digest', 'v1'))
+            cache.set('digest', 'v1', self.PREDICTION)
+        self.assertEqual(cache.get('digest', 'v1'), self.PREDICTION)
+        self.assertEqual(cache.stats()['shared_errors'], 2)
+
+    def test_clear_local_drops_every_entry(self):
+        cache = PredictionCache()
+        cache.set('digest', 'v1', self.PREDICTION)
+        cache.clear_local()
+        self.assertIsNone(cache.get('digest', 'v1'))
+
+    def test_digest_depends_only_on_content(self):
+        self.assertEqual(content_digest(_jpeg('a.jpg')), content_digest(_jpeg('b.jpg')))
+        self.assertNotEqual(content_digest(_jpeg(color=(0, 0, 0))), content_digest(_jpeg()))
+
+
+@override_settings(PREDICTION_CACHE_ENABLED=True, PREDICTION_CASCADE_ENABLED=False, PREDICTION_QUALITY_MODE='off')
+class PredictBatchCacheTests(SimpleTestCase):
+    """
+    predict_batch answers repeated uploads from the cache and files new
+    answers under the model version that produced them.
+    """
+
+    def setUp(self):
+        self.cache = PredictionCache()
+        self.active_version = 'v1'
+        self.scoring_version = 'v1'
+        self.scored = 0
+
+        def score(tensor):
+            self.scored += tensor.shape[0]
+            model = SimpleNamespace(labels=['Tomato__healthy', 'Tomato__late_blight'], version=self.scoring_version)
+            return [(np.array([0.3, 0.7], dtype=np.float32), model, onnx_predictor.ENSEMBLE_STAGE) for _ in tensor]
+
+        for patcher in (
+            mock.patch.object(onnx_predictor, 'prediction_cache', self.cache),
+            mock.patch.object(onnx_predictor, 'score_batch', side_effect=score),
+            mock.patch.object(onnx_predictor, 'active_model_version', side_effect=lambda: self.active_version),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_repeated_upload_skips_inference(self):
+        first = onnx_predictor.predict_batch([_jpeg()])
+        second = onnx_predictor.predict_batch([_jpeg('again.jpg')])
+        self.assertEqual(self.scored, 1)
+        self.assertEqual(first, second)
+
+    def test_results_are_keyed_by_the_scoring_model(self):
+        # The model was swapped between the cache lookup and inference
+        self.scoring_version = 'v2'
+        onnx_predictor.predict_batch([_jpeg()])
+        digest = content_digest(_jpeg())
+        self.assertIsNone(self.cache.get(digest, 'v1'))
+        self.assertEqual(self.cache.get(digest, 'v2')['model_version'], 'v2')
+
+
+class InferencePoolProtocolTests(SimpleTestCase):
+    """
+    Web workers talk to the inference pool in length-prefixed frames over a
+    Unix socket; labels only travel when the client has not seen a version.
+    """
+
+    def test_frames_round_trip(self):
+        left, right = socket.socketpair()
+        self.addCleanup(left.close)
+        self.addCleanup(right.close)
+        tensor = np.arange(2 * 224 * 224 * 3, dtype=np.float32).reshape(2, 224, 224, 3)
+
+        sender = threading.Thread(target=lambda: (send_frame(left, {'op': 'run'}, tensor), send_frame(left, {'op': 'info'})))
+        sender.start()
+        header, array = recv_frame(right)
+        self.assertEqual(header['op'], 'run')
+        np.testing.assert_array_equal(array, tensor)
+        header, array = recv_frame(right)
+        sender.join()
+        self.assertEqual(header, {'op': 'info'})
+        self.assertIsNone(array)
+
+    def test_closed_connection_raises(self):
+        left, right = socket.socketpair()
+        self.addCleanup(right.close)
+        left.close()
+        with self.assertRaises(ConnectionError):
+            recv_frame(right)
+
+    def _serve(self, **patches):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        for name, value in patches.items():
+            patcher = mock.patch.object(onnx_predictor, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        path = os.path.join(directory, 'pool.sock')
+        server = _PoolServer(path, _PoolRequestHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return InferencePoolClient(path, timeout=5)
+
+    def test_run_returns_probabilities_and_labels_once(self):
+        model = SimpleNamespace(version='v1', labels=['Tomato__healthy', 'Tomato__late_blight'])
+        flows = []
+
+        def run_local_inference(tensor, stage):
+            flows.append(current_flow())
+            return np.full((tensor.shape[0], 2), 0.5, dtype=np.float32), model
+
+        client = self._serve(run_local_inference=run_local_inference)
+        with mock.patch.object(client, '_call', wraps=client._call) as call:
+            with inference_flow(7, 2.0):
+                probabilities, remote = client.run(np.zeros((3, 224, 224, 3), dtype=np.float32))
+            client.run(np.zeros((1, 224, 224, 3), dtype=np.float32))
+        self.assertEqual(probabilities.shape, (3, 2))
+        self.assertEqual((remote.version, remote.labels), ('v1', model.labels))
+        # The second request tells the pool it already knows v1, so no labels come back
+        self.assertEqual(call.call_args_list[1].args[0]['known_versions'], ['v1'])
+        # The pool schedules by the web request's flow, not by connection
+        self.assertEqual(flows, [(7, 2.0), (None, 1.0)])
+
+    def test_status_reports_the_pool_registry(self):
+        registry = mock.Mock(**{'status.return_value': {'ready': True, 'version': 'v1', 'state': 'ready'}})
+        client = self._serve(registry=registry)
+        self.assertEqual(client.status(), {'ready': True, 'version': 'v1', 'state': 'ready'})
+
+    def test_errors_are_returned_to_the_client(self):
+        client = self._serve(run_local_inference=mock.Mock(side_effect=ValueError('bad tensor')))
+        with self.assertRaisesMessage(RuntimeError, 'bad tensor'), \
+                self.assertLogs('detection.utils.inference_pool', 'ERROR'):
+            client.run(np.zeros((1, 224, 224, 3), dtype=np.float32))
+
+
+class TuneOnnxThreadsCommandTests(SimpleTestCase):
+    """
+    tune_onnx_threads sweeps every thread/mode combination and reports the fastest.
+    """
+
+    def test_sweep_reports_each_configuration_and_the_best(self):
+        from .management.commands import tune_onnx_threads
+        tried = []
+
+        def run_config(command, options, session_options):
+            tried.append(session_options)
+            # Two images per second per intra-op thread, plus one for parallel mode
+            rate = 2 * session_options['intra_op_threads'] + (session_options['execution_mode'] == 'parallel')
+            return [1.0 / rate] * int(rate * options['duration'])
+
+        out = io.StringIO()
+        with mock.patch.object(tune_onnx_threads.Command, '_run_config', run_config):
+            call_command(
+                'tune_onnx_threads', workers=2, intra='1,4', inter='1,2', execution_mode='sequential, parallel',
+                duration=5.0, model='/models/bundled.onnx', stdout=out,
+            )
+        self.assertEqual(len(tried), 8)
+        self.assertEqual(
+            {(o['intra_op_threads'], o['inter_op_threads'], o['execution_mode']) for o in tried},
+            {(intra, inter, mode) for intra in (1, 4) for inter in (1, 2) for mode in ('sequential', 'parallel')},
+        )
+        self.assertIn("2 workers, batch size 1, 5.0s per configuration", out.getvalue())
+        self.assertRegex(out.getvalue(), r"\n\s+4\s+1\s+parallel\s+9\.0\s+111\.1\s+111\.1\n")
+        self.assertIn(
+            "Best: PREDICTION_ORT_INTRA_OP_THREADS=4 PREDICTION_ORT_INTER_OP_THREADS=2 "
+            "PREDICTION_ORT_EXECUTION_MODE=parallel (9.0 img/s)", out.getvalue(),
+        )
+
+    def test_configurations_without_results_are_skipped(self):
+        from .management.commands import tune_onnx_threads
+        out = io.StringIO()
+        with mock.patch.object(tune_onnx_threads.Command, '_run_config', return_value=[]):
+            call_command('tune_onnx_threads', workers=1, intra='1', inter='1', duration=1.0, model='m.onnx', stdout=out)
+        self.assertNotIn("Best:", out.getvalue())
+
+    def test_dead_or_slow_workers_stop_the_sweep(self):
+        from .management.commands.tune_onnx_threads import Command
+        running, crashed = SimpleNamespace(exitcode=None), SimpleNamespace(exitcode=1)
+        Command._check_workers([running, running], time.monotonic() + 60, "load the model")
+        with self.assertRaisesMessage(CommandError, "a worker exited (exit codes: running, 1)"):
+            Command._check_workers([running, crashed], time.monotonic() + 60, "load the model")
+        with self.assertRaisesMessage(CommandError, "Workers did not report results: timed out"):
+            Command._check_workers([running], time.monotonic() - 1, "report results")
+
+
+class CompareModelsTests(SimpleTestCase):
+    """
+    compare_models scores images one at a time in a child process and names each
+    prediction with that model's own label manifest.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        for label in ('Tomato__healthy', 'Tomato__late_blight'):
+            os.makedirs(os.path.join(self.directory, 'images', label))
+            for n in range(2):
+                with open(os.path.join(self.directory, 'images', label, f'{n}.jpg'), 'wb') as f:
+                    f.write(_jpeg().read())
+        # Same output layout, opposite label order: index 1 is a different class per model
+        self.fp32 = self._model('model.onnx', ['Tomato__healthy', 'Tomato__late_blight'])
+        self.int8 = self._model('model.int8.onnx', ['Tomato__late_blight', 'Tomato__healthy'])
+
+    def _model(self, name, labels):
+        path = os.path.join(self.directory, name)
+        open(path, 'wb').close()
+        with open(os.path.splitext(path)[0] + '.json', 'w') as f:
+            json.dump({'version': name, 'labels': labels}, f)
+        return path
+
+    def _compare(self):
+        from .management.commands import compare_models
+
+        def run_in_process(command, model_path, image_paths, timeout):
+            results = queue.Queue()
+            compare_models._score_model(model_path, image_paths, results)
+            return results.get_nowait()
+
+        out = io.StringIO()
+        with mock.patch.object(compare_models, 'create_session', return_value=_FakeSession()), \
+                mock.patch.object(compare_models.Command, '_run', run_in_process):
+            call_command('compare_models', os.path.join(self.directory, 'images'), fp32=self.fp32, int8=self.int8, stdout=out)
+        return out.getvalue()
+
+    def test_predictions_are_named_by_each_models_manifest(self):
+        output = self._compare()
+        self.assertIn("Top-1 agreement: 0.00% (0/4)", output)
+        self.assertIn("Accuracy: FP32 50.00%, INT8 50.00% over 4 labelled images", output)
+        self.assertRegex(output, r"Tomato__healthy\s+2\s+0\.0%\s+100\.0%")
+
+    def test_images_are_decoded_as_they_are_scored(self):
+        from .management.commands import compare_models
+        paths = sorted(compare_models.iter_image_paths(os.path.join(self.directory, 'images')))
+        events = []
+
+        def preprocess(f):
+            events.append('decode')
+            return onnx_predictor.preprocess_image(f)
+
+        session = _FakeSession()
+        with mock.patch.object(session, 'run', side_effect=lambda outputs, feeds: events.append('run') or _FakeSession().run(outputs, feeds)), \
+                mock.patch.object(compare_models, 'create_session', return_value=session), \
+                mock.patch.object(compare_models, 'preprocess_image', preprocess):
+            compare_models._score_model(self.fp32, paths, queue.Queue())
+        # A warm-up, then each image is decoded just before it is scored instead of all up front
+        self.assertEqual(events, ['decode', 'run'] + ['decode', 'run'] * len(paths))
+
+
+@override_settings(DETECTION_DERIVATIVES_ASYNC=False, PREDICTION_JOB_LEASE_SECONDS=300, PREDICTION_JOB_CHUNK_SIZE=2)
+class PredictionJobQueueTests(TestCase):
+    """
+    The database is the job queue: claims are conditional UPDATEs, stale
+    leases are requeued, and a worker that lost its lease writes nothing.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('grower', password='x')
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        media_root = override_settings(MEDIA_ROOT=media)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        for patcher in (
+            mock.patch('detection.utils.prediction_jobs.poll_model_version'),
+            mock.patch('detection.utils.prediction_jobs.predict_batch', side_effect=self._predict),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.on_predict = None
+
+    def _predict(self, images, tensors=()):
+        if self.on_predict:
+            self.on_predict()
+        prediction = {'label': 'Tomato__late_blight', 'confidence': 0.8, 'model_version': 'v1', 'stage': 'ensemble'}
+        return [dict(prediction) for _ in list(images) + list(tensors)]
+
+    def _submit(self, images=1):
+        return submit_job(self.user, [_jpeg(f'leaf{i}.jpg') for i in range(images)])
+
+    def test_jobs_are_claimed_once_oldest_first(self):
+        first, second = self._submit(), self._submit()
+        self.assertEqual(claim_job('w1').pk, first.pk)
+        self.assertEqual(claim_job('w2').pk, second.pk)
+        self.assertIsNone(claim_job('w3'))
+        first.refresh_from_db()
+        self.assertEqual((first.status, first.worker), (PredictionJob.RUNNING, 'w1'))
+        self.assertIsNotNone(first.heartbeat_at)
+
+    def test_stale_leases_are_requeued(self):
+        stale, fresh = self._submit(), self._submit()
+        claim_job('w1')
+        claim_job('w2')
+        PredictionJob.objects.filter(pk=stale.pk).update(heartbeat_at=timezone.now() - timedelta(seconds=301))
+
+        with self.assertLogs('detection.utils.prediction_jobs', 'WARNING'):
+            self.assertEqual(requeue_stale_jobs(), 1)
+        stale.refresh_from_db()
+        fresh.refresh_from_db()
+        self.assertEqual((stale.status, stale.worker), (PredictionJob.QUEUED, None))
+        self.assertEqual(fresh.status, PredictionJob.RUNNING)
+        self.assertEqual(claim_job('w3').pk, stale.pk)
+
+    def test_claimed_job_is_processed(self):
+        job = self._submit(images=3)
+        process_job(claim_job('w1'), 'w1')
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.processed, job.failed), (PredictionJob.DONE, 3, 0))
+        items = list(job.items.all())
+        self.assertTrue(all(item.status == PredictionJobItem.DONE and item.detection_id for item in items))
+        # Staged uploads are gone once the stored images are written
+        self.assertTrue(all(not item.upload for item in items))
+        self.assertTrue(all(item.detection.image for item in items))
+        self.assertEqual(DetectionDailyStat.objects.get().count, 3)
+
+    def test_worker_that_lost_its_lease_writes_nothing(self):
+        job = self._submit(images=2)
+        claim_job('w1')
+
+        def requeued_and_reclaimed():
+            PredictionJob.objects.filter(pk=job.pk).update(status=PredictionJob.QUEUED, worker=None)
+            claim_job('w2')
+
+        self.on_predict = requeued_and_reclaimed
+        with self.assertLogs('detection.utils.prediction_jobs', 'WARNING'):
+            process_job(PredictionJob.objects.get(pk=job.pk), 'w1')
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.worker, job.processed), (PredictionJob.RUNNING, 'w2', 0))
+        self.assertFalse(Detection.objects.exists())
+        self.assertTrue(all(item.status == PredictionJobItem.PENDING and item.upload for item in job.items.all()))
+
+
+class DecodedUploadTests(SimpleTestCase):
+    """
+    Uploads decode just large enough for their consumer: the model input for
+    inference, the capped archival edge for the stored copy.
+    """
+
+    def _upload(self, fmt, size):
+        buffer = io.BytesIO()
+        Image.new('RGB', size, (60, 140, 40)).save(buffer, fmt)
+        buffer.seek(0)
+        return buffer
+
+    def test_inference_decode_covers_the_model_input(self):
+        # JPEG: the 1/8 DCT scale; PNG: a whole-factor reduce after the full decode
+        self.assertEqual(DecodedUpload(self._upload('JPEG', (4000, 3000))).rgb().size, (500, 375))
+        self.assertEqual(DecodedUpload(self._upload('PNG', (4000, 3000))).rgb().size, (308, 231))
+        self.assertEqual(DecodedUpload(self._upload('PNG', (200, 150))).rgb().size, (200, 150))
+
+    def test_archival_decode_covers_the_max_edge(self):
+        decoded = DecodedUpload(self._upload('JPEG', (4000, 3000)), max_edge=1600)
+        self.assertEqual(decoded.rgb().size, (2000, 1500))
+        self.assertEqual(decoded.decodes, 1)
+
+
+@override_settings(DETECTION_DERIVATIVES_ASYNC=False)
+class DetectionImageStagingTests(TestCase):
+    """
+    A Detection points at its staged original until the archival copy and
+    thumbnail replace it, so no committed row depends on bytes in memory.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('grower', password='x')
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        media_root = override_settings(MEDIA_ROOT=self.media)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+
+    def _staged_detection(self, **fields):
+        name = stage_original(_jpeg('leaf.jpg', size=(2000, 1500)))
+        return Detection.objects.create(user=self.user, image=name, result='Tomato__healthy', confidence_score=0.9, **fields)
+
+    def _originals(self):
+        directory = os.path.join(self.media, ORIGINALS_DIR)
+        return os.listdir(directory) if os.path.isdir(directory) else []
+
+    def test_derivatives_replace_the_staged_original(self):
+        detection = self._staged_detection()
+        schedule_derivatives([(detection.pk, detection.image.name)])
+
+        detection.refresh_from_db()
+        self.assertFalse(detection.image.name.startswith(ORIGINALS_DIR))
+        self.assertEqual((detection.image.width, detection.image.height), (1600, 1200))
+        self.assertTrue(detection.thumbnail)
+        self.assertEqual(self._originals(), [])
+
+    def test_repair_finishes_rows_left_on_their_staged_original(self):
+        old = timezone.now() - timedelta(hours=1)
+        stranded = self._staged_detection()
+        fresh = self._staged_detection()
+        Detection.objects.filter(pk=stranded.pk).update(created_at=old)
+
+        call_command('repair_detection_images', stdout=io.StringIO())
+
+        stranded.refresh_from_db()
+        fresh.refresh_from_db()
+        self.assertFalse(stranded.image.name.startswith(ORIGINALS_DIR))
+        self.assertTrue(stranded.thumbnail)
+        # Recent rows may still be queued
+        self.assertTrue(fresh.image.name.startswith(ORIGINALS_DIR))
+        self.assertEqual(self._originals(), [os.path.basename(fresh.image.name)])
+
+    def test_deleted_rows_leave_no_files(self):
+        detection = self._staged_detection()
+        item = (detection.pk, detection.image.name)
+        detection.delete()
+        schedule_derivatives([item])
+
+        self.assertEqual(self._originals(), [])
+        self.assertEqual(sorted(os.listdir(os.path.join(self.media, 'detections'))), ['originals', 'thumbnails'])
+        self.assertEqual(os.listdir(os.path.join(self.media, 'detections', 'thumbnails')), [])
+
+
+@override_settings(
+    PREDICTION_MAX_IMAGES_PER_REQUEST=50, PREDICTION_MAX_CONCURRENT_REQUESTS_PER_USER=2,
+    PREDICTION_MAX_IN_FLIGHT_IMAGES=100, PREDICTION_LATENCY_BUDGET_MS=5000,
+)
+class AdmissionControllerTests(SimpleTestCase):
+    """
+    Requests are shed before any work is done: 413 over the image cap, 429 for
+    a user over their concurrency limit, 503 over the queue depth or latency budget.
+    """
+
+    def assertRejected(self, reason, status_code, admit):
+        with self.assertRaises(AdmissionRejected) as raised:
+            admit()
+        self.assertEqual((raised.exception.reason, raised.exception.status_code), (reason, status_code))
+        return raised.exception
+
+    def test_image_cap(self):
+        controller = AdmissionController()
+        controller.admit('farmer', 50).release()
+        self.assertRejected('image_cap', 413, lambda: controller.admit('farmer', 51))
+
+    def test_per_user_concurrency(self):
+        controller = AdmissionController()
+        first, second = controller.admit('farmer', 1), controller.admit('farmer', 1)
+        rejected = self.assertRejected('user_concurrency', 429, lambda: controller.admit('farmer', 1))
+        self.assertIsNotNone(rejected.retry_after)
+        # Other users are unaffected, and a finished request frees its slot
+        controller.admit('neighbour', 1).release()
+        first.release()
+        controller.admit('farmer', 1).release()
+        second.release()
+
+    def test_queue_depth(self):
+        controller = AdmissionController()
+        with controller.admit('a', 50), controller.admit('b', 30):
+            self.assertRejected('queue_full', 503, lambda: controller.admit('c', 21))
+            controller.admit('c', 20).release()
+
+    def test_idle_process_always_admits(self):
+        controller = AdmissionController()
+        controller._image_seconds = 10.0
+        with controller.admit('farmer', 5):
+            pass
+
+    def test_latency_budget_uses_the_learned_cost(self):
+        controller = AdmissionController()
+        ticket = controller.admit('a', 10)
+        # 10 images in 10 seconds: one second per image
+        ticket.started -= 10.0
+        ticket.release()
+        self.assertAlmostEqual(controller.stats()['estimated_image_ms'], 1000, delta=5)
+
+        with controller.admit('a', 3):
+            rejected = self.assertRejected('latency_budget', 503, lambda: controller.admit('b', 3))
+            self.assertGreaterEqual(rejected.retry_after, 1)
+            controller.admit('b', 1).release()
+
+    def test_only_timed_work_is_charged(self):
+        controller = AdmissionController()
+        ticket = controller.admit('a', 4)
+        with ticket.working():
+            pass
+        # A streamed response held for a minute while the client reads it
+        ticket.started -= 60.0
+        ticket.release()
+        self.assertLess(controller.stats()['estimated_image_ms'], 100)
+
+    def test_tickets_release_once(self):
+        controller = AdmissionController()
+        ticket = controller.admit('farmer', 4)
+        ticket.release()
+        ticket.release()
+        stats = controller.stats()
+        self.assertEqual((stats['in_flight_images'], stats['active_users'], stats['admitted']), (0, 0, 1))
+
+    def test_zero_disables_a_limit(self):
+        controller = AdmissionController()
+        with self.settings(PREDICTION_MAX_IMAGES_PER_REQUEST=0, PREDICTION_MAX_CONCURRENT_REQUESTS_PER_USER=0):
+            tickets = [controller.admit('farmer', 80), controller.admit('farmer', 1), controller.admit('farmer', 1)]
+        for ticket in tickets:
+            ticket.release()
+        self.assertEqual(controller.stats()['shed_total'], 0)
+
+
+@override_settings(
+    PREDICTION_CACHE_ENABLED=False, PREDICTION_QUALITY_MODE='off', PREDICTION_STREAM_CHUNK_SIZE=2,
+    DETECTION_DERIVATIVES_ASYNC=False,
+)
+class StreamingPredictTests(TestCase):
+    """
+    `?stream=` or a streaming Accept header sends each chunk's results as soon as
+    it is scored, then a summary record.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('grower', password='x')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        media_root = override_settings(MEDIA_ROOT=self.media)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        self.forward_passes = []
+        for patcher in (
+            mock.patch.object(onnx_predictor, 'score_batch', side_effect=self._score),
+            mock.patch('detection.views.poll_model_version'),
+            mock.patch('detection.views.admission', AdmissionController()),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _score(self, tensor):
+        self.forward_passes.append(tensor.shape[0])
+        model = SimpleNamespace(labels=['Tomato__healthy', 'Tomato__late_blight'], version='v1')
+        return [(np.array([0.2, 0.8], dtype=np.float32), model, onnx_predictor.ENSEMBLE_STAGE) for _ in tensor]
+
+    def _uploads(self):
+        # Tensors are only checked when they are loaded, so this one fails inside the stream
+        return {'images': [_jpeg('a.jpg'), _jpeg('b.jpg')], 'tensors': [SimpleUploadedFile('leaf.bin', b'abc')]}
+
+    def test_ndjson_streams_results_then_a_summary(self):
+        response = self.client.post('/api/predict/?stream=ndjson', self._uploads(), format='multipart')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual((response['Cache-Control'], response['X-Accel-Buffering']), ('no-cache', 'no'))
+        # Nothing is scored until the client reads the body
+        self.assertEqual(self.forward_passes, [])
+
+        records = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(self.forward_passes, [2])
+        self.assertEqual([record.get('predicted_class') for record in records[:3]], ['Tomato__late_blight', 'Tomato__late_blight', None])
+        self.assertIn('Tensor upload rejected', records[2]['error'])
+        self.assertEqual(records[3], {'done': True, 'stored': 2, 'failed': 1})
+        self.assertEqual(Detection.objects.filter(user=self.user).count(), 2)
+
+    def test_sse_is_chosen_by_accept_header(self):
+        response = self.client.post('/api/predict/', self._uploads(), format='multipart', HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = b''.join(response.streaming_content).decode().split('\n\n')
+        self.assertEqual(events[-1], '')
+        self.assertEqual([event.split('\n')[0] for event in events[:-1]], ['event: result'] * 3 + ['event: done'])
+        self.assertEqual(json.loads(events[3].split('data: ')[1]), {'done': True, 'stored': 2, 'failed': 1})
+
+    def test_without_stream_the_response_is_one_json_list(self):
+        response = self.client.post('/api/predict/', self._uploads(), format='multipart')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertFalse(response.streaming)
+        self.assertEqual(self.forward_passes, [2])
+        self.assertEqual(len(response.json()), 3)
+
+    def test_asgi_requests_get_an_async_iterator(self):
+        chunks = iter([b'a', b'b'])
+        self.assertIs(streaming.server_iterator(RequestFactory().get('/'), chunks), chunks)
+
+        iterator = streaming.server_iterator(AsyncRequestFactory().get('/'), iter([b'a', b'b']))
+        self.assertTrue(hasattr(iterator, '__anext__'))
+
+        async def drain():
+            return [chunk async for chunk in iterator]
+
+        self.assertEqual(async_to_sync(drain)(), [b'a', b'b'])
+
+
+@override_settings(PREDICTION_MAX_IMAGES_PER_REQUEST=2, PREDICTION_MAX_CONCURRENT_REQUESTS_PER_USER=1)
+class PredictAdmissionTests(TestCase):
+    """
+    The predict endpoint sheds with the controller's status code and a Retry-After.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('farmer', password='x')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.admission = AdmissionController()
+        patcher = mock.patch('detection.views.admission', self.admission)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_too_many_images(self):
+        response = self.client.post('/api/predict/', {'images': [_jpeg(f'{i}.jpg') for i in range(3)]}, format='multipart')
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(response.json()['reason'], 'image_cap')
+        self.assertFalse(Detection.objects.exists())
+
+    def test_user_already_predicting(self):
+        with self.admission.admit(self.user.pk, 1):
+            response = self.client.post('/api/predict/', {'images': [_jpeg()]}, format='multipart')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.json()['reason'], 'user_concurrency')
+        self.assertIn('Retry-After', response)
+
+    def test_upload_lists_are_capped_before_headers_are_read(self):
+        uploads = [_jpeg(f'{i}.jpg') for i in range(51)]
+        with mock.patch('detection.serializers.DecodedUpload') as decoded:
+            response = self.client.post('/api/predict/', {'images': uploads}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('images', response.json())
+        decoded.of.assert_not_called()
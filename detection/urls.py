@@ -1,8 +1,12 @@
 from django.urls import path
-from .views import PredictAPIView, DetectionHistoryView, DetectionDeleteAPIView, DetectionBulkDeleteAPIView, FlagDetectionAPIView, AdminFlaggedDetectionsView, AdminStatsAPIView, FilteredDetectionHistoryView, ExportDetectionHistoryAPIView
+from .views import PredictAPIView, AsyncPredictView, PredictionJobCreateAPIView, PredictionJobDetailAPIView, PredictionJobResultsAPIView, DetectionHistoryView, DetectionDeleteAPIView, DetectionBulkDeleteAPIView, FlagDetectionAPIView, AdminFlaggedDetectionsView, AdminStatsAPIView, AdminDailyStatsAPIView, AdminClassStatsAPIView, AdminInferenceStatsAPIView, FilteredDetectionHistoryView, ExportDetectionHistoryAPIView, AdminExportDetectionsAPIView
 
 urlpatterns = [
     path('', PredictAPIView.as_view(), name='predict'),
+    path('async/', AsyncPredictView.as_view(), name='predict_async'),
+    path('jobs/', PredictionJobCreateAPIView.as_view(), name='prediction_job_create'),
+    path('jobs/<int:pk>/', PredictionJobDetailAPIView.as_view(), name='prediction_job_detail'),
+    path('jobs/<int:pk>/results/', PredictionJobResultsAPIView.as_view(), name='prediction_job_results'),
     path('history/', DetectionHistoryView.as_view(), name='detection_history'),
     path('history/<int:pk>/', DetectionDeleteAPIView.as_view(), name='detection_history_delete'),
     path('history/delete_all/', DetectionBulkDeleteAPIView.as_view(), name='detection_history_delete_all'),
@@ -11,4 +15,8 @@ urlpatterns = [
     path('history/<int:pk>/flag/', FlagDetectionAPIView.as_view(), name='flag_detection'),
     path('admin/flagged/', AdminFlaggedDetectionsView.as_view(), name='admin_flagged_detections'),
     path('admin/stats/', AdminStatsAPIView.as_view(), name='admin_stats'),
+    path('admin/stats/daily/', AdminDailyStatsAPIView.as_view(), name='admin_stats_daily'),
+    path('admin/stats/classes/', AdminClassStatsAPIView.as_view(), name='admin_stats_classes'),
+    path('admin/export/', AdminExportDetectionsAPIView.as_view(), name='admin_export_detections'),
+    path('admin/inference/stats/', AdminInferenceStatsAPIView.as_view(), name='admin_inference_stats'),
 ]
\ No newline at end of file
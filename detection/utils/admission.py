@@ -0,0 +1,181 @@
+import math
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+from django.conf import settings
+
+# Weight of the newest sample in the per-image cost estimate
+_EWMA_ALPHA = 0.2
+
+
+class AdmissionRejected(Exception):
+    """
+    A request shed before any work was done. `status_code` is 413 for requests
+    over the image cap, 429 for a user over their concurrency limit and 503 when
+    the process is over its latency budget or queue depth.
+    """
+
+    def __init__(self, reason: str, status_code: int, message: str, retry_after: int = None):
+        super().__init__(message)
+        self.reason = reason
+        self.status_code = status_code
+        self.message = message
+        self.retry_after = retry_after
+
+    def response_data(self) -> dict:
+        data = {'error': self.message, 'reason': self.reason}
+        if self.retry_after is not None:
+            data['retry_after'] = self.retry_after
+        return data
+
+
+class AdmissionTicket:
+    """
+    An admitted request's share of the in-flight work; released exactly once,
+    by `release()`, the `with` block or garbage collection.
+    """
+
+    def __init__(self, controller, user_id, images: int, ahead: int):
+        self.controller = controller
+        self.user_id = user_id
+        self.images = images
+        self.ahead = ahead
+        self.started = time.perf_counter()
+        # Seconds spent inside `working()` blocks; None until one is entered
+        self.busy = None
+        self._released = False
+
+    @contextmanager
+    def working(self):
+        """
+        Times the enclosed work as this request's cost. A streamed response
+        holds its ticket until the client has read everything, so it times
+        only the producing of each chunk; without any `working()` block the
+        whole time the ticket was held counts.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.busy = (self.busy or 0.0) + time.perf_counter() - started
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.controller._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def __del__(self):
+        self.release()
+
+
+class AdmissionController:
+    """
+    Per-process admission control for prediction requests.
+    - the per-image cost is an EWMA of each request's latency divided by the
+      images that were in flight ahead of it plus its own
+    - a request is shed when (in-flight images + its images) x cost would exceed
+      PREDICTION_LATENCY_BUDGET_MS, or the in-flight images would exceed
+      PREDICTION_MAX_IN_FLIGHT_IMAGES; an idle process always admits
+    - limits are read from settings on every call, 0 disables a limit
+    """
+
+    def __init__(self, window: int = 1024):
+        # Reentrant: a ticket may be garbage collected while this thread holds the lock
+        self._lock = threading.RLock()
+        self._in_flight_images = 0
+        self._per_user = defaultdict(int)
+        self._image_seconds = None
+        self._admitted = 0
+        self._shed = defaultdict(int)
+        self._latencies = deque(maxlen=window)
+
+    def _retry_after(self, images: int) -> int:
+        return max(1, math.ceil(images * (self._image_seconds or 0.0)))
+
+    def _reject(self, reason, status_code, message, retry_after=None):
+        self._shed[reason] += 1
+        raise AdmissionRejected(reason, status_code, message, retry_after)
+
+    def admit(self, user_id, images: int) -> AdmissionTicket:
+        max_images = getattr(settings, 'PREDICTION_MAX_IMAGES_PER_REQUEST', 50)
+        max_per_user = getattr(settings, 'PREDICTION_MAX_CONCURRENT_REQUESTS_PER_USER', 2)
+        max_in_flight = getattr(settings, 'PREDICTION_MAX_IN_FLIGHT_IMAGES', 256)
+        budget = getattr(settings, 'PREDICTION_LATENCY_BUDGET_MS', 5000) / 1000
+
+        with self._lock:
+            if max_images and images > max_images:
+                self._reject(
+                    'image_cap', 413,
+                    f"{images} uploads exceed the limit of {max_images} per request; use a prediction job for larger batches.",
+                )
+            if max_per_user and self._per_user.get(user_id, 0) >= max_per_user:
+                self._reject(
+                    'user_concurrency', 429,
+                    f"Too many predictions in progress; at most {max_per_user} at a time per user.",
+                    self._retry_after(self._in_flight_images),
+                )
+            ahead = self._in_flight_images
+            if ahead:
+                if max_in_flight and ahead + images > max_in_flight:
+                    self._reject(
+                        'queue_full', 503, "The prediction queue is full; try again shortly.",
+                        self._retry_after(ahead),
+                    )
+                if budget and self._image_seconds is not None and (ahead + images) * self._image_seconds > budget:
+                    self._reject(
+                        'latency_budget', 503, "The service is overloaded; try again shortly.",
+                        self._retry_after(ahead + images - budget / self._image_seconds),
+                    )
+            self._in_flight_images += images
+            self._per_user[user_id] += 1
+            self._admitted += 1
+        return AdmissionTicket(self, user_id, images, ahead)
+
+    def _release(self, ticket: AdmissionTicket):
+        elapsed = ticket.busy if ticket.busy is not None else time.perf_counter() - ticket.started
+        with self._lock:
+            self._in_flight_images -= ticket.images
+            self._per_user[ticket.user_id] -= 1
+            if self._per_user[ticket.user_id] <= 0:
+                del self._per_user[ticket.user_id]
+            if ticket.images:
+                sample = elapsed / (ticket.ahead + ticket.images)
+                if self._image_seconds is None:
+                    self._image_seconds = sample
+                else:
+                    self._image_seconds += _EWMA_ALPHA * (sample - self._image_seconds)
+            self._latencies.append(elapsed)
+
+    def stats(self) -> dict:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            shed = dict(self._shed)
+            admitted, in_flight, users = self._admitted, self._in_flight_images, len(self._per_user)
+            image_seconds = self._image_seconds
+
+        def percentile(p):
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 3) if latencies else 0.0
+
+        return {
+            'in_flight_images': in_flight,
+            'active_users': users,
+            'estimated_image_ms': round(image_seconds * 1000, 3) if image_seconds is not None else None,
+            'admitted': admitted,
+            'shed': shed,
+            'shed_total': sum(shed.values()),
+            'admitted_latency_ms': {'p50': percentile(0.5), 'p95': percentile(0.95), 'p99': percentile(0.99)},
+            'limits': {
+                'max_images_per_request': getattr(settings, 'PREDICTION_MAX_IMAGES_PER_REQUEST', 50),
+                'max_concurrent_requests_per_user': getattr(settings, 'PREDICTION_MAX_CONCURRENT_REQUESTS_PER_USER', 2),
+                'max_in_flight_images': getattr(settings, 'PREDICTION_MAX_IN_FLIGHT_IMAGES', 256),
+                'latency_budget_ms': getattr(settings, 'PREDICTION_LATENCY_BUDGET_MS', 5000),
+            },
+        }
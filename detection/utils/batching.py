@@ -0,0 +1,273 @@
+import contextvars
+import heapq
+import itertools
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+
+import numpy as np
+
+# (flow key, weight) of the work submitted from the current context
+_current_flow = contextvars.ContextVar('inference_flow', default=None)
+
+# Times a request's slices are scored before giving up on getting them all under one tag
+_MAX_SCORING_ROUNDS = 3
+
+
+@contextmanager
+def inference_flow(key, weight: float = 1.0):
+    """
+    Attributes inference submitted inside the block to flow `key` (e.g. a user id),
+    which gets a share of the scheduler proportional to `weight`.
+    """
+    token = _current_flow.set((key, weight))
+    try:
+        yield
+    finally:
+        _current_flow.reset(token)
+
+
+def current_flow():
+    return _current_flow.get()
+
+
+class _PendingRequest:
+    """
+    One caller's tensor, scored in one or more slices. `pieces` maps each
+    slice's offset to (batch number, output rows, tag).
+    """
+    __slots__ = ('remaining', 'pieces', 'done', 'error', 'cancelled')
+
+    def __init__(self, slices: int):
+        self.remaining = slices
+        self.pieces = {}
+        self.done = threading.Event()
+        self.error = None
+        # Set when a slice failed or the caller stopped waiting; queued slices are then skipped
+        self.cancelled = False
+
+
+class _Slice:
+    """
+    Up to `quantum` rows of a request, queued under its flow's virtual start tag.
+    """
+    __slots__ = ('request', 'offset', 'tensor', 'rows', 'start_tag', 'enqueued_at')
+
+    def __init__(self, request, offset, tensor, start_tag):
+        self.request = request
+        self.offset = offset
+        self.tensor = tensor
+        self.rows = tensor.shape[0]
+        self.start_tag = start_tag
+        self.enqueued_at = time.perf_counter()
+
+
+class MicroBatchScheduler:
+    """
+    Packs concurrent inference calls into a single batched run.
+    - callers submit an NHWC tensor and block until their rows are scored
+    - a dispatcher thread groups queued rows until `max_batch_size` rows
+      are collected or `max_wait_ms` has passed since the first one arrived
+    - `run_batch` receives the stacked (N, H, W, C) tensor and returns
+      `(outputs, tag)`, where the first axis of `outputs` lines up with the
+      input rows; every caller gets its rows back along with the one tag all
+      of them were scored under. A request whose slices straddle a tag change
+      (a model swap) has the slices scored under the older tag queued again
+    - once a slice fails or its caller times out, the request's other queued
+      slices are dropped instead of scored
+    - rows are served with start-time fair queuing across flows (see
+      `inference_flow`): requests are cut into slices of `quantum` rows, each
+      slice gets a virtual start tag of max(virtual time, the flow's previous
+      finish tag) and finishes rows / weight later, and the dispatcher always
+      takes the lowest start tag. A 200-image request therefore interleaves
+      with, instead of delaying, single images from other flows; with a
+      single flow this is plain FIFO
+    """
+
+    def __init__(self, run_batch, max_batch_size: int = 16, max_wait_ms: float = 5.0, name: str = 'onnx-batcher', quantum: int = None):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max(max_wait_ms, 0.0) / 1000.0
+        self.name = name
+        self.quantum = quantum or max(1, max_batch_size // 4)
+
+        self._cond = threading.Condition()
+        self._heap = []
+        self._sequence = itertools.count()
+        self._batch_numbers = itertools.count()
+        self._virtual_time = 0.0
+        self._flow_finish = {}
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._queue_waits = deque(maxlen=2048)
+        self._batches = 0
+        self._rows = 0
+
+    def submit(self, tensor: np.ndarray, timeout: float = None, flow: tuple = None) -> tuple:
+        """
+        Queues `tensor` under `flow` (default: the current `inference_flow`) and
+        returns `(its output rows, tag)`.
+        """
+        self._ensure_started()
+        key, weight = flow or current_flow() or (None, 1.0)
+        weight = max(weight, 1e-6)
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        quantum = max(1, min(self.quantum, self.max_batch_size))
+        offsets = list(range(0, tensor.shape[0], quantum)) or [0]
+
+        scored = {}
+        for _ in range(_MAX_SCORING_ROUNDS):
+            pending = self._enqueue(tensor, offsets, quantum, key, weight)
+            wait = None if deadline is None else max(deadline - time.perf_counter(), 0.0)
+            if not pending.done.wait(wait):
+                pending.cancelled = True
+                raise TimeoutError(f"Inference did not complete within {timeout}s")
+            if pending.error is not None:
+                raise pending.error
+            scored.update(pending.pieces)
+            _, _, tag = max(scored.values(), key=lambda piece: piece[0])
+            offsets = [offset for offset, (_, _, piece_tag) in scored.items() if piece_tag != tag]
+            if not offsets:
+                break
+        else:
+            raise RuntimeError(f"Scoring tag kept changing; {len(offsets)} slice(s) were never scored under {tag!r}")
+
+        pieces = [scored[offset][1] for offset in sorted(scored)]
+        outputs = pieces[0] if len(pieces) == 1 else np.concatenate(pieces, axis=0)
+        return outputs, tag
+
+    def _enqueue(self, tensor: np.ndarray, offsets: list, quantum: int, key, weight: float) -> _PendingRequest:
+        pending = _PendingRequest(len(offsets))
+        with self._cond:
+            tag = max(self._virtual_time, self._flow_finish.get(key, 0.0))
+            for offset in offsets:
+                piece = tensor[offset:offset + quantum]
+                heapq.heappush(self._heap, (tag, next(self._sequence), _Slice(pending, offset, piece, tag)))
+                tag += max(piece.shape[0], 1) / weight
+            self._flow_finish[key] = tag
+            self._cond.notify()
+        return pending
+
+    def stats(self) -> dict:
+        """
+        Batch sizes and queue-wait times actually produced by the dispatcher.
+        """
+        with self._stats_lock:
+            waits = sorted(self._queue_waits)
+            histogram = dict(sorted(self._batch_sizes.items()))
+            batches, rows = self._batches, self._rows
+
+        def percentile(p):
+            if not waits:
+                return 0.0
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))] * 1000, 3)
+
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000,
+            'quantum': self.quantum,
+            'queue_depth': len(self._heap),
+            'active_flows': len(self._flow_finish),
+            'batches': batches,
+            'rows': rows,
+            'mean_batch_size': round(rows / batches, 3) if batches else 0.0,
+            'batch_size_histogram': histogram,
+            'queue_wait_ms': {
+                'samples': len(waits),
+                'mean': round(sum(waits) / len(waits) * 1000, 3) if waits else 0.0,
+                'p50': percentile(0.50),
+                'p95': percentile(0.95),
+                'p99': percentile(0.99),
+                'max': round(waits[-1] * 1000, 3) if waits else 0.0,
+            },
+        }
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._dispatch_forever, name=self.name, daemon=True)
+                self._thread.start()
+
+    def _pop(self):
+        _, _, piece = heapq.heappop(self._heap)
+        self._virtual_time = max(self._virtual_time, piece.start_tag)
+        return piece
+
+    def _drop_cancelled(self):
+        while self._heap and self._heap[0][2].request.cancelled:
+            heapq.heappop(self._heap)
+
+    def _collect(self) -> list:
+        with self._cond:
+            self._drop_cancelled()
+            while not self._heap:
+                self._cond.wait()
+                self._drop_cancelled()
+            first = self._pop()
+            batch, rows = [first], first.rows
+            deadline = time.perf_counter() + self.max_wait
+
+            while rows < self.max_batch_size:
+                self._drop_cancelled()
+                if self._heap:
+                    if rows + self._heap[0][2].rows > self.max_batch_size:
+                        # Leave it for the next batch rather than overshooting this one
+                        break
+                    piece = self._pop()
+                    batch.append(piece)
+                    rows += piece.rows
+                    continue
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            # Flows that have caught up with virtual time are idle; forget them
+            if len(self._flow_finish) > 1024:
+                self._flow_finish = {k: v for k, v in self._flow_finish.items() if v > self._virtual_time}
+        return batch
+
+    def _dispatch_forever(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            try:
+                if len(batch) == 1:
+                    stacked = batch[0].tensor
+                else:
+                    stacked = np.concatenate([piece.tensor for piece in batch], axis=0)
+                outputs, tag = self.run_batch(stacked)
+            except Exception as e:
+                for piece in batch:
+                    piece.request.error = e
+                    piece.request.cancelled = True
+                    piece.request.done.set()
+                continue
+
+            number = next(self._batch_numbers)
+            offset = 0
+            for piece in batch:
+                request = piece.request
+                request.pieces[piece.offset] = (number, outputs[offset:offset + piece.rows], tag)
+                offset += piece.rows
+                request.remaining -= 1
+                if request.remaining == 0:
+                    request.done.set()
+
+            self._record(batch, started)
+
+    def _record(self, batch, started):
+        rows = sum(p.rows for p in batch)
+        with self._stats_lock:
+            self._batches += 1
+            self._rows += rows
+            self._batch_sizes[rows] += 1
+            self._queue_waits.extend(started - p.enqueued_at for p in batch)
@@ -0,0 +1,78 @@
+import threading
+
+import numpy as np
+
+FAST_STAGE = 'fast'
+ENSEMBLE_STAGE = 'ensemble'
+
+
+class CascadeStats:
+    """
+    How many images each cascade stage answered, for tuning the threshold.
+    - `fast_confidence_histogram` buckets the fast model's top-1 confidence
+      (20 bins of 0.05) for every image it saw
+    - `escalated_agreement` is how often the ensemble agreed with the fast
+      model's top-1 on images that were escalated anyway
+    """
+
+    BINS = 20
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._images = 0
+        self._resolved_fast = 0
+        self._escalated = 0
+        self._escalated_agreed = 0
+        self._histogram = np.zeros(self.BINS, dtype=np.int64)
+
+    def record(self, confidences: np.ndarray, confident: np.ndarray, agreed: int):
+        bins = np.minimum((confidences * self.BINS).astype(np.int64), self.BINS - 1)
+        with self._lock:
+            self._images += len(confidences)
+            self._resolved_fast += int(confident.sum())
+            self._escalated += int((~confident).sum())
+            self._escalated_agreed += agreed
+            self._histogram += np.bincount(bins, minlength=self.BINS)
+
+    def stats(self) -> dict:
+        with self._lock:
+            images, fast, escalated, agreed = self._images, self._resolved_fast, self._escalated, self._escalated_agreed
+            histogram = self._histogram.tolist()
+        return {
+            'images': images,
+            'resolved_fast': fast,
+            'resolved_ensemble': escalated,
+            'fast_fraction': round(fast / images, 4) if images else 0.0,
+            'escalated_agreement': round(agreed / escalated, 4) if escalated else 0.0,
+            'fast_confidence_histogram': {
+                f'{i / self.BINS:.2f}-{(i + 1) / self.BINS:.2f}': count for i, count in enumerate(histogram)
+            },
+        }
+
+
+def run_cascade(input_tensor: np.ndarray, run_stage, threshold: float, stats: CascadeStats) -> list:
+    """
+    Scores every row with the fast model and escalates only the rows whose top-1
+    confidence is below `threshold` to the ensemble.
+    `run_stage(tensor, stage)` returns (probabilities, model).
+    Returns one (probabilities, model, stage) tuple per input row.
+    """
+    fast_probabilities, fast_model = run_stage(input_tensor, FAST_STAGE)
+    confidences = fast_probabilities.max(axis=1)
+    confident = confidences >= threshold
+
+    scored = [None] * input_tensor.shape[0]
+    for row in np.flatnonzero(confident):
+        scored[row] = (fast_probabilities[row], fast_model, FAST_STAGE)
+
+    agreed = 0
+    uncertain = np.flatnonzero(~confident)
+    if uncertain.size:
+        ensemble_probabilities, ensemble_model = run_stage(input_tensor[uncertain], ENSEMBLE_STAGE)
+        for position, row in enumerate(uncertain):
+            scored[row] = (ensemble_probabilities[position], ensemble_model, ENSEMBLE_STAGE)
+            fast_label = fast_model.labels[int(np.argmax(fast_probabilities[row]))]
+            agreed += fast_label == ensemble_model.labels[int(np.argmax(ensemble_probabilities[position]))]
+
+    stats.record(confidences, confident, agreed)
+    return scored
@@ -0,0 +1,225 @@
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection
+from PIL import features
+
+logger = logging.getLogger(__name__)
+
+_EXTENSIONS = {'WEBP': 'webp', 'JPEG': 'jpg'}
+# Where uploads sit, as sent, until their derivatives replace them: request
+# uploads are staged here and job uploads stay where submit_job put them
+ORIGINALS_DIR = 'detections/originals/'
+STAGED_PREFIXES = (ORIGINALS_DIR, 'jobs/')
+
+_executor = None
+_executor_lock = threading.Lock()
+# Detections handed to the executor and not yet stored
+_queued = 0
+
+
+def _archive_format() -> str:
+    fmt = getattr(settings, 'DETECTION_ARCHIVE_FORMAT', 'WEBP').upper()
+    if fmt == 'WEBP' and not features.check('webp'):
+        return 'JPEG'
+    return fmt
+
+
+def _encode(image, fmt: str, quality: int) -> bytes:
+    buffer = io.BytesIO()
+    if fmt == 'WEBP':
+        image.save(buffer, fmt, quality=quality, method=4)
+    else:
+        image.save(buffer, fmt, quality=quality, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def build_derivatives(decoded) -> tuple:
+    """
+    Encodes the archival copy and the thumbnail of a DecodedUpload opened with
+    `max_edge=DETECTION_ARCHIVE_MAX_EDGE`, from its single decode.
+    - `decoded.rgb()` is made at the smallest DCT scale that covers the
+      archival edge; it is shrunk to that edge
+    - the thumbnail is shrunk from the archival copy, not decoded again
+    Returns (archive bytes, thumbnail bytes, file extension).
+    """
+    max_edge = decoded.max_edge
+    fmt = _archive_format()
+
+    archive = decoded.rgb().copy()
+    archive.thumbnail((max_edge, max_edge), reducing_gap=3.0)
+    archive_bytes = _encode(archive, fmt, getattr(settings, 'DETECTION_ARCHIVE_QUALITY', 80))
+
+    return archive_bytes, _thumbnail_bytes(archive, fmt), _EXTENSIONS.get(fmt, fmt.lower())
+
+
+def _thumbnail_bytes(image, fmt: str) -> bytes:
+    # Shrinks `image` in place
+    thumbnail_edge = getattr(settings, 'DETECTION_THUMBNAIL_EDGE', 256)
+    image.thumbnail((thumbnail_edge, thumbnail_edge), reducing_gap=2.0)
+    return _encode(image, fmt, getattr(settings, 'DETECTION_THUMBNAIL_QUALITY', 70))
+
+
+def stage_original(upload) -> str:
+    """
+    Saves an upload as sent under ORIGINALS_DIR and returns its storage name,
+    so its Detection points at a durable image from the moment it is committed.
+    """
+    from ..models import Detection
+
+    storage = Detection._meta.get_field('image').storage
+    upload.seek(0)
+    return storage.save(storage.generate_filename(ORIGINALS_DIR + os.path.basename(upload.name)), upload)
+
+
+def is_staged(name: str) -> bool:
+    """
+    Whether a Detection's image is still the upload as sent, awaiting derivatives.
+    """
+    return name.startswith(STAGED_PREFIXES)
+
+
+def discard_staged(names: list):
+    """
+    Deletes staged originals whose Detections were never committed.
+    """
+    from ..models import Detection
+
+    storage = Detection._meta.get_field('image').storage
+    for name in names:
+        storage.delete(name)
+
+
+def store_derivatives(detection_id: int, staged_name: str):
+    """
+    Replaces a Detection's staged original with its archival copy and thumbnail,
+    then deletes the original. The row only moves off `staged_name` once both
+    are written, so a crash at any point leaves it with a usable image.
+    """
+    from ..models import Detection
+    from .uploads import DecodedUpload
+
+    storage = Detection._meta.get_field('image').storage
+    with storage.open(staged_name, 'rb') as f:
+        decoded = DecodedUpload(f, max_edge=getattr(settings, 'DETECTION_ARCHIVE_MAX_EDGE', 1600))
+        archive_bytes, thumbnail_bytes, extension = build_derivatives(decoded)
+    stem = os.path.splitext(os.path.basename(staged_name))[0]
+
+    stored = {}
+    for field_name, content in (('image', archive_bytes), ('thumbnail', thumbnail_bytes)):
+        field = Detection._meta.get_field(field_name)
+        name = field.generate_filename(None, f'{stem}.{extension}')
+        stored[field_name] = field.storage.save(name, ContentFile(content))
+
+    if Detection.objects.filter(pk=detection_id, image=staged_name).update(**stored):
+        storage.delete(staged_name)
+        return
+    # Deleted, or already rebuilt by repair_detection_images, before its derivatives were ready
+    for field_name, name in stored.items():
+        Detection._meta.get_field(field_name).storage.delete(name)
+    if not Detection.objects.filter(pk=detection_id).exists():
+        storage.delete(staged_name)
+
+
+def store_thumbnail(detection):
+    """
+    Writes a missing thumbnail for a Detection from its stored archival copy.
+    """
+    from ..models import Detection
+    from .uploads import DecodedUpload
+
+    fmt = _archive_format()
+    with detection.image.open('rb') as f:
+        decoded = DecodedUpload(f, max_edge=getattr(settings, 'DETECTION_THUMBNAIL_EDGE', 256))
+        thumbnail_bytes = _thumbnail_bytes(decoded.rgb().copy(), fmt)
+    field = Detection._meta.get_field('thumbnail')
+    stem = os.path.splitext(os.path.basename(detection.image.name))[0]
+    name = field.storage.save(
+        field.generate_filename(None, f'{stem}.{_EXTENSIONS.get(fmt, fmt.lower())}'), ContentFile(thumbnail_bytes),
+    )
+    if not Detection.objects.filter(pk=detection.pk).update(thumbnail=name):
+        field.storage.delete(name)
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'DETECTION_DERIVATIVE_THREADS', 1),
+                    thread_name_prefix='derivatives',
+                )
+    return _executor
+
+
+def _store_items(items: list):
+    for detection_id, staged_name in items:
+        try:
+            store_derivatives(detection_id, staged_name)
+        except Exception:
+            logger.exception("Storing derivatives for detection %s failed", detection_id)
+
+
+def _store_all(items: list):
+    global _queued
+    try:
+        _store_items(items)
+    finally:
+        with _executor_lock:
+            _queued -= len(items)
+        connection.close()
+
+
+def _reserve(count: int) -> bool:
+    """
+    Claims room for `count` detections in the background queue, if it has any.
+    """
+    global _queued
+    limit = getattr(settings, 'DETECTION_DERIVATIVE_QUEUE_SIZE', 64)
+    with _executor_lock:
+        if limit and _queued + count > limit:
+            return False
+        _queued += count
+        return True
+
+
+def schedule_derivatives(items: list):
+    """
+    Stores derivatives for (detection id, staged original name) items.
+    Only the names are queued; each original is read back from storage when
+    its turn comes. Encoding and storage writes run on a background thread
+    unless DETECTION_DERIVATIVES_ASYNC is off or DETECTION_DERIVATIVE_QUEUE_SIZE
+    detections are already waiting, in which case they are written before
+    returning. Rows a dead process never got to keep their staged original
+    until repair_detection_images rebuilds them.
+    """
+    global _queued
+    if not items:
+        return
+    if getattr(settings, 'DETECTION_DERIVATIVES_ASYNC', True) and _reserve(len(items)):
+        try:
+            _get_executor().submit(_store_all, items)
+        except BaseException:
+            with _executor_lock:
+                _queued -= len(items)
+            raise
+    else:
+        _store_items(items)
+
+
+def wait_for_pending():
+    """
+    Blocks until every scheduled derivative is stored. The next schedule_derivatives
+    call starts a fresh executor.
+    """
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
@@ -0,0 +1,44 @@
+from ..models import DiseaseClass
+
+
+def parse_label(label: str) -> tuple:
+    """
+    Splits a model label into (crop, disease, healthy):
+    'Pepper_bell__bacterial_spot' -> ('Pepper bell', 'bacterial spot', False).
+    """
+    crop, separator, disease = label.partition('__')
+    if not separator:
+        crop, disease = label, ''
+    crop = crop.replace('_', ' ').strip()
+    # Some labels use a third underscore ('Strawberry___leaf_scorch')
+    disease = disease.strip('_').replace('_', ' ').strip()
+    return crop, disease, disease.lower() == 'healthy'
+
+
+def class_ids(labels) -> dict:
+    """
+    Maps every label to its DiseaseClass id, creating the missing classes.
+    """
+    labels = set(labels)
+    if not labels:
+        return {}
+    ids = dict(DiseaseClass.objects.filter(label__in=labels).values_list('label', 'pk'))
+    missing = labels - ids.keys()
+    if missing:
+        DiseaseClass.objects.bulk_create(
+            [DiseaseClass(label=label, **dict(zip(('crop', 'disease', 'healthy'), parse_label(label)))) for label in missing],
+            ignore_conflicts=True,  # another worker may be adding the same label
+        )
+        ids.update(DiseaseClass.objects.filter(label__in=missing).values_list('label', 'pk'))
+    return ids
+
+
+def link_classes(detections):
+    """
+    Points unsaved detections at the DiseaseClass of their `result`. Called by
+    the Detection model layer on save and bulk_create.
+    """
+    labelled = [(detection, detection.result) for detection in detections if detection.result]
+    ids = class_ids(label for _, label in labelled)
+    for detection, label in labelled:
+        detection.disease_class_id = ids[label]
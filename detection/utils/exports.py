@@ -0,0 +1,99 @@
+import csv
+import io
+import zlib
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import ValidationError
+
+from .streaming import server_iterator
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+# Columns of a user's own export; the admin export prepends user_id
+EXPORT_COLUMNS = ('id', 'result', 'confidence_score', 'created_at', 'latitude', 'longitude', 'flagged', 'flag_reason', 'model_version')
+
+# Encoded output is handed to the server in pieces of about this size
+_CHUNK_BYTES = 64 * 1024
+
+
+def export_rows(detections):
+    """
+    Adds the `result` column, which Detection stores only as its class link.
+    """
+    return detections.annotate(result=F('disease_class__label'))
+
+
+def export_options(request) -> tuple:
+    """
+    (file format, gzip?) from the `file_format` and `compress` query parameters.
+    """
+    file_format = request.query_params.get('file_format', 'csv')
+    if file_format not in EXPORT_FORMATS:
+        raise ValidationError({'file_format': f"Must be one of: {', '.join(EXPORT_FORMATS)}."})
+    compress = request.query_params.get('compress', '')
+    if compress not in ('', 'gzip'):
+        raise ValidationError({'compress': "Only 'gzip' is supported."})
+    return file_format, compress == 'gzip'
+
+
+def _csv_chunks(columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= _CHUNK_BYTES:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def _ndjson_chunks(columns, rows):
+    encoder = DjangoJSONEncoder()
+    lines, size = [], 0
+    for row in rows:
+        line = encoder.encode(dict(zip(columns, row)))
+        lines.append(line)
+        size += len(line) + 1
+        if size >= _CHUNK_BYTES:
+            yield ('\n'.join(lines) + '\n').encode()
+            lines, size = [], 0
+    if lines:
+        yield ('\n'.join(lines) + '\n').encode()
+
+
+def _gzip(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)  # gzip container
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_response(request, queryset, columns, filename: str) -> StreamingHttpResponse:
+    """
+    Streams `columns` of every row of `queryset` as a CSV or NDJSON download,
+    optionally gzipped, without holding more than one fetch of rows in memory:
+    rows come from `values_list().iterator()`, which uses a server-side cursor
+    on PostgreSQL, and are encoded and sent in ~64 KiB pieces.
+    """
+    file_format, compress = export_options(request)
+    rows = queryset.values_list(*columns).iterator(chunk_size=getattr(settings, 'DETECTION_EXPORT_FETCH_SIZE', 2000))
+    chunks = _csv_chunks(columns, rows) if file_format == 'csv' else _ndjson_chunks(columns, rows)
+    content_type, filename = EXPORT_FORMATS[file_format], f'{filename}.{file_format}'
+    if compress:
+        chunks, content_type, filename = _gzip(chunks), 'application/gzip', f'{filename}.gz'
+
+    response = StreamingHttpResponse(server_iterator(request, chunks), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,230 @@
+import json
+import logging
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+import numpy as np
+
+from .batching import current_flow, inference_flow
+
+logger = logging.getLogger(__name__)
+
+# Frame: 4-byte big-endian header length, JSON header, then `nbytes` of raw tensor data
+_HEADER = struct.Struct('>I')
+
+
+def _recv_exact(sock, size: int) -> bytearray:
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:], size - received)
+        if count == 0:
+            raise ConnectionError("Inference pool connection closed")
+        received += count
+    return buffer
+
+
+def send_frame(sock, header: dict, array: np.ndarray = None):
+    if array is not None:
+        array = np.ascontiguousarray(array)
+        header = {**header, 'shape': list(array.shape), 'dtype': str(array.dtype), 'nbytes': array.nbytes}
+    encoded = json.dumps(header).encode()
+    sock.sendall(_HEADER.pack(len(encoded)) + encoded)
+    if array is not None:
+        sock.sendall(memoryview(array).cast('B'))
+
+
+def recv_frame(sock):
+    (length,) = _HEADER.unpack(_recv_exact(sock, _HEADER.size))
+    header = json.loads(_recv_exact(sock, length))
+    array = None
+    if header.get('nbytes'):
+        payload = _recv_exact(sock, header['nbytes'])
+        array = np.frombuffer(payload, dtype=header['dtype']).reshape(header['shape'])
+    return header, array
+
+
+class RemoteModel:
+    """
+    What a pool response says about the model that scored it; mirrors LoadedModel.
+    """
+
+    def __init__(self, version: str, labels: list):
+        self.version = version
+        self.labels = labels
+
+
+class InferencePoolClient:
+    """
+    Sends preprocessed tensors to the inference pool over a Unix socket.
+    Each thread keeps one persistent connection; labels are cached per model version
+    and only sent by the server when the version changes.
+    """
+
+    def __init__(self, socket_path: str, timeout: float = 30.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._models = {}
+        self._last_version = None
+        self._last_seen = 0.0
+
+    def _connection(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self._local.sock = sock
+        return sock
+
+    def _reset(self):
+        sock = getattr(self._local, 'sock', None)
+        self._local.sock = None
+        if sock is not None:
+            sock.close()
+
+    def _call(self, header: dict, array: np.ndarray = None):
+        # A pooled connection may have been closed by a restarted server; retry once on a fresh one
+        for attempt in range(2):
+            try:
+                sock = self._connection()
+                send_frame(sock, header, array)
+                response, payload = recv_frame(sock)
+                break
+            except (ConnectionError, OSError):
+                self._reset()
+                if attempt:
+                    raise
+        if not response.get('ok'):
+            raise RuntimeError(response.get('error', 'Inference pool error'))
+        return response, payload
+
+    def _remember(self, response) -> RemoteModel:
+        version = response['version']
+        if 'labels' in response:
+            self._models[version] = RemoteModel(version, response['labels'])
+        self._last_version, self._last_seen = version, time.monotonic()
+        return self._models[version]
+
+    def run(self, input_tensor: np.ndarray, stage: str = 'ensemble'):
+        """
+        Scores `input_tensor` with the pool's `stage` model. Returns (probabilities, RemoteModel).
+        """
+        header = {'op': 'run', 'stage': stage, 'known_versions': list(self._models)}
+        if current_flow() is not None:
+            header['flow'] = list(current_flow())
+        response, probabilities = self._call(header, input_tensor.astype(np.float32, copy=False))
+        return probabilities, self._remember(response)
+
+    def version(self, max_age: float = 5.0) -> str:
+        """
+        Version of the pool's active model, refreshed at most every `max_age` seconds.
+        """
+        if self._last_version is None or time.monotonic() - self._last_seen > max_age:
+            response, _ = self._call({'op': 'info', 'known_versions': list(self._models)})
+            self._remember(response)
+        return self._last_version
+
+    def status(self) -> dict:
+        response, _ = self._call({'op': 'status'})
+        return response['status']
+
+
+class _PoolRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        from .onnx_predictor import get_model, registry, run_local_inference
+
+        while True:
+            try:
+                header, array = recv_frame(self.request)
+            except (ConnectionError, OSError):
+                return
+            try:
+                op = header.get('op')
+                if op == 'run':
+                    # Fair-share the pool's scheduler by the web request's user, not by connection
+                    with inference_flow(*header.get('flow', (None, 1.0))):
+                        probabilities, model = run_local_inference(array, header.get('stage', 'ensemble'))
+                elif op == 'info':
+                    probabilities, model = None, get_model()
+                elif op == 'status':
+                    # This process's own model; model_status() would ask the pool, i.e. this socket
+                    send_frame(self.request, {'ok': True, 'status': registry.status()})
+                    continue
+                else:
+                    raise ValueError(f"Unknown op {op!r}")
+                response = {'ok': True, 'version': model.version}
+                if model.version not in header.get('known_versions', []):
+                    response['labels'] = model.labels
+                send_frame(self.request, response, probabilities)
+            except Exception as e:
+                logger.exception("Inference pool request failed")
+                send_frame(self.request, {'ok': False, 'error': str(e)})
+
+
+class _PoolServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def _serve_worker(listener: socket.socket, poll_seconds: float):
+    """
+    One pool process: loads its own model, then serves connections on the shared listener.
+    Requests from all its connections go through the same micro-batching scheduler.
+    """
+    from django.db import connection
+    from .onnx_predictor import preload_model, registry
+
+    def poll_forever():
+        while True:
+            try:
+                registry.poll(force=True)
+            except Exception:
+                logger.exception("Model version poll failed")
+            finally:
+                connection.close()
+            time.sleep(poll_seconds)
+
+    threading.Thread(target=poll_forever, name='pool-model-poll', daemon=True).start()
+    preload_model()
+
+    server = _PoolServer(listener.getsockname(), _PoolRequestHandler, bind_and_activate=False)
+    server.socket = listener
+    logger.info("Inference pool worker %s serving on %s", os.getpid(), listener.getsockname())
+    server.serve_forever()
+
+
+def serve(socket_path: str, workers: int = 1, poll_seconds: float = 30):
+    """
+    Binds `socket_path` and runs `workers` pre-forked processes that each own a model copy.
+    """
+    import multiprocessing
+    from django.db import connections
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(socket_path)
+    listener.listen(128)
+
+    # Children must not share the parent's database connections
+    connections.close_all()
+    context = multiprocessing.get_context('fork')
+    processes = [
+        context.Process(target=_serve_worker, args=(listener, poll_seconds), name=f'inference-pool-{i}', daemon=True)
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    finally:
+        listener.close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
@@ -0,0 +1,424 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+import onnxruntime as ort
+from django.conf import settings
+from django.db import DatabaseError
+
+logger = logging.getLogger(__name__)
+
+
+class ModelSpec:
+    """
+    What to load: a version id, the ONNX file and its class labels.
+    """
+
+    def __init__(self, version: str, path: str, labels: list):
+        self.version = version
+        self.path = path
+        self.labels = list(labels)
+
+    def __eq__(self, other):
+        return isinstance(other, ModelSpec) and (self.version, self.path) == (other.version, other.path)
+
+
+def read_manifest(model_path: str, default_labels=None) -> ModelSpec:
+    """
+    Builds a ModelSpec from the JSON manifest sitting next to the model.
+    - `<model>.json` may hold {"version": "...", "labels": [...]}
+    - without a manifest the file name is the version and `default_labels` apply
+    """
+    stem, _ = os.path.splitext(model_path)
+    manifest = {}
+    if os.path.exists(stem + '.json'):
+        with open(stem + '.json') as f:
+            manifest = json.load(f)
+    labels = manifest.get('labels', default_labels)
+    if not labels:
+        raise ValueError(f"No labels found for model {model_path}")
+    return ModelSpec(manifest.get('version', os.path.basename(stem)), model_path, labels)
+
+
+def quantized_path(model_path: str) -> str:
+    """
+    Where the INT8 variant of a model lives: `<model>.int8.onnx`.
+    """
+    stem, _ = os.path.splitext(model_path)
+    return stem + '.int8.onnx'
+
+
+def apply_precision(spec: ModelSpec) -> ModelSpec:
+    """
+    Swaps in the INT8 variant of `spec` when PREDICTION_MODEL_PRECISION is 'int8'.
+    Falls back to FP32 if no quantized file has been produced for this model.
+    """
+    if getattr(settings, 'PREDICTION_MODEL_PRECISION', 'fp32') != 'int8':
+        return spec
+    quantized = quantized_path(spec.path)
+    if not os.path.exists(quantized):
+        logger.warning("No INT8 variant at %s, serving FP32 model %s", quantized, spec.version)
+        return spec
+    return ModelSpec(f'{spec.version}-int8', quantized, spec.labels)
+
+
+class LoadedModel:
+    """
+    A warmed ONNX session plus the labels and version it was loaded with.
+    Requests hold a lease while they run; a retired model is closed once the
+    last lease is released.
+    """
+
+    def __init__(self, spec: ModelSpec, session):
+        self.spec = spec
+        self.version = spec.version
+        self.path = spec.path
+        self.labels = spec.labels
+        self.session = session
+        self.input_name = session.get_inputs()[0].name
+        batch_dim = session.get_inputs()[0].shape[0]
+        self.fixed_batch_size = batch_dim if isinstance(batch_dim, int) and batch_dim > 0 else None
+        self.loaded_at = time.time()
+
+        self._lock = threading.Lock()
+        self._leases = 0
+        self._retired = False
+
+    def run(self, input_tensor: np.ndarray) -> np.ndarray:
+        return self.session.run(None, {self.input_name: input_tensor})[0]
+
+    def acquire(self) -> bool:
+        with self._lock:
+            if self.session is None:
+                return False
+            self._leases += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._leases -= 1
+            if self._retired and self._leases == 0:
+                self._close()
+
+    def retire(self):
+        with self._lock:
+            self._retired = True
+            if self._leases == 0:
+                self._close()
+
+    def _close(self):
+        logger.info("Releasing ONNX model %s", self.version)
+        self.session = None
+
+
+def _warm_up(session):
+    """
+    Runs the configured number of dummy batches so ORT's first-run allocations
+    happen before real traffic arrives.
+    """
+    runs = getattr(settings, 'PREDICTION_WARMUP_RUNS', 1)
+    batch_size = getattr(settings, 'PREDICTION_WARMUP_BATCH_SIZE', 1)
+    model_input = session.get_inputs()[0]
+    if isinstance(model_input.shape[0], int) and model_input.shape[0] > 0:
+        batch_size = model_input.shape[0]
+    dummy = np.zeros((batch_size,) + tuple(model_input.shape[1:]), dtype=np.float32)
+    for _ in range(runs):
+        session.run(None, {model_input.name: dummy})
+
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    'disable': ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    'basic': ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    'extended': ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    'all': ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+EXECUTION_MODES = {
+    'sequential': ort.ExecutionMode.ORT_SEQUENTIAL,
+    'parallel': ort.ExecutionMode.ORT_PARALLEL,
+}
+
+
+def configured_session_options() -> dict:
+    """
+    Session tuning for this deployment, read from the PREDICTION_ORT_* settings.
+    """
+    return {
+        'intra_op_threads': getattr(settings, 'PREDICTION_ORT_INTRA_OP_THREADS', 0),
+        'inter_op_threads': getattr(settings, 'PREDICTION_ORT_INTER_OP_THREADS', 0),
+        'execution_mode': getattr(settings, 'PREDICTION_ORT_EXECUTION_MODE', 'sequential'),
+        'graph_optimization': getattr(settings, 'PREDICTION_ORT_GRAPH_OPTIMIZATION', 'all'),
+        'cpu_mem_arena': getattr(settings, 'PREDICTION_ORT_CPU_MEM_ARENA', True),
+        'mem_pattern': getattr(settings, 'PREDICTION_ORT_MEM_PATTERN', True),
+    }
+
+
+def build_session_options(intra_op_threads=0, inter_op_threads=0, execution_mode='sequential',
+                          graph_optimization='all', cpu_mem_arena=True, mem_pattern=True) -> ort.SessionOptions:
+    """
+    Translates plain tuning values into ort.SessionOptions. 0 threads means ORT's default.
+    """
+    if execution_mode not in EXECUTION_MODES:
+        raise ValueError(f"Unknown execution mode {execution_mode!r}, expected one of {list(EXECUTION_MODES)}")
+    if graph_optimization not in GRAPH_OPTIMIZATION_LEVELS:
+        raise ValueError(f"Unknown graph optimization {graph_optimization!r}, expected one of {list(GRAPH_OPTIMIZATION_LEVELS)}")
+
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = intra_op_threads
+    options.inter_op_num_threads = inter_op_threads
+    options.execution_mode = EXECUTION_MODES[execution_mode]
+    options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[graph_optimization]
+    options.enable_cpu_mem_arena = cpu_mem_arena
+    options.enable_mem_pattern = mem_pattern
+    return options
+
+
+def _optimized_model_path(model_path: str, graph_optimization: str, cache_dir: str) -> str:
+    # Optimized graphs are only valid for the source file, level and ORT build that produced them
+    stat = os.stat(model_path)
+    key = f"{os.path.abspath(model_path)}:{stat.st_size}:{stat.st_mtime_ns}:{graph_optimization}:{ort.__version__}"
+    digest = hashlib.sha1(key.encode()).hexdigest()[:12]
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    return os.path.join(cache_dir, f"{stem}.{graph_optimization}.{digest}.onnx")
+
+
+def create_session(model_path: str, options: dict = None):
+    """
+    Creates an InferenceSession with the deployment's tuning.
+    When PREDICTION_ORT_OPTIMIZED_MODEL_DIR is set, the optimized graph is
+    serialized there on first start and loaded as-is (optimization disabled)
+    on later starts.
+    """
+    options = options or configured_session_options()
+    session_options = build_session_options(**options)
+    cache_dir = getattr(settings, 'PREDICTION_ORT_OPTIMIZED_MODEL_DIR', None)
+    if not cache_dir or options['graph_optimization'] == 'disable':
+        return ort.InferenceSession(model_path, session_options)
+
+    cached = _optimized_model_path(model_path, options['graph_optimization'], cache_dir)
+    if os.path.exists(cached):
+        session_options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS['disable']
+        try:
+            return ort.InferenceSession(cached, session_options)
+        except Exception:
+            logger.warning("Discarding unreadable optimized model %s", cached)
+            os.remove(cached)
+            session_options = build_session_options(**options)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    # Write under a per-process name so concurrent workers never read a partial file
+    temporary = f"{cached}.{os.getpid()}.tmp"
+    session_options.optimized_model_filepath = temporary
+    session = ort.InferenceSession(model_path, session_options)
+    if os.path.exists(temporary):
+        os.replace(temporary, cached)
+        logger.info("Saved optimized model %s", cached)
+    return session
+
+
+def load_model(spec: ModelSpec) -> LoadedModel:
+    """
+    Creates and warms an InferenceSession for `spec`.
+    """
+    session = create_session(spec.path)
+    _warm_up(session)
+    return LoadedModel(spec, session)
+
+
+class ModelRegistry:
+    """
+    Holds the active model for this process and swaps in new versions without downtime.
+    - the active version is the `ModelVersion` row marked active, falling back to
+      the bundled model from settings; with `versioned=False` (the cascade's
+      fast model) it is always the bundled model
+    - the first load already resolves the active version, so a process does
+      not start on the bundled model only to swap on its first poll
+    - a poll that cannot reach the database keeps whatever is being served
+    - new versions are loaded and warmed in a background thread, then published
+      atomically; in-flight requests finish on the session they leased
+    - a version that fails to load is retried after PREDICTION_MODEL_RETRY_SECONDS,
+      doubling per consecutive failure up to an hour, instead of on every poll
+    """
+
+    # Swaps kept for `status()`
+    SWAP_HISTORY = 5
+    MAX_RETRY_SECONDS = 3600
+
+    def __init__(self, default_labels: list, model_path_setting: str = 'PREDICTION_MODEL_PATH', versioned: bool = True):
+        self.default_labels = default_labels
+        self.model_path_setting = model_path_setting
+        self.versioned = versioned
+        self._active = None
+        self._lock = threading.Lock()
+        self._pending = None
+        self._last_poll = 0.0
+        self._state = {'state': 'not_loaded', 'error': None, 'load_seconds': None}
+        self._swaps = deque(maxlen=self.SWAP_HISTORY)
+        self._swap_listeners = []
+        # The version that last failed to load, how often in a row, and when it may be tried again
+        self._failed = None
+        self._failures = 0
+        self._retry_at = 0.0
+
+    def on_swap(self, callback):
+        """
+        Registers `callback(new_model)` to run after a new version is published.
+        """
+        self._swap_listeners.append(callback)
+
+    def default_spec(self) -> ModelSpec:
+        return apply_precision(read_manifest(getattr(settings, self.model_path_setting), self.default_labels))
+
+    def desired_spec(self):
+        """
+        The model this process should be serving, according to the database,
+        or None when the database cannot be read.
+        """
+        if not self.versioned:
+            return self.default_spec()
+        from detection.models import ModelVersion
+        try:
+            row = ModelVersion.objects.filter(is_active=True).order_by('-activated_at').first()
+        except DatabaseError as e:
+            logger.warning("Could not read the active model version, keeping the current one: %s", e)
+            return None
+        if row is None:
+            return self.default_spec()
+        return apply_precision(ModelSpec(row.version, row.model_path, row.labels))
+
+    def get_active(self) -> LoadedModel:
+        """
+        Returns the active model, loading the active version on first call (the
+        bundled model if the database cannot be read).
+        """
+        if self._active is not None:
+            return self._active
+        with self._lock:
+            if self._active is None:
+                self._active = self._load(self._pending or self.desired_spec() or self.default_spec())
+                self._pending = None
+        return self._active
+
+    @contextmanager
+    def lease(self):
+        """
+        Yields the active model and keeps its session alive until the block exits.
+        """
+        while True:
+            model = self.get_active()
+            if model.acquire():
+                break
+        try:
+            yield model
+        finally:
+            model.release()
+
+    def poll(self, force: bool = False):
+        """
+        Checks, at most every PREDICTION_MODEL_POLL_SECONDS, whether another
+        version was activated and starts swapping to it. Call from request threads.
+        """
+        interval = getattr(settings, 'PREDICTION_MODEL_POLL_SECONDS', 30)
+        now = time.monotonic()
+        if not force and now - self._last_poll < interval:
+            return
+        self._last_poll = now
+
+        spec = self.desired_spec()
+        if spec is None:
+            return
+        with self._lock:
+            if self._active is None:
+                # Nothing served yet: the first load picks this version up directly
+                self._pending = spec
+                return
+            if spec == self._active.spec or spec == self._pending:
+                return
+            if spec == self._failed and now < self._retry_at:
+                return
+            self._pending = spec
+        threading.Thread(target=self._swap, args=(spec,), name='onnx-swap', daemon=True).start()
+
+    def swap(self, spec: ModelSpec):
+        """
+        Loads `spec` and publishes it, blocking until the new model is active.
+        """
+        with self._lock:
+            self._pending = spec
+        self._swap(spec)
+
+    def _swap(self, spec: ModelSpec):
+        try:
+            model = self._load(spec)
+        except Exception:
+            with self._lock:
+                if self._pending == spec:
+                    self._pending = None
+                self._failures = self._failures + 1 if spec == self._failed else 1
+                self._failed = spec
+                delay = getattr(settings, 'PREDICTION_MODEL_RETRY_SECONDS', 60) * 2 ** (self._failures - 1)
+                self._retry_at = time.monotonic() + min(delay, self.MAX_RETRY_SECONDS)
+            return
+
+        with self._lock:
+            previous, self._active = self._active, model
+            if self._pending == spec:
+                self._pending = None
+            if spec == self._failed:
+                self._failed, self._failures = None, 0
+        self._swaps.append({
+            'from': previous.version if previous else None,
+            'to': model.version,
+            'at': model.loaded_at,
+        })
+        logger.info("Swapped ONNX model %s -> %s", previous.version if previous else None, model.version)
+        for callback in self._swap_listeners:
+            callback(model)
+        if previous is not None:
+            previous.retire()
+
+    def _load(self, spec: ModelSpec) -> LoadedModel:
+        self._state.update(state='loading', error=None)
+        started = time.perf_counter()
+        try:
+            model = load_model(spec)
+        except Exception as e:
+            self._state.update(state='failed' if self._active is None else 'ready', error=str(e))
+            logger.exception("Failed to load ONNX model %s from %s", spec.version, spec.path)
+            raise
+        self._state.update(state='ready', load_seconds=round(time.perf_counter() - started, 3))
+        logger.info("Loaded ONNX model %s from %s in %ss", spec.version, spec.path, self._state['load_seconds'])
+        return model
+
+    def mark_loading(self) -> bool:
+        """
+        Flags an initial background load; returns False if one is already under way.
+        """
+        if self._active is not None or self._state['state'] == 'loading':
+            return False
+        with self._lock:
+            if self._active is not None or self._state['state'] == 'loading':
+                return False
+            self._state['state'] = 'loading'
+            return True
+
+    def status(self) -> dict:
+        active = self._active
+        pending = self._pending
+        failed = self._failed
+        return {
+            'ready': active is not None,
+            'version': active.version if active else None,
+            'model_path': active.path if active else getattr(settings, self.model_path_setting),
+            'pending_version': pending.version if pending else None,
+            'failed_version': failed.version if failed else None,
+            'retry_in_seconds': round(max(self._retry_at - time.monotonic(), 0.0), 1) if failed else None,
+            'recent_swaps': list(self._swaps),
+            **self._state,
+        }
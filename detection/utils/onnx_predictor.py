@@ -1,15 +1,26 @@
-import onnxruntime as ort
 import numpy as np
-from PIL import Image
 import io
+import logging
+import threading
+import time
+from django.conf import settings
+from django.db import connection
 
-# Load ONNX model
-onnx_session = ort.InferenceSession("detection/ai_models/ensemble_model_v1.0.1.onnx")
+from .batching import MicroBatchScheduler
+from .model_registry import ModelRegistry
+from .prediction_cache import build_prediction_cache, content_digest
+from .inference_pool import InferencePoolClient
+from .cascade import CascadeStats, ENSEMBLE_STAGE, FAST_STAGE, run_cascade
+from .preprocess_pool import PreprocessStats, TimedTask, run_all
+from .uploads import DecodedUpload
+from .admission import AdmissionController
+from .quality import BLOCKING_REASONS, QualityStats, quality_mode, rejection, screen
+
+logger = logging.getLogger(__name__)
 
 # Configuration
 INPUT_SIZE = (224, 224)
 EXPECTED_SHAPE = (1, 224, 224, 3)
-INPUT_NAME = onnx_session.get_inputs()[0].name
 LABELS = [
  'Apple__black_rot',
  'Apple__healthy',
@@ -101,66 +112,408 @@ LABELS = [
  'Wheat__yellow_rust']
 
 
+# Active model, created on first use (or by preload_model) and hot-swapped when
+# another ModelVersion is activated
+registry = ModelRegistry(default_labels=LABELS)
+
+# Small first-stage classifier for the confidence-gated cascade (PREDICTION_CASCADE_ENABLED).
+# It is not versioned through ModelVersion; the ensemble stays the source of truth
+fast_registry = ModelRegistry(default_labels=LABELS, model_path_setting='PREDICTION_CASCADE_FAST_MODEL_PATH', versioned=False)
+cascade_stats = CascadeStats()
+
+# Decode/resize timings for uploads, per request
+preprocess_stats = PreprocessStats()
+
+# Blur/exposure/leaf prescreen outcomes
+quality_stats = QualityStats()
+
+# Predictions for previously seen uploads, keyed by content hash and model version
+prediction_cache = build_prediction_cache()
+registry.on_swap(prediction_cache.clear_local)
+
+# In-flight prediction work in this process; sheds requests that would blow the latency budget
+admission = AdmissionController()
+
+# Set when PREDICTION_BACKEND is 'pool': inference runs in `manage.py run_inference_pool`
+pool_client = InferencePoolClient(
+    getattr(settings, 'PREDICTION_POOL_SOCKET', '/tmp/plant-disease-inference.sock'),
+    timeout=getattr(settings, 'PREDICTION_POOL_TIMEOUT', 30.0),
+)
 
 
-def is_preprocessed(image_array: np.ndarray) -> bool:
+def _use_pool() -> bool:
+    return getattr(settings, 'PREDICTION_BACKEND', 'local') == 'pool'
+
+
+def get_model():
     """
-    Checks if image is likely preprocessed:
-    - shape (224, 224, 3)
-    - dtype float32
-    - values between 0 and 1
+    Returns the active model, loading and warming it on first call.
     """
-    if image_array.shape == (224, 224, 3) and image_array.dtype == np.float32:
-        min_val, max_val = image_array.min(), image_array.max()
-        return 0.0 <= min_val <= 1.0 and max_val <= 1.0
-    return False
+    return registry.get_active()
 
 
-def preprocess_image(image_file) -> np.ndarray:
+def preload_model():
     """
-    Preprocesses the image to shape (1, 224, 224, 3) (NHWC).
+    Eagerly loads and warms the model. Used by serving processes at startup.
     """
     try:
-        image_file.seek(0)
-        image = Image.open(image_file).convert("RGB")
-        image_array = np.array(image)
+        get_model()
+    except Exception:
+        logger.exception("Failed to preload ONNX model")
 
-        if is_preprocessed(image_array):
-            # Already resized and normalized, just add batch dimension
-            tensor = np.expand_dims(image_array, axis=0)  # (1, 224, 224, 3)
-        else:
-            # Resize, normalize, add batch dim
-            image = image.resize(INPUT_SIZE)
-            image_array = np.array(image).astype(np.float32) / 255.0  # (224, 224, 3)
-            tensor = np.expand_dims(image_array, axis=0)  # (1, 224, 224, 3)
 
-        if tensor.shape != EXPECTED_SHAPE:
-            raise ValueError(f"Final input tensor has invalid shape: {tensor.shape}, expected {EXPECTED_SHAPE}")
+def _load_in_background():
+    try:
+        registry.poll(force=True)
+        preload_model()
+    finally:
+        connection.close()
 
-        return tensor.astype(np.float32)
+
+def start_background_load():
+    """
+    Kicks off model loading in a background thread if nothing has started it yet.
+    """
+    if registry.mark_loading():
+        threading.Thread(target=_load_in_background, name='onnx-preload', daemon=True).start()
+
+
+def model_status() -> dict:
+    """
+    Current load state of the model: not_loaded, loading, ready or failed.
+    In pool mode this is the state of the pool's model.
+    """
+    if _use_pool():
+        try:
+            return {**pool_client.status(), 'backend': 'pool'}
+        except Exception as e:
+            return {'backend': 'pool', 'ready': False, 'state': 'unreachable', 'error': str(e)}
+    return {'backend': 'local', **registry.status()}
+
+
+def poll_model_version():
+    """
+    Lets the local registry pick up a newly activated model. The pool polls on its own.
+    """
+    if not _use_pool():
+        registry.poll()
+
+
+def active_model_version() -> str:
+    """
+    Version of the model that will score the next request.
+    """
+    if _use_pool():
+        try:
+            return pool_client.version()
+        except Exception:
+            if not getattr(settings, 'PREDICTION_POOL_FALLBACK', False):
+                raise
+    return get_model().version
+
+
+def preprocess_into(image_file, out: np.ndarray) -> None:
+    """
+    Decodes, resizes and normalizes an image straight into `out`, a (224, 224, 3)
+    float32 slot of a preallocated batch buffer.
+    - the image is opened through its DecodedUpload, so the header parsed during
+      upload validation and the decoded pixels are shared with the quality checks
+    - the pixel count is checked from the header before anything is decoded
+    - JPEGs are decoded with DCT scaling (draft) at the smallest scale that
+      covers 224x224, so the full-resolution image never exists in memory
+    """
+    try:
+        image = DecodedUpload.of(image_file).rgb()
+        if image.size != INPUT_SIZE:
+            image = image.resize(INPUT_SIZE, reducing_gap=3.0)
+
+        np.divide(np.asarray(image), np.float32(255.0), out=out)
 
     except Exception as e:
         raise ValueError(f"Image preprocessing failed: {str(e)}")
 
 
-def predict(image_file) -> dict:
+# Raw tensor uploads: dtype is implied by the byte length of a 224x224x3 array
+_RAW_TENSOR_DTYPES = {
+    np.dtype(np.uint8).itemsize * 224 * 224 * 3: np.dtype(np.uint8),
+    np.dtype(np.float16).itemsize * 224 * 224 * 3: np.dtype(np.float16),
+    np.dtype(np.float32).itemsize * 224 * 224 * 3: np.dtype(np.float32),
+}
+
+
+def load_tensor(tensor_file) -> np.ndarray:
     """
-    Performs inference using the ONNX model with NHWC input.
+    Reads a mobile-preprocessed (224, 224, 3) tensor without decoding or copying it.
+    - `.npy` files are parsed from their header
+    - raw files must be uint8, float16 or float32 bytes; the dtype follows from the size
+    - only shape and dtype are validated; float tensors are expected in [0, 1]
+    """
+    tensor_file.seek(0)
+    data = tensor_file.read()
+
+    if data[:6] == b'\x93NUMPY':
+        header = io.BytesIO(data)
+        version = np.lib.format.read_magic(header)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(header)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(header)
+        if fortran_order:
+            raise ValueError("Fortran-ordered .npy tensors are not supported")
+        offset = header.tell()
+    else:
+        if len(data) not in _RAW_TENSOR_DTYPES:
+            raise ValueError(f"Raw tensor is {len(data)} bytes; expected 224x224x3 uint8, float16 or float32")
+        shape, dtype, offset = EXPECTED_SHAPE[1:], _RAW_TENSOR_DTYPES[len(data)], 0
+
+    if tuple(shape) not in (EXPECTED_SHAPE, EXPECTED_SHAPE[1:]):
+        raise ValueError(f"Tensor has shape {tuple(shape)}, expected {EXPECTED_SHAPE[1:]}")
+    if dtype not in _RAW_TENSOR_DTYPES.values():
+        raise ValueError(f"Tensor has dtype {dtype}, expected uint8, float16 or float32")
+    return np.frombuffer(data, dtype=dtype, count=224 * 224 * 3, offset=offset).reshape(EXPECTED_SHAPE[1:])
+
+
+def preprocess_tensor_into(tensor_file, out: np.ndarray) -> None:
+    """
+    Writes an uploaded tensor into `out`, scaling uint8 pixels to [0, 1].
     """
     try:
-        input_tensor = preprocess_image(image_file)
-        outputs = onnx_session.run(None, {INPUT_NAME: input_tensor})
-
-        probabilities = outputs[0][0]  # (num_classes,)
-        confidence = float(np.max(probabilities))
-        predicted_index = int(np.argmax(probabilities))
-        predicted_label = LABELS[predicted_index]
-
-        return {
-            "label": predicted_label,
-            "confidence": round(confidence, 4)
-        }
+        tensor = load_tensor(tensor_file)
+        if tensor.dtype == np.uint8:
+            np.divide(tensor, np.float32(255.0), out=out)
+        else:
+            out[...] = tensor
     except Exception as e:
-        return {
-            "error": str(e)
-        }
+        raise ValueError(f"Tensor upload rejected: {str(e)}")
+
+
+def preprocess_image(image_file) -> np.ndarray:
+    """
+    Preprocesses the image to shape (1, 224, 224, 3) (NHWC).
+    """
+    tensor = np.empty(EXPECTED_SHAPE, dtype=np.float32)
+    preprocess_into(image_file, tensor[0])
+    return tensor
+
+
+def _run_session(input_tensor: np.ndarray, models: ModelRegistry = registry):
+    """
+    Runs the active model of `models` on an NHWC batch.
+    Returns (N, num_classes) probabilities and the model that produced them.
+    """
+    with models.lease() as model:
+        return model.run(input_tensor), model
+
+
+batch_scheduler = MicroBatchScheduler(
+    _run_session,
+    max_batch_size=getattr(settings, 'PREDICTION_BATCH_MAX_SIZE', 16),
+    max_wait_ms=getattr(settings, 'PREDICTION_BATCH_MAX_WAIT_MS', 5.0),
+    quantum=getattr(settings, 'PREDICTION_FAIR_QUANTUM', None),
+)
+
+fast_batch_scheduler = MicroBatchScheduler(
+    lambda input_tensor: _run_session(input_tensor, fast_registry),
+    max_batch_size=getattr(settings, 'PREDICTION_BATCH_MAX_SIZE', 16),
+    max_wait_ms=getattr(settings, 'PREDICTION_BATCH_MAX_WAIT_MS', 5.0),
+    name='onnx-fast-batcher',
+    quantum=getattr(settings, 'PREDICTION_FAIR_QUANTUM', None),
+)
+
+
+def flow_for_user(user, tier: str = None) -> tuple:
+    """
+    The (flow key, weight) the batch scheduler shares inference by: one flow per
+    user, weighted by their profile's inference tier (or `tier`) through
+    PREDICTION_TIER_WEIGHTS. Queries the profile, so call it from sync code.
+    """
+    weights = getattr(settings, 'PREDICTION_TIER_WEIGHTS', {'standard': 1.0})
+    if tier is None:
+        tier = getattr(getattr(user, 'profile', None), 'inference_tier', None) or 'standard'
+    return user.pk, float(weights.get(tier, weights.get('standard', 1.0)))
+
+_STAGES = {
+    ENSEMBLE_STAGE: (registry, batch_scheduler),
+    FAST_STAGE: (fast_registry, fast_batch_scheduler),
+}
+
+
+def run_inference(input_tensor: np.ndarray, stage: str = ENSEMBLE_STAGE):
+    """
+    Scores an NHWC tensor, in the inference pool when PREDICTION_BACKEND is 'pool'
+    and in this process otherwise (or when the pool is unreachable and
+    PREDICTION_POOL_FALLBACK is on).
+    Returns the probabilities and the model that produced them.
+    """
+    if _use_pool():
+        try:
+            return pool_client.run(input_tensor, stage)
+        except (ConnectionError, OSError) as e:
+            if not getattr(settings, 'PREDICTION_POOL_FALLBACK', False):
+                raise
+            logger.warning("Inference pool unavailable (%s), running in-process", e)
+    return run_local_inference(input_tensor, stage)
+
+
+def run_local_inference(input_tensor: np.ndarray, stage: str = ENSEMBLE_STAGE):
+    """
+    Scores an NHWC tensor in this process, sharing a batched run with concurrent
+    requests when enabled. Returns the probabilities and the model that produced them.
+    """
+    models, scheduler = _STAGES[stage]
+    # Models exported with a fixed batch dimension can only take that many images per run
+    fixed = models.get_active().fixed_batch_size
+    if fixed and input_tensor.shape[0] > fixed:
+        scored = {i: run_local_inference(input_tensor[i:i + fixed], stage) for i in range(0, input_tensor.shape[0], fixed)}
+        # Every row must come from one model: rescore chunks that ran before a swap
+        for _ in range(2):
+            active = models.get_active()
+            stale = [i for i, (_, model) in scored.items() if model is not active]
+            if not stale:
+                break
+            scored.update({i: run_local_inference(input_tensor[i:i + fixed], stage) for i in stale})
+        else:
+            raise RuntimeError("The active model kept changing while scoring the batch")
+        return np.concatenate([scored[i][0] for i in sorted(scored)], axis=0), active
+
+    if getattr(settings, 'PREDICTION_BATCHING_ENABLED', True):
+        if fixed:
+            scheduler.max_batch_size = min(scheduler.max_batch_size, fixed)
+        return scheduler.submit(input_tensor)
+    return _run_session(input_tensor, models)
+
+
+def _cascade_enabled() -> bool:
+    return getattr(settings, 'PREDICTION_CASCADE_ENABLED', False)
+
+
+def score_batch(input_tensor: np.ndarray) -> list:
+    """
+    Scores an NHWC batch, through the fast-model cascade when enabled.
+    Returns one (probabilities, model, stage) tuple per row.
+    """
+    if _cascade_enabled():
+        threshold = getattr(settings, 'PREDICTION_CASCADE_THRESHOLD', 0.9)
+        return run_cascade(input_tensor, run_inference, threshold, cascade_stats)
+    probabilities, model = run_inference(input_tensor)
+    return [(row, model, ENSEMBLE_STAGE) for row in probabilities]
+
+
+def _to_prediction(probabilities: np.ndarray, model, stage: str = ENSEMBLE_STAGE) -> dict:
+    confidence = float(np.max(probabilities))
+    predicted_index = int(np.argmax(probabilities))
+    return {
+        "label": model.labels[predicted_index],
+        "confidence": round(confidence, 4),
+        "model_version": model.version,
+        "stage": stage,
+    }
+
+
+def _cache_version(model_version: str) -> str:
+    # Cascade answers depend on the threshold, so they never share entries with plain ensemble ones
+    if _cascade_enabled():
+        return f"{model_version}+cascade@{getattr(settings, 'PREDICTION_CASCADE_THRESHOLD', 0.9)}"
+    return model_version
+
+
+def _cache_enabled() -> bool:
+    return getattr(settings, 'PREDICTION_CACHE_ENABLED', True)
+
+
+def predict(image_file) -> dict:
+    """
+    Performs inference using the ONNX model with NHWC input.
+    """
+    return predict_batch([image_file])[0]
+
+
+def predict_batch(image_files, tensor_files=()) -> list:
+    """
+    Scores several images with a single forward pass.
+    - uploads already in the prediction cache skip decoding and inference
+    - every other image is preprocessed into one stacked (N, 224, 224, 3) tensor,
+      fanned out over the preprocessing thread pool; `tensor_files` were
+      preprocessed on the device and are copied in as-is
+    - an image that fails preprocessing gets its own {"error": ...} entry
+    - decoded images are prescreened for blur, exposure and leaf coverage; with
+      PREDICTION_QUALITY_MODE 'reject' blurred, dark or overexposed ones are not
+      scored and get an error entry with the reasons; anything else flagged
+      (and everything flagged in 'tag' mode) is scored and carries "quality_warnings"
+    - results are returned in the order of `image_files` followed by `tensor_files`
+    """
+    loaders = [preprocess_into] * len(image_files) + [preprocess_tensor_into] * len(tensor_files)
+    image_files = list(image_files) + list(tensor_files)
+    results = [None] * len(image_files)
+    digests = [None] * len(image_files)
+
+    if _cache_enabled():
+        try:
+            version = _cache_version(active_model_version())
+        except Exception as e:
+            return [{"error": str(e)} for _ in image_files]
+
+        for index, outcome in enumerate(run_all(lambda i: content_digest(image_files[i]), len(image_files))):
+            if isinstance(outcome, Exception):
+                results[index] = {"error": str(outcome)}
+                continue
+            digests[index] = outcome
+            results[index] = prediction_cache.get(outcome, version)
+
+    # Each remaining upload gets its own slot, so threads write into the batch without coordination
+    pending = [index for index, result in enumerate(results) if result is None]
+    batch = np.empty((len(pending),) + EXPECTED_SHAPE[1:], dtype=np.float32)
+    started = time.perf_counter()
+    task = TimedTask(lambda slot: loaders[pending[slot]](image_files[pending[slot]], batch[slot]))
+    outcomes = run_all(task, len(pending))
+    preprocess_stats.record(len(pending), time.perf_counter() - started, task.busy)
+
+    slots = [slot for slot, outcome in enumerate(outcomes) if not isinstance(outcome, Exception)]
+    for slot, outcome in enumerate(outcomes):
+        if isinstance(outcome, Exception):
+            results[pending[slot]] = {"error": str(outcome)}
+
+    # Only failed uploads leave gaps; the common all-good case scores the buffer in place
+    tensor = batch if len(slots) == len(pending) else batch[slots]
+    positions = [pending[slot] for slot in slots]
+
+    warnings = {}
+    mode = quality_mode()
+    if positions and mode != 'off':
+        originals = [
+            DecodedUpload.of(image_files[index]).rgb() if loaders[index] is preprocess_into else None
+            for index in positions
+        ]
+        screened = screen(tensor, originals)
+        quality_stats.record(screened)
+        blocking = BLOCKING_REASONS if mode == 'reject' else ()
+        keep = []
+        for row, (metrics, reasons) in enumerate(screened):
+            if any(reason in blocking for reason in reasons):
+                results[positions[row]] = rejection(metrics, reasons)
+                continue
+            keep.append(row)
+            if reasons:
+                warnings[positions[row]] = reasons
+        if len(keep) < len(positions):
+            tensor, positions = tensor[keep], [positions[row] for row in keep]
+
+    if positions:
+        try:
+            scored = score_batch(tensor)
+        except Exception as e:
+            for index in positions:
+                results[index] = {"error": str(e)}
+        else:
+            for (probabilities, model, stage), index in zip(scored, positions):
+                results[index] = _to_prediction(probabilities, model, stage)
+                if index in warnings:
+                    results[index]["quality_warnings"] = warnings[index]
+                if digests[index] is not None:
+                    # Key by the model that actually scored the row: a swap can land between
+                    # the lookup above and inference. Fast-stage answers are looked up under
+                    # the active ensemble version, so they keep that key
+                    scored_version = _cache_version(results[index]["model_version"]) if stage == ENSEMBLE_STAGE else version
+                    prediction_cache.set(digests[index], scored_version, results[index])
+
+    return results
@@ -0,0 +1,133 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+
+def content_digest(image_file) -> str:
+    """
+    Hash of the uploaded bytes, read in chunks so large uploads are never held twice.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    image_file.seek(0)
+    if hasattr(image_file, 'chunks'):
+        for chunk in image_file.chunks():
+            digest.update(chunk)
+    else:
+        for chunk in iter(lambda: image_file.read(64 * 1024), b''):
+            digest.update(chunk)
+    image_file.seek(0)
+    return digest.hexdigest()
+
+
+class PredictionCache:
+    """
+    Caches predictions by (content hash, model version).
+    - a bounded in-process LRU tier with TTL
+    - an optional shared tier in a Django cache alias (e.g. a DB or Redis cache),
+      consulted on local misses
+    - entries are keyed by model version, and the local tier is cleared when the
+      active model changes
+    - the shared tier is best effort: if its backend fails, a lookup counts as a
+      miss and a write only reaches the local tier
+    """
+
+    def __init__(self, max_entries: int = 2048, ttl: float = 86400, shared_alias: str = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.shared_alias = shared_alias
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {'local_hits': 0, 'shared_hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'shared_errors': 0}
+
+    @staticmethod
+    def _key(digest: str, model_version: str) -> str:
+        return f'prediction:{model_version}:{digest}'
+
+    def _shared(self):
+        return caches[self.shared_alias] if self.shared_alias else None
+
+    def get(self, digest: str, model_version: str):
+        key = self._key(digest, model_version)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, prediction = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._counters['local_hits'] += 1
+                    return dict(prediction)
+                del self._entries[key]
+                self._counters['expirations'] += 1
+
+        prediction = None
+        shared = self._shared()
+        if shared is not None:
+            try:
+                prediction = shared.get(key)
+            except Exception as e:
+                self._shared_error('read', e)
+        with self._lock:
+            if prediction is None:
+                self._counters['misses'] += 1
+                return None
+            self._counters['shared_hits'] += 1
+        self._store_local(key, prediction)
+        return dict(prediction)
+
+    def set(self, digest: str, model_version: str, prediction: dict):
+        key = self._key(digest, model_version)
+        self._store_local(key, dict(prediction))
+        shared = self._shared()
+        if shared is not None:
+            try:
+                shared.set(key, dict(prediction), timeout=self.ttl)
+            except Exception as e:
+                self._shared_error('write', e)
+
+    def _shared_error(self, operation, error):
+        logger.warning("Shared prediction cache %s failed on %r: %s", operation, self.shared_alias, error)
+        with self._lock:
+            self._counters['shared_errors'] += 1
+
+    def _store_local(self, key, prediction):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, prediction)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters['evictions'] += 1
+
+    def clear_local(self, *args):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+            size = len(self._entries)
+        lookups = counters['local_hits'] + counters['shared_hits'] + counters['misses']
+        hits = counters['local_hits'] + counters['shared_hits']
+        return {
+            'size': size,
+            'max_entries': self.max_entries,
+            'ttl_seconds': self.ttl,
+            'shared_alias': self.shared_alias,
+            **counters,
+            'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+def build_prediction_cache() -> PredictionCache:
+    return PredictionCache(
+        max_entries=getattr(settings, 'PREDICTION_CACHE_MAX_ENTRIES', 2048),
+        ttl=getattr(settings, 'PREDICTION_CACHE_TTL_SECONDS', 86400),
+        shared_alias=getattr(settings, 'PREDICTION_CACHE_SHARED_ALIAS', None),
+    )
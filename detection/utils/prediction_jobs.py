@@ -0,0 +1,200 @@
+import logging
+import os
+import socket
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from ..models import Detection, PredictionJob, PredictionJobItem
+from .batching import inference_flow
+from .derivatives import schedule_derivatives
+from .onnx_predictor import flow_for_user, poll_model_version, predict_batch
+
+logger = logging.getLogger(__name__)
+
+
+class LeaseLost(Exception):
+    """
+    The job was requeued (its heartbeat went stale) while this worker held it.
+    """
+
+
+def submit_job(user, images, tensors=()) -> PredictionJob:
+    """
+    Stages the uploads in storage and queues a job for them.
+    """
+    items = []
+    try:
+        for position, (upload, preprocessed_on) in enumerate(
+            [(image, 'backend') for image in images] + [(tensor, 'mobile') for tensor in tensors]
+        ):
+            item = PredictionJobItem(position=position, filename=upload.name, preprocessed_on=preprocessed_on)
+            item.upload.save(upload.name, upload, save=False)
+            items.append(item)
+
+        with transaction.atomic():
+            job = PredictionJob.objects.create(user=user, total=len(items))
+            for item in items:
+                item.job = job
+            PredictionJobItem.objects.bulk_create(items)
+    except Exception:
+        for item in items:
+            item.upload.delete(save=False)
+        raise
+    return job
+
+
+def requeue_stale_jobs() -> int:
+    """
+    Returns running jobs whose worker stopped heartbeating to the queue.
+    """
+    cutoff = timezone.now() - timedelta(seconds=getattr(settings, 'PREDICTION_JOB_LEASE_SECONDS', 300))
+    requeued = PredictionJob.objects.filter(status=PredictionJob.RUNNING, heartbeat_at__lt=cutoff).update(
+        status=PredictionJob.QUEUED, worker=None,
+    )
+    if requeued:
+        logger.warning("Requeued %s prediction job(s) with a stale heartbeat", requeued)
+    return requeued
+
+
+def claim_job(worker: str):
+    """
+    Claims the oldest queued job. The claim is a conditional UPDATE, so concurrent
+    workers never get the same job, on any database backend.
+    """
+    candidates = PredictionJob.objects.filter(status=PredictionJob.QUEUED).order_by('created_at')
+    for job_id in candidates.values_list('pk', flat=True)[:10]:
+        now = timezone.now()
+        claimed = PredictionJob.objects.filter(pk=job_id, status=PredictionJob.QUEUED).update(
+            status=PredictionJob.RUNNING, worker=worker, heartbeat_at=now,
+            started_at=Coalesce(F('started_at'), Value(now)),
+        )
+        if claimed:
+            return PredictionJob.objects.get(pk=job_id)
+    return None
+
+
+def _score_chunk(job: PredictionJob, items: list, worker: str):
+    """
+    Scores one chunk of items and records it in a single transaction: the
+    Detection rows, the item results and the job's progress counters.
+    """
+    # predict_batch returns images first, then tensors
+    items = sorted(items, key=lambda item: item.preprocessed_on != 'backend')
+    files, opened, predictions = {}, [], {}
+    for item in items:
+        try:
+            files[item.pk] = item.upload.open('rb')
+            opened.append(item)
+        except Exception as e:
+            predictions[item.pk] = {"error": f"Staged upload is unavailable: {e}"}
+
+    images = [files[item.pk] for item in opened if item.preprocessed_on == 'backend']
+    tensors = [files[item.pk] for item in opened if item.preprocessed_on != 'backend']
+    for item, prediction in zip(opened, predict_batch(images, tensors)):
+        predictions[item.pk] = prediction
+
+    detections = []
+    for item in items:
+        prediction = predictions[item.pk]
+        if "error" in prediction:
+            # Quality rejections already explain themselves
+            error = prediction["error"] if "rejected" in prediction else f"Prediction failed: {prediction['error']}"
+            item.status, item.error = PredictionJobItem.FAILED, error
+            continue
+        item.status = PredictionJobItem.DONE
+        item.result = prediction["label"]
+        item.confidence_score = prediction["confidence"]
+        item.model_version = prediction["model_version"]
+        item.inference_stage = prediction["stage"]
+        item.detection = Detection(
+            user_id=job.user_id,
+            # A scored image's staged upload becomes the Detection's image until
+            # the archival copy replaces it
+            image=item.upload.name if item.preprocessed_on == 'backend' else '',
+            result=item.result,
+            confidence_score=item.confidence_score,
+            model_version=item.model_version,
+            inference_stage=item.inference_stage,
+        )
+        detections.append(item.detection)
+
+    # Staged images now belong to their Detections; the other uploads are done with
+    archived = [item for item in items if item.detection and item.preprocessed_on == 'backend']
+    discarded = [item.upload.name for item in items if item.upload and item not in archived]
+    for item in items:
+        item.upload = ''
+    failed = sum(item.status == PredictionJobItem.FAILED for item in items)
+
+    with transaction.atomic():
+        if not PredictionJob.objects.filter(pk=job.pk, status=PredictionJob.RUNNING, worker=worker).update(
+            processed=F('processed') + len(items), failed=F('failed') + failed, heartbeat_at=timezone.now(),
+        ):
+            raise LeaseLost(job.pk)
+        Detection.objects.bulk_create(detections)
+        for item in items:
+            item.detection_id = item.detection.pk if item.detection else None
+        PredictionJobItem.objects.bulk_update(
+            items, ['status', 'result', 'confidence_score', 'model_version', 'inference_stage', 'error', 'detection', 'upload'],
+        )
+
+    try:
+        schedule_derivatives([(item.detection_id, item.detection.image.name) for item in archived])
+    finally:
+        storage = PredictionJobItem._meta.get_field('upload').storage
+        for file in files.values():
+            file.close()
+        for name in discarded:
+            storage.delete(name)
+
+
+def process_job(job: PredictionJob, worker: str):
+    """
+    Scores a claimed job chunk by chunk until no pending items are left.
+    """
+    chunk_size = getattr(settings, 'PREDICTION_JOB_CHUNK_SIZE', 32)
+    try:
+        # Jobs share a pooled model with interactive requests at the 'bulk' tier's weight
+        with inference_flow(*flow_for_user(job.user, tier='bulk')):
+            while True:
+                items = list(job.items.filter(status=PredictionJobItem.PENDING).order_by('position')[:chunk_size])
+                if not items:
+                    break
+                poll_model_version()
+                _score_chunk(job, items, worker)
+    except LeaseLost:
+        logger.warning("Lost the lease on prediction job %s; another worker will finish it", job.pk)
+        return
+    except Exception as e:
+        logger.exception("Prediction job %s failed", job.pk)
+        PredictionJob.objects.filter(pk=job.pk, worker=worker).update(
+            status=PredictionJob.FAILED, error=str(e), finished_at=timezone.now(),
+        )
+        return
+    PredictionJob.objects.filter(pk=job.pk, worker=worker).update(status=PredictionJob.DONE, finished_at=timezone.now())
+
+
+def default_worker_name() -> str:
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def run_worker(worker: str = None, poll_seconds: float = 2.0, once: bool = False):
+    """
+    Claims and processes jobs until stopped; with `once`, until the queue is empty.
+    """
+    worker = worker or default_worker_name()
+    while True:
+        close_old_connections()
+        requeue_stale_jobs()
+        job = claim_job(worker)
+        if job is not None:
+            process_job(job, worker)
+            continue
+        if once:
+            return
+        time.sleep(poll_seconds)
@@ -0,0 +1,97 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+_executor = None
+_executor_workers = 0
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """
+    Process-wide pool for decoding and resizing uploads. Pillow releases the GIL
+    while decoding and resizing, so these threads run on separate cores.
+    """
+    global _executor, _executor_workers
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor_workers = getattr(settings, 'PREDICTION_PREPROCESS_THREADS', 0) or min(4, os.cpu_count() or 1)
+                _executor = ThreadPoolExecutor(max_workers=_executor_workers, thread_name_prefix='preprocess')
+    return _executor
+
+
+def run_all(task, count: int) -> list:
+    """
+    Calls `task(i)` for i in range(count) on the pool and returns the outcomes in order.
+    Each outcome is the task's return value, or the exception it raised.
+    """
+    def guarded(i):
+        try:
+            return task(i)
+        except Exception as e:
+            return e
+
+    if count <= 1:
+        return [guarded(i) for i in range(count)]
+    return list(get_executor().map(guarded, range(count)))
+
+
+class PreprocessStats:
+    """
+    Wall-clock decode time per request, and the summed per-image time across threads.
+    """
+
+    def __init__(self, window: int = 1024):
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._images = 0
+        self._wall = deque(maxlen=window)
+        self._busy = 0.0
+
+    def record(self, images: int, wall_seconds: float, busy_seconds: float):
+        with self._lock:
+            self._requests += 1
+            self._images += images
+            self._wall.append(wall_seconds)
+            self._busy += busy_seconds
+
+    def stats(self) -> dict:
+        with self._lock:
+            wall = sorted(self._wall)
+            requests, images, busy = self._requests, self._images, self._busy
+        return {
+            'threads': _executor_workers,
+            'requests': requests,
+            'images': images,
+            'mean_image_ms': round(busy / images * 1000, 3) if images else 0.0,
+            'request_wall_ms': {
+                'mean': round(sum(wall) / len(wall) * 1000, 3) if wall else 0.0,
+                'p50': round(wall[len(wall) // 2] * 1000, 3) if wall else 0.0,
+                'p95': round(wall[min(len(wall) - 1, int(len(wall) * 0.95))] * 1000, 3) if wall else 0.0,
+            },
+        }
+
+
+class TimedTask:
+    """
+    Wraps a per-image task and accumulates how long it ran.
+    """
+
+    def __init__(self, task):
+        self.task = task
+        self.busy = 0.0
+        self._lock = threading.Lock()
+
+    def __call__(self, i):
+        started = time.perf_counter()
+        try:
+            return self.task(i)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.busy += elapsed
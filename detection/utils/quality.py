@@ -0,0 +1,154 @@
+import threading
+from collections import Counter
+
+import numpy as np
+from django.conf import settings
+
+# ITU-R BT.601 luma weights
+_LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+# Why an image was rejected, phrased for the farmer retaking the photo
+REASON_MESSAGES = {
+    'blurry': "the photo is blurred; hold the phone steady and tap the leaf to focus",
+    'too_dark': "the photo is too dark; take it in better light",
+    'too_bright': "the photo is overexposed; avoid direct sunlight on the leaf",
+    'no_leaf': "no leaf was found; fill the frame with the affected leaf",
+}
+
+# Reasons that stop an image from being scored in 'reject' mode. no_leaf only
+# warns: the leaf check is a heuristic, and a wrong rejection costs the farmer
+# a diagnosis
+BLOCKING_REASONS = ('blurry', 'too_dark', 'too_bright')
+
+# Hues (degrees) counted as foliage: red through yellow and green up to
+# blue-green, plus the deep reds just below 360
+_FOLIAGE_MAX_HUE = 165.0
+_FOLIAGE_MIN_RED_HUE = 340.0
+
+# Edge of the centre crop whose sharpness is measured at decode resolution
+_NATIVE_CROP = 512
+
+
+def quality_mode() -> str:
+    return getattr(settings, 'PREDICTION_QUALITY_MODE', 'tag')
+
+
+def _laplacian_variance(luma: np.ndarray) -> np.ndarray:
+    """
+    Variance of the 4-neighbour Laplacian of (N, H, W) luma in [0, 1], on the 0-255 scale.
+    """
+    laplacian = (
+        luma[:, :-2, 1:-1] + luma[:, 2:, 1:-1] + luma[:, 1:-1, :-2] + luma[:, 1:-1, 2:]
+        - 4 * luma[:, 1:-1, 1:-1]
+    )
+    return laplacian.reshape(luma.shape[0], -1).var(axis=1) * (255.0 ** 2)
+
+
+def native_sharpness(image) -> float:
+    """
+    Sharpness of a centre crop of a decoded upload at its decode resolution.
+    Downscaling a large, finely detailed photo to 224 averages its detail away,
+    so the 224 buffer alone would call it blurred.
+    """
+    width, height = image.size
+    crop_width, crop_height = min(width, _NATIVE_CROP), min(height, _NATIVE_CROP)
+    left, top = (width - crop_width) // 2, (height - crop_height) // 2
+    crop = image.crop((left, top, left + crop_width, top + crop_height)).convert('L')
+    luma = np.asarray(crop, dtype=np.float32)[np.newaxis] / np.float32(255.0)
+    return float(_laplacian_variance(luma)[0])
+
+
+def measure(batch: np.ndarray) -> dict:
+    """
+    Quality metrics for every image of an NHWC float batch in [0, 1], as arrays of length N.
+    - sharpness: variance of the 4-neighbour Laplacian of the luma, on the 0-255 scale
+    - brightness: mean luma in [0, 1]
+    - foliage_coverage: fraction of pixels with a foliage colour, i.e. a hue
+      between red and green (red, rust, brown, yellow and green leaves alike)
+      and HSV saturation of at least PREDICTION_QUALITY_FOLIAGE_MIN_SATURATION;
+      grey, white, black and blue backgrounds do not count
+    """
+    count = batch.shape[0]
+    luma = batch @ _LUMA
+    red, green, blue = batch[..., 0], batch[..., 1], batch[..., 2]
+    high, low = batch.max(axis=-1), batch.min(axis=-1)
+    chroma = np.maximum(high - low, 1e-6)
+    saturation = (high - low) / np.maximum(high, 1e-6)
+    hue = np.where(
+        high == red, 60 * (((green - blue) / chroma) % 6),
+        np.where(high == green, 60 * ((blue - red) / chroma + 2), 60 * ((red - green) / chroma + 4)),
+    )
+    min_saturation = getattr(settings, 'PREDICTION_QUALITY_FOLIAGE_MIN_SATURATION', 0.2)
+    foliage = ((hue <= _FOLIAGE_MAX_HUE) | (hue >= _FOLIAGE_MIN_RED_HUE)) & (saturation >= min_saturation)
+    return {
+        'sharpness': _laplacian_variance(luma),
+        'brightness': luma.reshape(count, -1).mean(axis=1),
+        'foliage_coverage': foliage.reshape(count, -1).mean(axis=1),
+    }
+
+
+def screen(batch: np.ndarray, originals=()) -> list:
+    """
+    Checks every image of a preprocessed batch against the PREDICTION_QUALITY_*
+    thresholds. `originals` holds the decoded upload of each row (None for
+    tensors); an image counts as blurred only if it is flat both at 224 and at
+    its decode resolution. Returns one (metrics, reasons) pair per row;
+    `reasons` is empty for usable images.
+    """
+    metrics = measure(batch)
+    for row, image in enumerate(originals):
+        if image is not None:
+            metrics['sharpness'][row] = max(metrics['sharpness'][row], native_sharpness(image))
+    failures = {
+        'blurry': metrics['sharpness'] < getattr(settings, 'PREDICTION_QUALITY_MIN_SHARPNESS', 40.0),
+        'too_dark': metrics['brightness'] < getattr(settings, 'PREDICTION_QUALITY_MIN_BRIGHTNESS', 0.12),
+        'too_bright': metrics['brightness'] > getattr(settings, 'PREDICTION_QUALITY_MAX_BRIGHTNESS', 0.92),
+        'no_leaf': metrics['foliage_coverage'] < getattr(settings, 'PREDICTION_QUALITY_MIN_FOLIAGE_COVERAGE', 0.05),
+    }
+    screened = []
+    for row in range(batch.shape[0]):
+        values = {name: round(float(values[row]), 4) for name, values in metrics.items()}
+        screened.append((values, [reason for reason, failed in failures.items() if failed[row]]))
+    return screened
+
+
+def rejection(metrics: dict, reasons: list) -> dict:
+    """
+    The per-image result for an image that was not scored because of `reasons`.
+    """
+    return {
+        "error": "Image rejected: " + "; ".join(REASON_MESSAGES[reason] for reason in reasons) + ".",
+        "rejected": reasons,
+        "quality": metrics,
+    }
+
+
+class QualityStats:
+    """
+    How many images the prescreen saw, and how many it flagged per reason.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._screened = 0
+        self._flagged = 0
+        self._reasons = Counter()
+
+    def record(self, screened: list):
+        flagged = [reasons for _, reasons in screened if reasons]
+        with self._lock:
+            self._screened += len(screened)
+            self._flagged += len(flagged)
+            for reasons in flagged:
+                self._reasons.update(reasons)
+
+    def stats(self) -> dict:
+        with self._lock:
+            screened, flagged, reasons = self._screened, self._flagged, dict(self._reasons)
+        return {
+            'mode': quality_mode(),
+            'screened': screened,
+            'flagged': flagged,
+            'flagged_fraction': round(flagged / screened, 4) if screened else 0.0,
+            'reasons': reasons,
+        }
@@ -0,0 +1,135 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from ..models import Detection, DetectionDailyStat
+
+
+def rollup_key(detection) -> tuple:
+    """
+    The (day, class id, flagged) rollup row `detection` counts towards.
+    """
+    return timezone.localdate(detection.created_at), detection.disease_class_id, detection.flagged
+
+
+def stored_rollup_key(pk):
+    """
+    The rollup key of the stored row `pk`, or None if there is none.
+    """
+    row = Detection.objects.filter(pk=pk).values_list('created_at', 'disease_class', 'flagged').first()
+    if row is None:
+        return None
+    created_at, class_id, flagged = row
+    return timezone.localdate(created_at), class_id, flagged
+
+
+def _apply(deltas):
+    """
+    Adds each (day, class id, flagged) -> delta to the rollups. Keys are applied
+    in a fixed order so concurrent writers lock rows in the same order; rows a
+    decrement empties are removed.
+    """
+    for (day, class_id, flagged), delta in sorted(deltas.items(), key=lambda item: (item[0][0], item[0][1] or 0, item[0][2])):
+        if not delta:
+            continue
+        rows = DetectionDailyStat.objects.filter(day=day, disease_class_id=class_id, flagged=flagged)
+        if rows.update(count=F('count') + delta):
+            if delta < 0:
+                rows.filter(count__lte=0).delete()
+            continue
+        _, created = DetectionDailyStat.objects.get_or_create(
+            day=day, disease_class_id=class_id, flagged=flagged, defaults={'count': delta},
+        )
+        if not created:
+            # Another writer inserted the row first
+            rows.update(count=F('count') + delta)
+
+
+def record_created(detections):
+    """
+    Counts freshly inserted detections; call in the transaction that inserted them.
+    """
+    _apply(Counter(rollup_key(detection) for detection in detections if detection.pk))
+
+
+def record_deleted(detection):
+    _apply({rollup_key(detection): -1})
+
+
+def record_change(before, detection):
+    """
+    Moves a saved detection from rollup key `before` (None: not counted yet) to its current one.
+    """
+    after = rollup_key(detection)
+    if before is not None and before != after:
+        _apply({before: -1, after: 1})
+
+
+def rebuild() -> int:
+    """
+    Recomputes every rollup row from the Detection table; returns the row count.
+    """
+    groups = (
+        Detection.objects.order_by().annotate(day=TruncDate('created_at'))
+        .values_list('day', 'disease_class', 'flagged').annotate(rows=Count('id'))
+    )
+    with transaction.atomic():
+        DetectionDailyStat.objects.all().delete()
+        rollups = DetectionDailyStat.objects.bulk_create(
+            DetectionDailyStat(day=day, disease_class_id=class_id, flagged=flagged, count=rows)
+            for day, class_id, flagged, rows in groups.iterator()
+        )
+    return len(rollups)
+
+
+def _counts():
+    return {'total': Sum('count'), 'flagged': Sum('count', filter=Q(flagged=True))}
+
+
+def _in_range(start=None, end=None):
+    rollups = DetectionDailyStat.objects.all()
+    if start:
+        rollups = rollups.filter(day__gte=start)
+    if end:
+        rollups = rollups.filter(day__lte=end)
+    return rollups
+
+
+def totals() -> dict:
+    counts = DetectionDailyStat.objects.aggregate(**_counts())
+    return {'prediction_count': counts['total'] or 0, 'flagged_count': counts['flagged'] or 0}
+
+
+def daily(start=None, end=None) -> list:
+    """
+    Detections and flagged detections per day, oldest first.
+    """
+    rows = _in_range(start, end).values('day').annotate(**_counts()).order_by('day')
+    return [{'day': row['day'], 'total': row['total'], 'flagged': row['flagged'] or 0} for row in rows]
+
+
+def by_class(start=None, end=None, crop=None) -> list:
+    """
+    Detections and flagged detections per disease class, most frequent first.
+    """
+    rollups = _in_range(start, end)
+    if crop:
+        rollups = rollups.filter(disease_class__crop__iexact=crop)
+    rows = (
+        rollups.values('disease_class', 'disease_class__label', 'disease_class__crop', 'disease_class__disease', 'disease_class__healthy')
+        .annotate(**_counts()).order_by('-total', 'disease_class__label')
+    )
+    return [
+        {
+            'label': row['disease_class__label'],
+            'crop': row['disease_class__crop'],
+            'disease': row['disease_class__disease'],
+            'healthy': row['disease_class__healthy'],
+            'total': row['total'],
+            'flagged': row['flagged'] or 0,
+        }
+        for row in rows
+    ]
@@ -0,0 +1,88 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import JSONRenderer
+
+STREAM_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'sse': 'text/event-stream',
+}
+
+
+class NDJSONRenderer(JSONRenderer):
+    """
+    Lets content negotiation accept `Accept: application/x-ndjson`; streamed
+    bodies are encoded by `streaming_response`, anything else renders as JSON.
+    """
+    media_type = STREAM_FORMATS['ndjson']
+    format = 'ndjson'
+
+
+class EventStreamRenderer(JSONRenderer):
+    """
+    Same as NDJSONRenderer, for `Accept: text/event-stream`.
+    """
+    media_type = STREAM_FORMATS['sse']
+    format = 'sse'
+
+
+STREAM_RENDERERS = [NDJSONRenderer, EventStreamRenderer]
+
+
+def requested_stream_format(request):
+    """
+    'ndjson' or 'sse' when the client asked for a streamed response via `?stream=`
+    or its Accept header, otherwise None.
+    """
+    requested = request.query_params.get('stream')
+    if requested in STREAM_FORMATS:
+        return requested
+    accepted = getattr(request.accepted_renderer, 'format', None)
+    return accepted if accepted in STREAM_FORMATS else None
+
+
+def _encode(record: dict, stream_format: str) -> bytes:
+    data = json.dumps(record)
+    if stream_format == 'sse':
+        event = 'done' if record.get('done') else 'result'
+        return f'event: {event}\ndata: {data}\n\n'.encode()
+    return f'{data}\n'.encode()
+
+
+async def _iterate_async(records):
+    """
+    Advances a synchronous generator one record at a time on the thread that runs
+    sync views, so its ORM calls behave as they would under WSGI.
+    """
+    sentinel = object()
+    advance = sync_to_async(next, thread_sensitive=True)
+    while True:
+        record = await advance(records, sentinel)
+        if record is sentinel:
+            return
+        yield record
+
+
+def server_iterator(request, chunks):
+    """
+    `chunks` in the form the server can stream. Under ASGI the generator is
+    wrapped in an async iterator: Django would otherwise drain a sync iterator
+    completely before sending anything.
+    """
+    if isinstance(getattr(request, '_request', request), ASGIRequest):
+        return _iterate_async(chunks)
+    return chunks
+
+
+def streaming_response(request, records, stream_format: str) -> StreamingHttpResponse:
+    """
+    Streams the dicts produced by `records` as NDJSON lines or Server-Sent Events.
+    """
+    encoded = (_encode(record, stream_format) for record in records)
+    response = StreamingHttpResponse(server_iterator(request, encoded), content_type=STREAM_FORMATS[stream_format])
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,82 @@
+import math
+
+from django.conf import settings
+from PIL import Image
+
+ALLOWED_FORMATS = {'JPEG', 'MPO', 'PNG', 'WEBP', 'BMP', 'GIF', 'TIFF'}
+
+# The model input (onnx_predictor.INPUT_SIZE); uploads decoded for inference only need to cover it
+INFERENCE_SIZE = (224, 224)
+
+
+class DecodedUpload:
+    """
+    One uploaded image, opened once and decoded at most once.
+    - opening only parses the header, which is enough for upload validation
+    - `rgb()` decodes once, just large enough to cover the model input, and
+      every later consumer in the request (quality checks, inference) shrinks
+      from those pixels; the stored derivatives decode the staged original
+      again with `max_edge` set to the archival edge
+    - attached to the upload as `upload.decoded_upload`, so every stage of the
+      request finds the same instance
+    """
+
+    def __init__(self, upload, max_edge: int = None):
+        self.upload = upload
+        self.max_edge = max_edge
+        upload.seek(0)
+        self.image = Image.open(upload)
+        self.format = self.image.format
+        self.size = self.image.size
+        self.decodes = 0
+        self._rgb = None
+
+    @classmethod
+    def of(cls, upload) -> 'DecodedUpload':
+        decoded = getattr(upload, 'decoded_upload', None)
+        if decoded is None:
+            decoded = cls(upload)
+            upload.decoded_upload = decoded
+        return decoded
+
+    def check(self):
+        """
+        Header-only validation: a known image format within the pixel limit.
+        """
+        if self.format not in ALLOWED_FORMATS:
+            raise ValueError(f"Unsupported image format {self.format}")
+        width, height = self.size
+        max_pixels = getattr(settings, 'PREDICTION_MAX_IMAGE_PIXELS', 50_000_000)
+        if width * height > max_pixels:
+            raise ValueError(f"Image is {width}x{height}, larger than the {max_pixels} pixel limit")
+
+    def decode_size(self) -> tuple:
+        """
+        The smallest size the decode must cover: the model input, or with
+        `max_edge` the full image capped at that edge.
+        """
+        if self.max_edge is None:
+            return INFERENCE_SIZE
+        width, height = self.size
+        scale = min(1.0, self.max_edge / max(width, height))
+        return math.ceil(width * scale), math.ceil(height * scale)
+
+    def rgb(self) -> Image.Image:
+        """
+        The image as RGB, decoded on first use at the smallest JPEG DCT scale
+        that still covers `decode_size()`. Formats without DCT scaling decode
+        at full size and are then reduced by a whole factor, so no more than
+        twice the needed size stays in memory. Callers must not modify it.
+        """
+        if self._rgb is None:
+            self.check()
+            target = self.decode_size()
+            self.image.draft('RGB', target)
+            image = self.image.convert('RGB')
+            # Free the decoded source, keeping the upload itself open; only the
+            # header fields above are needed from here on
+            self.image = None
+            factor = min(image.width // target[0], image.height // target[1])
+            self._rgb = image.reduce(factor) if factor >= 2 else image
+            self.decodes += 1
+        return self._rgb
@@ -1,65 +1,311 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework import status, permissions, generics, mixins, viewsets
+from rest_framework import status, permissions, generics
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
-from django.utils.dateparse import parse_datetime
-from django.db.models import Q
-import csv
-from django.http import HttpResponse
+from django.utils.dateparse import parse_date
+from django.utils import timezone
+from datetime import datetime, timedelta
+from django.http import JsonResponse
+from django.conf import settings
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from asgiref.sync import sync_to_async
+from rest_framework.exceptions import AuthenticationFailed, ValidationError
+from rest_framework_simplejwt.authentication import JWTAuthentication
 
-from .serializers import MultiImageUploadSerializer, PredictionResponseSerializer, DetectionSerializer
-from .models import Detection
-from .utils.onnx_predictor import predict, is_preprocessed
-from PIL import Image
-import numpy as np
+from .serializers import MultiImageUploadSerializer, PredictionJobUploadSerializer, PredictionResponseSerializer, DetectionSerializer, PredictionJobSerializer
+from .models import Detection, DiseaseClass, PredictionJob
+from .pagination import DetectionHistoryPagination
+from .utils.derivatives import discard_staged, schedule_derivatives, stage_original
+from .utils.streaming import STREAM_FORMATS, STREAM_RENDERERS, requested_stream_format, streaming_response
+from .utils.prediction_jobs import submit_job
+from .utils.exports import EXPORT_COLUMNS, EXPORT_FORMATS, export_response, export_rows
+from .utils import rollups
+from .utils.onnx_predictor import predict_batch, batch_scheduler, model_status, start_background_load, poll_model_version, prediction_cache, cascade_stats, preprocess_stats, admission, flow_for_user, quality_stats
+from .utils.batching import inference_flow
+from .utils.admission import AdmissionRejected
+
+def _build_detections(user, uploads, predictions):
+    """
+    Pairs (upload, preprocessed_on) items with their predictions.
+    Returns the per-image results, the unsaved Detection rows, and the
+    (detection, upload) pairs whose derivatives should be stored once saved.
+    """
+    results = []
+    detections = []
+    originals = []
+    for (img, preprocessed_on), pred in zip(uploads, predictions):
+        if "rejected" in pred:
+            # Failed the quality prescreen; tell the user what to fix when retaking the photo
+            results.append({"filename": img.name, "error": pred["error"], "rejected": pred["rejected"], "quality": pred["quality"]})
+            continue
+        if "error" in pred:
+            results.append({"filename": img.name, "error": f"Prediction failed: {pred['error']}"})
+            continue
+
+        detection = Detection(
+            user=user,
+            # Backend uploads are staged before the commit and replaced by the
+            # archival copy once derivatives are stored; tensor uploads carry
+            # no displayable image
+            image='',
+            result=pred["label"],
+            confidence_score=pred["confidence"],
+            model_version=pred["model_version"],
+            inference_stage=pred["stage"]
+        )
+        detections.append(detection)
+        if preprocessed_on == 'backend':
+            originals.append((detection, img))
+        results.append({
+            "filename": img.name,
+            "predicted_class": pred["label"],
+            "confidence_score": pred["confidence"],
+            "model_version": pred["model_version"],
+            "stage": pred["stage"],
+            "preprocessed_on": preprocessed_on,
+        })
+        if "quality_warnings" in pred:
+            results[-1]["quality_warnings"] = pred["quality_warnings"]
+    return results, detections, originals
+
+def _shed_response(rejected, response_class=Response):
+    response = response_class(rejected.response_data(), status=rejected.status_code)
+    if rejected.retry_after is not None:
+        response['Retry-After'] = str(rejected.retry_after)
+    return response
+
+def _stage_and_insert(detections, originals):
+    """
+    Saves the originals to storage, then commits the rows pointing at them, so
+    a committed Detection never depends on bytes held only in memory.
+    """
+    for detection, img in originals:
+        detection.image = stage_original(img)
+    try:
+        Detection.objects.bulk_create(detections)
+    except BaseException:
+        discard_staged([detection.image.name for detection, _ in originals])
+        raise
+
+def _save_detections(detections, originals):
+    _stage_and_insert(detections, originals)
+    schedule_derivatives([(detection.pk, detection.image.name) for detection, _ in originals])
 
 class PredictAPIView(APIView):
     permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = APIView.renderer_classes + STREAM_RENDERERS
 
     @swagger_auto_schema(
         operation_summary="Predict plant disease from images",
-        operation_description="Upload one or more images for plant disease prediction. Accepts `multipart/form-data` with an 'images' field.",
+        operation_description=(
+            "Upload one or more images for plant disease prediction. Accepts `multipart/form-data` with an 'images' field and/or a 'tensors' field of images preprocessed on the device. "
+            "All uploads are scored in a single batch; an upload that cannot be processed gets its own `error` entry.\n\n"
+            "With `?stream=ndjson` (or `Accept: application/x-ndjson`) or `?stream=sse` (or `Accept: text/event-stream`), uploads are scored in chunks of PREDICTION_STREAM_CHUNK_SIZE "
+            "and each image's result is sent as soon as its chunk is done, followed by a final summary record. Streamed responses are always 200.\n\n"
+            "Requests over PREDICTION_MAX_IMAGES_PER_REQUEST uploads get 413 (400 when a single list is over it). When the user already has too many predictions in progress (429) or the worker is over its latency budget (503), the request is rejected immediately with a `Retry-After` header."
+        ),
         request_body=MultiImageUploadSerializer,
+        manual_parameters=[
+            openapi.Parameter('stream', openapi.IN_QUERY, description="Stream per-image results: 'ndjson' or 'sse'", type=openapi.TYPE_STRING, enum=list(STREAM_FORMATS)),
+        ],
         responses={200: PredictionResponseSerializer(many=True)},
     )
     def post(self, request):
         serializer = MultiImageUploadSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        images = serializer.validated_data['images']
+        images = serializer.validated_data.get('images', [])
+        tensors = serializer.validated_data.get('tensors', [])
+        uploads = [(img, 'backend') for img in images] + [(tensor, 'mobile') for tensor in tensors]
 
-        results = []
+        try:
+            ticket = admission.admit(request.user.pk, len(uploads))
+        except AdmissionRejected as rejected:
+            return _shed_response(rejected)
 
-        for img in images:
-            try:
-                img.seek(0)
-                pred = predict(img)
-            except Exception as e:
-                return Response({"error": f"Prediction failed: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
-
-            if "error" in pred:
-                return Response({"error": pred["error"]}, status=status.HTTP_400_BAD_REQUEST)
-
-            detection = Detection.objects.create(
-                user=request.user,
-                image=img,
-                result=pred["label"],
-                confidence_score=pred["confidence"]
-            )
+        stream_format = requested_stream_format(request)
+        if stream_format:
+            # The ticket is held until the stream is exhausted or closed, but only
+            # the time spent producing it is charged to the cost estimate
+            return streaming_response(request, self._stream(request.user, uploads, ticket), stream_format)
 
-            results.append({
-                "filename": img.name,
-                "predicted_class": pred["label"],
-                "confidence_score": pred["confidence"],
-            })
+        with ticket:
+            poll_model_version()
+            with inference_flow(*flow_for_user(request.user)):
+                predictions = predict_batch(images, tensors)
+            results, detections, originals = _build_detections(request.user, uploads, predictions)
 
-            img.seek(0)
+            if not detections:
+                error = results[0]["error"] if len(results) == 1 else "Prediction failed for every image."
+                return Response({"error": error, "results": results}, status=status.HTTP_400_BAD_REQUEST)
 
+            _save_detections(detections, originals)
         return Response(results, status=status.HTTP_200_OK)
 
+    def _stream(self, user, uploads, ticket):
+        """
+        Scores and stores `uploads` chunk by chunk, yielding each result as its chunk finishes.
+        """
+        chunk_size = getattr(settings, 'PREDICTION_STREAM_CHUNK_SIZE', 8)
+        stored = failed = 0
+        with ticket:
+            with ticket.working():
+                poll_model_version()
+                flow = flow_for_user(user)
+            for start in range(0, len(uploads), chunk_size):
+                chunk = uploads[start:start + chunk_size]
+                # Only producing a chunk counts towards the cost estimate, not the client reading it
+                with ticket.working():
+                    # Entered per chunk: under ASGI each step of the stream runs in a fresh context
+                    with inference_flow(*flow):
+                        predictions = predict_batch(
+                            [img for img, source in chunk if source == 'backend'],
+                            [img for img, source in chunk if source == 'mobile'],
+                        )
+                    results, detections, originals = _build_detections(user, chunk, predictions)
+                    if detections:
+                        _save_detections(detections, originals)
+                stored += len(detections)
+                failed += len(results) - len(detections)
+                yield from results
+        yield {"done": True, "stored": stored, "failed": failed}
+
+class AsyncPredictView(View):
+    """
+    Native async variant of PredictAPIView for the ASGI deployment.
+    The event loop only awaits: JWT lookup and multipart parsing run in threads,
+    decoding and inference run on an executor, and Detections are written in
+    a thread by the same bulk insert as PredictAPIView (the async ORM cannot
+    wrap the insert and its rollup update in one transaction), so a
+    process can keep many slow uploads in flight.
+    Same request and response format as the non-streaming PredictAPIView.
+    """
+    authenticator = JWTAuthentication()
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # Authenticated by bearer token like the DRF views, so no CSRF cookie is involved
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    @staticmethod
+    def _validate(request):
+        files = request.FILES
+        serializer = MultiImageUploadSerializer(data={
+            'images': files.getlist('images'),
+            'tensors': files.getlist('tensors'),
+        })
+        return serializer, serializer.is_valid()
+
+    async def post(self, request):
+        try:
+            authenticated = await sync_to_async(self.authenticator.authenticate)(request)
+        except AuthenticationFailed as e:
+            detail = e.detail if isinstance(e.detail, dict) else {'detail': e.detail}
+            return JsonResponse(detail, status=status.HTTP_401_UNAUTHORIZED)
+        if authenticated is None:
+            return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=status.HTTP_401_UNAUTHORIZED)
+        user, _ = authenticated
+
+        serializer, valid = await sync_to_async(self._validate, thread_sensitive=False)(request)
+        if not valid:
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        images = serializer.validated_data.get('images', [])
+        tensors = serializer.validated_data.get('tensors', [])
+        uploads = [(img, 'backend') for img in images] + [(tensor, 'mobile') for tensor in tensors]
+
+        try:
+            ticket = admission.admit(user.pk, len(uploads))
+        except AdmissionRejected as rejected:
+            return _shed_response(rejected, JsonResponse)
+
+        with ticket:
+            await sync_to_async(poll_model_version)()
+            flow = await sync_to_async(flow_for_user)(user)
+            with inference_flow(*flow):
+                # sync_to_async runs predict_batch in a copy of this context, flow included
+                predictions = await sync_to_async(predict_batch, thread_sensitive=False)(images, tensors)
+            results, detections, originals = _build_detections(user, uploads, predictions)
+
+            if not detections:
+                error = results[0]["error"] if len(results) == 1 else "Prediction failed for every image."
+                return JsonResponse({"error": error, "results": results}, status=status.HTTP_400_BAD_REQUEST)
+
+            await sync_to_async(_stage_and_insert)(detections, originals)
+            await sync_to_async(schedule_derivatives, thread_sensitive=False)(
+                [(detection.pk, detection.image.name) for detection, _ in originals]
+            )
+        return JsonResponse(results, safe=False, status=status.HTTP_200_OK)
+
+class PredictionJobCreateAPIView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    @swagger_auto_schema(
+        operation_summary="Submit a background prediction job",
+        operation_description="Queue one or more uploads for prediction and return immediately with a job ID. Jobs are scored by `manage.py run_prediction_worker`; poll the job for progress and fetch its results once it is done.",
+        request_body=PredictionJobUploadSerializer,
+        responses={202: PredictionJobSerializer},
+    )
+    def post(self, request):
+        serializer = PredictionJobUploadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        job = submit_job(
+            request.user,
+            serializer.validated_data.get('images', []),
+            serializer.validated_data.get('tensors', []),
+        )
+        return Response(PredictionJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+class PredictionJobDetailAPIView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    @swagger_auto_schema(
+        operation_summary="Get prediction job status",
+        operation_description="Status and per-image progress of one of the user's prediction jobs.",
+        responses={200: PredictionJobSerializer},
+    )
+    def get(self, request, pk):
+        try:
+            job = PredictionJob.objects.get(pk=pk, user=request.user)
+        except PredictionJob.DoesNotExist:
+            return Response({'error': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(PredictionJobSerializer(job).data)
+
+class PredictionJobResultsAPIView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    @swagger_auto_schema(
+        operation_summary="Get prediction job results",
+        operation_description="Per-image results of a prediction job, in upload order. Images that are not scored yet have no prediction fields.",
+        responses={200: PredictionResponseSerializer(many=True)},
+    )
+    def get(self, request, pk):
+        try:
+            job = PredictionJob.objects.get(pk=pk, user=request.user)
+        except PredictionJob.DoesNotExist:
+            return Response({'error': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+        results = []
+        for item in job.items.order_by('position'):
+            if item.status == item.FAILED:
+                results.append({"filename": item.filename, "error": item.error})
+            elif item.status == item.DONE:
+                results.append({
+                    "filename": item.filename,
+                    "predicted_class": item.result,
+                    "confidence_score": item.confidence_score,
+                    "model_version": item.model_version,
+                    "stage": item.inference_stage,
+                    "preprocessed_on": item.preprocessed_on,
+                })
+            else:
+                results.append({"filename": item.filename})
+        return Response({'job': PredictionJobSerializer(job).data, 'results': results})
+
 class DetectionHistoryView(generics.ListAPIView):
     serializer_class = DetectionSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = DetectionHistoryPagination
 
     @swagger_auto_schema(
         operation_summary="Get prediction history",
@@ -69,7 +315,7 @@ class DetectionHistoryView(generics.ListAPIView):
         return super().get(request, *args, **kwargs)
 
     def get_queryset(self):
-        return Detection.objects.filter(user=self.request.user).order_by('-created_at')
+        return Detection.objects.filter(user=self.request.user).select_related('disease_class').order_by('-created_at', '-id')
 
 class DetectionDeleteAPIView(APIView):
     permission_classes = [permissions.IsAuthenticated]
@@ -94,7 +340,7 @@ class DetectionBulkDeleteAPIView(APIView):
         operation_description="Delete all prediction history items for the authenticated user.",
     )
     def delete(self, request):
-        deleted_count, _ = Detection.objects.filter(user=request.user).delete()
+        Detection.objects.filter(user=request.user).delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 class FlagDetectionAPIView(APIView):
@@ -114,9 +360,7 @@ class FlagDetectionAPIView(APIView):
             detection = Detection.objects.get(pk=pk, user=request.user)
         except Detection.DoesNotExist:
             return Response({'error': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
-        detection.flagged = True
-        detection.flag_reason = reason
-        detection.save()
+        detection.flag(reason)
         return Response({'success': 'Flagged.'}, status=status.HTTP_200_OK)
 
 class AdminFlaggedDetectionsView(generics.ListAPIView):
@@ -131,7 +375,7 @@ class AdminFlaggedDetectionsView(generics.ListAPIView):
         return super().get(request, *args, **kwargs)
 
     def get_queryset(self):
-        return Detection.objects.filter(flagged=True).order_by('-created_at')
+        return Detection.objects.filter(flagged=True).select_related('disease_class').order_by('-created_at')
 
 class AdminStatsAPIView(APIView):
     permission_classes = [permissions.IsAdminUser]
@@ -151,23 +395,120 @@ class AdminStatsAPIView(APIView):
     def get(self, request):
         from django.contrib.auth.models import User
         user_count = User.objects.count()
-        prediction_count = Detection.objects.count()
-        flagged_count = Detection.objects.filter(flagged=True).count()
+        # Summed from the daily rollups rather than counted from Detection
+        return Response({'user_count': user_count, **rollups.totals()})
+
+_STATS_RANGE_PARAMETERS = [
+    openapi.Parameter('start_date', openapi.IN_QUERY, description="First day (YYYY-MM-DD)", type=openapi.TYPE_STRING, format=openapi.FORMAT_DATE),
+    openapi.Parameter('end_date', openapi.IN_QUERY, description="Last day, inclusive (YYYY-MM-DD)", type=openapi.TYPE_STRING, format=openapi.FORMAT_DATE),
+]
+
+class AdminDailyStatsAPIView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    @swagger_auto_schema(
+        operation_summary="[Admin] Predictions per day",
+        operation_description="Number of predictions and flagged predictions per day, read from the daily rollups.",
+        manual_parameters=_STATS_RANGE_PARAMETERS,
+    )
+    def get(self, request):
+        start, end = _query_date_range(request)
+        return Response({'days': rollups.daily(start, end)})
+
+class AdminClassStatsAPIView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    @swagger_auto_schema(
+        operation_summary="[Admin] Predictions per disease class",
+        operation_description="Number of predictions and flagged predictions per disease class, most frequent first, read from the daily rollups.",
+        manual_parameters=_STATS_RANGE_PARAMETERS + [
+            openapi.Parameter('crop', openapi.IN_QUERY, description="Only classes of this crop (e.g., Cassava)", type=openapi.TYPE_STRING),
+        ],
+    )
+    def get(self, request):
+        start, end = _query_date_range(request)
+        return Response({'classes': rollups.by_class(start, end, crop=request.query_params.get('crop'))})
+
+class ModelReadinessView(APIView):
+    permission_classes = [permissions.AllowAny]
+    authentication_classes = []
+
+    @swagger_auto_schema(
+        operation_summary="Model readiness probe",
+        operation_description="Returns 200 once the ONNX model is loaded and warmed, 503 otherwise. Starts loading the model in the background if nothing has yet.",
+    )
+    def get(self, request):
+        model = model_status()
+        if not model['ready']:
+            if model['backend'] == 'local':
+                start_background_load()
+            return Response({'status': 'not_ready', 'model': model}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response({'status': 'ready', 'model': model}, status=status.HTTP_200_OK)
+
+class AdminInferenceStatsAPIView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    @swagger_auto_schema(
+        operation_summary="[Admin] Get inference statistics",
+        operation_description="Retrieve the batch sizes and queue-wait times produced by the inference batching scheduler, upload decode times, admission control (in-flight work and shed requests by reason), images flagged by the quality prescreen, the prediction cache hit/miss counters and the fraction of images resolved at each cascade stage, for this worker.",
+    )
+    def get(self, request):
         return Response({
-            'user_count': user_count,
-            'prediction_count': prediction_count,
-            'flagged_count': flagged_count
+            'model': model_status(),
+            'backend': getattr(settings, 'PREDICTION_BACKEND', 'local'),
+            'batching_enabled': getattr(settings, 'PREDICTION_BATCHING_ENABLED', True),
+            'scheduler': batch_scheduler.stats(),
+            'preprocessing': preprocess_stats.stats(),
+            'prediction_cache': prediction_cache.stats(),
+            'admission': admission.stats(),
+            'quality_prescreen': quality_stats.stats(),
+            'cascade': {
+                'enabled': getattr(settings, 'PREDICTION_CASCADE_ENABLED', False),
+                'threshold': getattr(settings, 'PREDICTION_CASCADE_THRESHOLD', 0.9),
+                **cascade_stats.stats(),
+            },
         })
 
+def _query_float(name, value):
+    try:
+        return float(value)
+    except ValueError:
+        raise ValidationError({name: "A number is required."})
+
+def _query_date(name, value):
+    try:
+        day = parse_date(value)
+    except ValueError:
+        day = None
+    if day is None:
+        raise ValidationError({name: "A date in YYYY-MM-DD format is required."})
+    return day
+
+def _query_date_range(request):
+    start, end = request.query_params.get('start_date'), request.query_params.get('end_date')
+    return (
+        _query_date('start_date', start) if start else None,
+        _query_date('end_date', end) if end else None,
+    )
+
+def _day_start(name, value):
+    """
+    Midnight of the YYYY-MM-DD date `value` in the current time zone.
+    """
+    return timezone.make_aware(datetime.combine(_query_date(name, value), datetime.min.time()))
+
 class FilteredDetectionHistoryView(generics.ListAPIView):
     serializer_class = DetectionSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = DetectionHistoryPagination
 
     @swagger_auto_schema(
         operation_summary="Filter prediction history",
         operation_description="Get a filtered list of predictions based on query parameters.",
         manual_parameters=[
             openapi.Parameter('result', openapi.IN_QUERY, description="Filter by disease name (partial match, case-insensitive)", type=openapi.TYPE_STRING),
+            openapi.Parameter('crop', openapi.IN_QUERY, description="Filter by crop (e.g., Cassava)", type=openapi.TYPE_STRING),
+            openapi.Parameter('healthy', openapi.IN_QUERY, description="true for healthy results only, false for diseased ones", type=openapi.TYPE_BOOLEAN),
             openapi.Parameter('min_conf', openapi.IN_QUERY, description="Minimum confidence score (e.g., 0.8)", type=openapi.TYPE_NUMBER),
             openapi.Parameter('max_conf', openapi.IN_QUERY, description="Maximum confidence score (e.g., 0.95)", type=openapi.TYPE_NUMBER),
             openapi.Parameter('start_date', openapi.IN_QUERY, description="Start date (YYYY-MM-DD)", type=openapi.TYPE_STRING, format=openapi.FORMAT_DATE),
@@ -178,39 +519,68 @@ class FilteredDetectionHistoryView(generics.ListAPIView):
         return super().get(request, *args, **kwargs)
 
     def get_queryset(self):
-        qs = Detection.objects.filter(user=self.request.user).order_by('-created_at')
+        qs = Detection.objects.filter(user=self.request.user).select_related('disease_class').order_by('-created_at', '-id')
         result = self.request.query_params.get('result')
+        crop = self.request.query_params.get('crop')
+        healthy = self.request.query_params.get('healthy')
         min_conf = self.request.query_params.get('min_conf')
         max_conf = self.request.query_params.get('max_conf')
         start_date = self.request.query_params.get('start_date')
         end_date = self.request.query_params.get('end_date')
 
-        if result:
-            qs = qs.filter(result__icontains=result)
+        # Every filter compares an indexed column directly, so none of them
+        # degrades to a scan of the user's history
+        # Text filters are resolved against the small DiseaseClass table, then
+        # looked up by class id on the (user, disease_class) index
+        if result or crop or healthy:
+            classes = DiseaseClass.objects.all()
+            if result:
+                classes = classes.filter(label__icontains=result)
+            if crop:
+                classes = classes.filter(crop__iexact=crop)
+            if healthy:
+                if healthy.lower() not in ('true', 'false'):
+                    raise ValidationError({'healthy': "Must be 'true' or 'false'."})
+                classes = classes.filter(healthy=healthy.lower() == 'true')
+            qs = qs.filter(disease_class__in=list(classes.values_list('pk', flat=True)))
         if min_conf:
-            qs = qs.filter(confidence_score__gte=float(min_conf))
+            qs = qs.filter(confidence_score__gte=_query_float('min_conf', min_conf))
         if max_conf:
-            qs = qs.filter(confidence_score__lte=float(max_conf))
+            qs = qs.filter(confidence_score__lte=_query_float('max_conf', max_conf))
+        # Dates become half-open [start 00:00, end + 1 day 00:00) timestamp ranges
         if start_date:
-            qs = qs.filter(created_at__date__gte=start_date)
+            qs = qs.filter(created_at__gte=_day_start('start_date', start_date))
         if end_date:
-            qs = qs.filter(created_at__date__lte=end_date)
+            qs = qs.filter(created_at__lt=_day_start('end_date', end_date) + timedelta(days=1))
         return qs
 
+_EXPORT_PARAMETERS = [
+    openapi.Parameter('file_format', openapi.IN_QUERY, description="csv (default) or ndjson", type=openapi.TYPE_STRING, enum=list(EXPORT_FORMATS)),
+    openapi.Parameter('compress', openapi.IN_QUERY, description="gzip to download a .gz file", type=openapi.TYPE_STRING, enum=['gzip']),
+]
+
 class ExportDetectionHistoryAPIView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     @swagger_auto_schema(
         operation_summary="Export prediction history",
-        operation_description="Download the user's complete prediction history as a CSV file.",
-        responses={200: "CSV file of prediction history."}
+        operation_description="Download the user's complete prediction history as a CSV or NDJSON file, optionally gzipped. The file is streamed as it is read.",
+        manual_parameters=_EXPORT_PARAMETERS,
+        responses={200: "CSV or NDJSON file of prediction history."}
+    )
+    def get(self, request):
+        detections = export_rows(Detection.objects.filter(user=request.user).order_by('-created_at', '-id'))
+        return export_response(request, detections, EXPORT_COLUMNS, 'prediction_history')
+
+class AdminExportDetectionsAPIView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    @swagger_auto_schema(
+        operation_summary="[Admin] Export all predictions",
+        operation_description="Download every user's predictions as a CSV or NDJSON file, optionally gzipped. The file is streamed as it is read.",
+        manual_parameters=_EXPORT_PARAMETERS,
+        responses={200: "CSV or NDJSON file of all predictions."}
     )
     def get(self, request):
-        detections = Detection.objects.filter(user=request.user).order_by('-created_at')
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename="prediction_history.csv"'
-        writer = csv.writer(response)
-        writer.writerow(['id', 'result', 'confidence_score', 'created_at', 'latitude', 'longitude', 'flagged', 'flag_reason'])
-        for d in detections:
-            writer.writerow([d.id, d.result, d.confidence_score, d.created_at, d.latitude, d.longitude, d.flagged, d.flag_reason])
-        return response
+        # Primary key order is a plain walk of the table
+        return export_response(request, export_rows(Detection.objects.order_by('id')), ('user_id',) + EXPORT_COLUMNS, 'all_predictions')
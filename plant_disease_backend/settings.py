@@ -108,6 +108,14 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -154,6 +162,134 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Uploads are not kept as sent: Detection.image points at the staged original
+# until a background thread replaces it with a re-encoded copy capped at
+# DETECTION_ARCHIVE_MAX_EDGE and writes Detection.thumbnail, a small copy for
+# lists (WEBP falls back to JPEG when Pillow lacks WebP support)
+DETECTION_ARCHIVE_FORMAT = env('DETECTION_ARCHIVE_FORMAT', default='WEBP')  # WEBP | JPEG
+DETECTION_ARCHIVE_MAX_EDGE = env.int('DETECTION_ARCHIVE_MAX_EDGE', default=1600)
+DETECTION_ARCHIVE_QUALITY = env.int('DETECTION_ARCHIVE_QUALITY', default=80)
+DETECTION_THUMBNAIL_EDGE = env.int('DETECTION_THUMBNAIL_EDGE', default=256)
+DETECTION_THUMBNAIL_QUALITY = env.int('DETECTION_THUMBNAIL_QUALITY', default=70)
+DETECTION_DERIVATIVES_ASYNC = env.bool('DETECTION_DERIVATIVES_ASYNC', default=True)
+DETECTION_DERIVATIVE_THREADS = env.int('DETECTION_DERIVATIVE_THREADS', default=1)
+# Detections waiting for the background thread at most; past this they are
+# written before the response (0 = unbounded). `manage.py repair_detection_images`
+# finishes rows left on their staged original when a process dies with work queued
+DETECTION_DERIVATIVE_QUEUE_SIZE = env.int('DETECTION_DERIVATIVE_QUEUE_SIZE', default=64)
+
+
+# ------- Inference
+# The model is loaded lazily on first use; serving processes can set
+# PREDICTION_PRELOAD_MODEL to load and warm it in DetectionConfig.ready()
+PREDICTION_MODEL_PATH = env('PREDICTION_MODEL_PATH', default=os.path.join(BASE_DIR, 'detection', 'ai_models', 'ensemble_model_v1.0.1.onnx'))
+# 'int8' serves the quantized <model>.int8.onnx produced by `manage.py quantize_model`
+PREDICTION_MODEL_PRECISION = env('PREDICTION_MODEL_PRECISION', default='fp32')
+PREDICTION_PRELOAD_MODEL = env.bool('PREDICTION_PRELOAD_MODEL', default=False)
+PREDICTION_WARMUP_RUNS = env.int('PREDICTION_WARMUP_RUNS', default=1)
+PREDICTION_WARMUP_BATCH_SIZE = env.int('PREDICTION_WARMUP_BATCH_SIZE', default=1)
+# How often each worker checks for a newly activated ModelVersion to hot-swap to
+PREDICTION_MODEL_POLL_SECONDS = env.int('PREDICTION_MODEL_POLL_SECONDS', default=30)
+# A version that fails to load is retried after this long, doubling per failure up to an hour
+PREDICTION_MODEL_RETRY_SECONDS = env.int('PREDICTION_MODEL_RETRY_SECONDS', default=60)
+
+# Confidence-gated cascade: a small classifier answers first and only images whose
+# top-1 confidence is below the threshold go on to the ensemble
+PREDICTION_CASCADE_ENABLED = env.bool('PREDICTION_CASCADE_ENABLED', default=False)
+PREDICTION_CASCADE_FAST_MODEL_PATH = env('PREDICTION_CASCADE_FAST_MODEL_PATH', default=None)
+PREDICTION_CASCADE_THRESHOLD = env.float('PREDICTION_CASCADE_THRESHOLD', default=0.9)
+
+# 'local' runs the model inside every web worker; 'pool' sends preprocessed
+# tensors over a Unix socket to `manage.py run_inference_pool`, which owns the
+# model, so web workers can scale without each holding a copy
+PREDICTION_BACKEND = env('PREDICTION_BACKEND', default='local')
+PREDICTION_POOL_SOCKET = env('PREDICTION_POOL_SOCKET', default='/tmp/plant-disease-inference.sock')
+PREDICTION_POOL_WORKERS = env.int('PREDICTION_POOL_WORKERS', default=1)
+PREDICTION_POOL_TIMEOUT = env.float('PREDICTION_POOL_TIMEOUT', default=30.0)
+# Fall back to in-process inference when the pool cannot be reached. Off by
+# default: a pool outage would otherwise make every web worker load its own model
+PREDICTION_POOL_FALLBACK = env.bool('PREDICTION_POOL_FALLBACK', default=False)
+
+# Uploads whose header reports more pixels than this are rejected before decoding
+PREDICTION_MAX_IMAGE_PIXELS = env.int('PREDICTION_MAX_IMAGE_PIXELS', default=50_000_000)
+
+# Quality prescreen before inference. 'tag' scores every image and adds
+# quality_warnings (blurry, too_dark, too_bright, no_leaf); 'reject' skips
+# inference for blurry, too dark or overexposed photos and returns the reasons
+# so the photo can be retaken (no_leaf only ever warns); 'off' disables it.
+# Sharpness is the Laplacian variance of the 0-255 luma, taken as the higher of
+# the 224x224 buffer and a centre crop at decode resolution; brightness is the
+# mean luma in [0, 1]; foliage coverage the fraction of pixels with a red-to-green
+# hue at or above the minimum saturation, so brown and rusted leaves count
+PREDICTION_QUALITY_MODE = env('PREDICTION_QUALITY_MODE', default='tag')
+PREDICTION_QUALITY_MIN_SHARPNESS = env.float('PREDICTION_QUALITY_MIN_SHARPNESS', default=40.0)
+PREDICTION_QUALITY_MIN_BRIGHTNESS = env.float('PREDICTION_QUALITY_MIN_BRIGHTNESS', default=0.12)
+PREDICTION_QUALITY_MAX_BRIGHTNESS = env.float('PREDICTION_QUALITY_MAX_BRIGHTNESS', default=0.92)
+PREDICTION_QUALITY_MIN_FOLIAGE_COVERAGE = env.float('PREDICTION_QUALITY_MIN_FOLIAGE_COVERAGE', default=0.05)
+PREDICTION_QUALITY_FOLIAGE_MIN_SATURATION = env.float('PREDICTION_QUALITY_FOLIAGE_MIN_SATURATION', default=0.2)
+
+# Threads shared by all requests in a process for decoding and resizing uploads
+# (0 = min(4, CPU count))
+PREDICTION_PREPROCESS_THREADS = env.int('PREDICTION_PREPROCESS_THREADS', default=0)
+
+# Prediction cache keyed by upload content hash and model version. The shared
+# tier is an optional alias from CACHES (e.g. CACHE_URL=dbcache://prediction_cache
+# after `manage.py createcachetable`)
+PREDICTION_CACHE_ENABLED = env.bool('PREDICTION_CACHE_ENABLED', default=True)
+PREDICTION_CACHE_MAX_ENTRIES = env.int('PREDICTION_CACHE_MAX_ENTRIES', default=2048)
+PREDICTION_CACHE_TTL_SECONDS = env.int('PREDICTION_CACHE_TTL_SECONDS', default=86400)
+PREDICTION_CACHE_SHARED_ALIAS = env('PREDICTION_CACHE_SHARED_ALIAS', default=None)
+
+# ONNX Runtime session tuning. Thread counts of 0 use ORT's defaults (all cores),
+# which oversubscribes the CPU when several web workers each hold a session;
+# use `manage.py tune_onnx_threads` to pick values for a given worker count
+PREDICTION_ORT_INTRA_OP_THREADS = env.int('PREDICTION_ORT_INTRA_OP_THREADS', default=0)
+PREDICTION_ORT_INTER_OP_THREADS = env.int('PREDICTION_ORT_INTER_OP_THREADS', default=0)
+PREDICTION_ORT_EXECUTION_MODE = env('PREDICTION_ORT_EXECUTION_MODE', default='sequential')  # sequential | parallel
+PREDICTION_ORT_GRAPH_OPTIMIZATION = env('PREDICTION_ORT_GRAPH_OPTIMIZATION', default='all')  # disable | basic | extended | all
+PREDICTION_ORT_CPU_MEM_ARENA = env.bool('PREDICTION_ORT_CPU_MEM_ARENA', default=True)
+PREDICTION_ORT_MEM_PATTERN = env.bool('PREDICTION_ORT_MEM_PATTERN', default=True)
+# Directory where the optimized graph is cached between starts (unset disables the cache).
+# Optimized graphs can be hardware specific, so keep this on node-local disk
+PREDICTION_ORT_OPTIMIZED_MODEL_DIR = env('PREDICTION_ORT_OPTIMIZED_MODEL_DIR', default=None)
+
+# Admission control for the predict endpoints, per web worker process (0 disables a limit).
+# Requests over the image cap get 413, users over their concurrency limit 429, and
+# requests that would push the estimated latency past the budget or the in-flight
+# images past the limit 503; 429 and 503 carry Retry-After
+PREDICTION_MAX_IMAGES_PER_REQUEST = env.int('PREDICTION_MAX_IMAGES_PER_REQUEST', default=50)
+PREDICTION_MAX_CONCURRENT_REQUESTS_PER_USER = env.int('PREDICTION_MAX_CONCURRENT_REQUESTS_PER_USER', default=2)
+PREDICTION_MAX_IN_FLIGHT_IMAGES = env.int('PREDICTION_MAX_IN_FLIGHT_IMAGES', default=256)
+PREDICTION_LATENCY_BUDGET_MS = env.int('PREDICTION_LATENCY_BUDGET_MS', default=5000)
+
+# Streamed predictions (?stream=ndjson|sse) are scored and sent in chunks of this many uploads
+PREDICTION_STREAM_CHUNK_SIZE = env.int('PREDICTION_STREAM_CHUNK_SIZE', default=8)
+
+# Prediction history is paginated with a (created_at, id) cursor; the page size
+# is fixed so a cursor means the same thing to every client
+DETECTION_HISTORY_PAGE_SIZE = env.int('DETECTION_HISTORY_PAGE_SIZE', default=20)
+
+# History exports are streamed; rows are fetched from the database this many at a time
+DETECTION_EXPORT_FETCH_SIZE = env.int('DETECTION_EXPORT_FETCH_SIZE', default=2000)
+
+# Background prediction jobs (POST /api/predict/jobs/) are scored by
+# `manage.py run_prediction_worker`, which uses the database as its queue. A job
+# whose worker stops heartbeating for PREDICTION_JOB_LEASE_SECONDS is requeued
+PREDICTION_JOB_CHUNK_SIZE = env.int('PREDICTION_JOB_CHUNK_SIZE', default=32)
+PREDICTION_JOB_LEASE_SECONDS = env.int('PREDICTION_JOB_LEASE_SECONDS', default=300)
+PREDICTION_JOB_POLL_SECONDS = env.float('PREDICTION_JOB_POLL_SECONDS', default=2.0)
+
+# Concurrent predictions are packed into one batched ONNX run
+PREDICTION_BATCHING_ENABLED = env.bool('PREDICTION_BATCHING_ENABLED', default=True)
+PREDICTION_BATCH_MAX_SIZE = env.int('PREDICTION_BATCH_MAX_SIZE', default=16)
+PREDICTION_BATCH_MAX_WAIT_MS = env.float('PREDICTION_BATCH_MAX_WAIT_MS', default=5.0)
+# Batched rows are shared fairly between users: requests are cut into slices of
+# PREDICTION_FAIR_QUANTUM rows (default: a quarter of the batch) and users get
+# throughput in proportion to their profile tier's weight. Background jobs run at
+# the 'bulk' weight
+PREDICTION_FAIR_QUANTUM = env.int('PREDICTION_FAIR_QUANTUM', default=None)
+PREDICTION_TIER_WEIGHTS = env.dict('PREDICTION_TIER_WEIGHTS', cast={'value': float}, default={'standard': 1.0, 'priority': 4.0, 'bulk': 0.25})
+
 
 # REST Framework settings
 REST_FRAMEWORK = {
@@ -21,6 +21,7 @@ from django.conf.urls.static import static
 from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
+from detection.views import ModelReadinessView
 
 
 schema_view = get_schema_view(
@@ -37,6 +38,7 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/predict/', include('detection.urls')),  # or direct to view
     path('api/users/', include('users.urls')),
+    path('health/ready', ModelReadinessView.as_view(), name='health_ready'),
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
 ]
 
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_userprofile_avatar'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='inference_tier',
+            field=models.CharField(choices=[('standard', 'Standard'), ('priority', 'Priority'), ('bulk', 'Bulk')], default='standard', max_length=16),
+        ),
+    ]
@@ -7,6 +7,12 @@ class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
     phone_number = models.CharField(max_length=15, blank=True, null=True)
     avatar = models.ImageField(upload_to='avatars/', null=True, blank=True)
+    # Share of the inference scheduler, weighted by PREDICTION_TIER_WEIGHTS
+    inference_tier = models.CharField(
+        max_length=16,
+        choices=[('standard', 'Standard'), ('priority', 'Priority'), ('bulk', 'Bulk')],
+        default='standard',
+    )
 
     def __str__(self):
         return self.user.username